@@ -2,6 +2,8 @@
 ASGI config for Stocker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The live dashboard stream (main.live) is only served under ASGI, e.g.
+``uvicorn Stocker.asgi:application`` with a single worker process.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.RequestMetricsMiddleware',
+    'main.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,9 +82,107 @@ WSGI_APPLICATION = 'Stocker.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # STOCKER_DB points manage.py at another file, e.g. a seeded benchmark database.
+        'NAME': os.environ.get('STOCKER_DB', BASE_DIR / 'db.sqlite3'),
+        # A file-backed test database lets the concurrency tests open one
+        # connection per thread, which an in-memory database cannot do. The
+        # pid keeps concurrent runs (CI jobs, two checkouts) from sharing it.
+        'TEST': {
+            'NAME': os.path.join(tempfile.gettempdir(), f'stocker_test_{os.getpid()}.sqlite3'),
+        },
+    }
+}
+
+# STOCKER_DB_PROFILE=production tunes SQLite for several concurrent workers:
+# WAL so readers never wait for a writer, the pragmas below (applied to every
+# new connection in main/signals.py), persistent connections, and BEGIN
+# IMMEDIATE transactions so a writer queues on the busy timeout up front
+# instead of failing with "database is locked" when upgrading a read lock.
+# `manage.py benchmark_concurrency` compares the profiles.
+DB_PROFILE = os.environ.get("STOCKER_DB_PROFILE", "default")
+SQLITE_PRAGMAS = {}
+if DB_PROFILE == "production":
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # negative = KiB, i.e. 64 MiB per connection
+        'temp_store': 'MEMORY',
     }
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get("DB_CONN_MAX_AGE", "600")),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    })
+elif DB_PROFILE != "default":
+    raise ValueError(f"Unknown STOCKER_DB_PROFILE {DB_PROFILE!r}; use 'default' or 'production'.")
+
+# Read replica. The dashboard, list, detail and report views read from
+# 'replica'; writes, select_for_update and reads inside a transaction use
+# 'default' (see main/routers.py). Without STOCKER_REPLICA_DB the replica is
+# a second connection to the same file, e.g. to try the routing locally.
+# After a write the browser reads from 'default' for REPLICA_LAG_SECONDS so
+# it sees its own changes; set it above the replication lag.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('STOCKER_REPLICA_DB', DATABASES['default']['NAME']),
+    'TEST': {'MIRROR': 'default'},
 }
+DATABASE_ROUTERS = ['main.routers.ReplicaRouter']
+REPLICA_LAG_SECONDS = int(os.environ.get("REPLICA_LAG_SECONDS", "5"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The dashboard snapshot and its hit/miss counters live here. Use a shared
+# backend (Redis, Memcached, database) when running several worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stocker',
+    }
+}
+
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get("DASHBOARD_CACHE_TIMEOUT", "300"))
+
+# Rendered totals and tables of list and report pages (see main/fragments.py).
+# Keys carry the inventory version, so this only bounds how long unused
+# fragments occupy the cache.
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get("FRAGMENT_CACHE_TIMEOUT", "3600"))
+
+# Stock valuations (see main/valuation.py), cached per inventory version and period.
+VALUATION_CACHE_TIMEOUT = int(os.environ.get("VALUATION_CACHE_TIMEOUT", "3600"))
+
+# Demand forecasting (manage.py forecast_demand, see main/forecasting.py):
+# days of sales history, supplier lead time and order cycle in days, and the
+# safety stock in standard deviations of daily demand (1.65 ~ 95% service).
+FORECAST_WINDOW_DAYS = int(os.environ.get("FORECAST_WINDOW_DAYS", "90"))
+FORECAST_LEAD_TIME_DAYS = int(os.environ.get("FORECAST_LEAD_TIME_DAYS", "7"))
+FORECAST_ORDER_CYCLE_DAYS = int(os.environ.get("FORECAST_ORDER_CYCLE_DAYS", "14"))
+FORECAST_SERVICE_FACTOR = float(os.environ.get("FORECAST_SERVICE_FACTOR", "1.65"))
+
+# Live dashboard over Server-Sent Events (see main/live.py; served under
+# ASGI only). Changes are batched for LIVE_COALESCE_SECONDS, the last
+# LIVE_HISTORY events are kept for reconnecting clients, and a client more
+# than LIVE_CLIENT_QUEUE_SIZE events behind is told to reload.
+LIVE_COALESCE_SECONDS = float(os.environ.get("LIVE_COALESCE_SECONDS", "0.25"))
+LIVE_HEARTBEAT_SECONDS = int(os.environ.get("LIVE_HEARTBEAT_SECONDS", "15"))
+LIVE_HISTORY = int(os.environ.get("LIVE_HISTORY", "256"))
+LIVE_CLIENT_QUEUE_SIZE = int(os.environ.get("LIVE_CLIENT_QUEUE_SIZE", "64"))
+
+# Per-request timing and query counts (see main/middleware.py). Samples are
+# kept in REQUEST_METRICS_CACHE; point it at a shared backend to aggregate
+# several worker processes.
+REQUEST_METRICS_ENABLED = os.environ.get("REQUEST_METRICS_ENABLED", "") == "1"
+REQUEST_METRICS_CACHE = "default"
+REQUEST_METRICS_SAMPLES = int(os.environ.get("REQUEST_METRICS_SAMPLES", "1000"))
+REQUEST_METRICS_SLOW_MS = int(os.environ.get("REQUEST_METRICS_SLOW_MS", "500"))
+REQUEST_METRICS_SLOW_QUERIES = int(os.environ.get("REQUEST_METRICS_SLOW_QUERIES", "50"))
+
+# List pages switch from numbered pages to cursor pagination past this many rows.
+KEYSET_PAGINATION_THRESHOLD = int(os.environ.get("KEYSET_PAGINATION_THRESHOLD", "100000"))
 
 
 # Password validation
@@ -129,6 +230,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL =  '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Product image thumbnails are rendered after the product is saved on a small
+# thread pool; `manage.py build_renditions` backfills existing images. Django
+# serves /renditions/ only for development: in production the web server
+# should answer it from MEDIA_ROOT/renditions with a long immutable max-age.
+IMAGE_RENDITIONS_ASYNC = os.environ.get("IMAGE_RENDITIONS_ASYNC", "1") == "1"
+IMAGE_RENDITION_WORKERS = int(os.environ.get("IMAGE_RENDITION_WORKERS", "2"))
+
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -142,3 +250,8 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 MANAGER_EMAIL = os.environ.get("MANAGER_EMAIL", "manager@example.com")
 EXPIRY_ALERT_DAYS = int(os.environ.get("EXPIRY_ALERT_DAYS", "7"))
+
+# Alerts are queued in the outbox and delivered by `manage.py send_queued_emails`.
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("EMAIL_OUTBOX_MAX_ATTEMPTS", "5"))
+EMAIL_OUTBOX_RETRY_SECONDS = int(os.environ.get("EMAIL_OUTBOX_RETRY_SECONDS", "60"))
+EMAIL_OUTBOX_CLAIM_SECONDS = int(os.environ.get("EMAIL_OUTBOX_CLAIM_SECONDS", "600"))
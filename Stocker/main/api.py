@@ -0,0 +1,363 @@
+import json
+from contextlib import nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+
+from .forms import StockWithdrawalForm, ProductWithdrawalForm
+from .importers import StockEntryImporter
+from .models import ApiToken, Supplier, Product, StockEntry, StockWithdrawal
+from .notifications import scan_alerts
+from .pagination import KeysetPaginator, InvalidCursor
+from .routers import replica_reads
+from .search import search_products, search_suppliers
+from .services import withdraw_from_entry, withdraw_from_product, InsufficientStock, FEFO
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class ApiError(Exception):
+
+	def __init__(self, status, message, **extra):
+		super().__init__(message)
+		self.status = status
+		self.message = message
+		self.extra = extra
+
+
+def api_view(methods, permissions=()):
+	"""
+	JSON endpoint decorator: authenticates the session or an
+	``Authorization: Token <key>`` header, checks ``permissions`` (the same
+	codes the HTML views require) and renders the view's ``(data, status)``
+	or an :class:`ApiError` as JSON. Session-authenticated writes still need
+	a CSRF token; token requests carry no cookies and skip it. Reads run on
+	the replica.
+	"""
+	def decorator(view):
+		@csrf_exempt
+		@wraps(view)
+		def wrapper(request, *args, **kwargs):
+			try:
+				if request.method not in methods:
+					raise ApiError(405, f"Method {request.method} not allowed.")
+				_authenticate(request)
+				if not request.user.has_perms(permissions):
+					raise ApiError(403, "You do not have permission to perform this action.")
+				with replica_reads() if request.method in SAFE_METHODS else nullcontext():
+					data, status = view(request, *args, **kwargs)
+			except ApiError as e:
+				data, status = {"error": e.message, **e.extra}, e.status
+			return JsonResponse(data, status=status, encoder=DjangoJSONEncoder)
+		return wrapper
+	return decorator
+
+
+def _authenticate(request):
+	header = request.headers.get("Authorization", "")
+	if header.startswith("Token "):
+		user = ApiToken.authenticate(header[len("Token "):].strip())
+		if user is None:
+			raise ApiError(401, "Invalid token.")
+		request.user = user
+		return
+	if not request.user.is_authenticated:
+		raise ApiError(401, "Authentication credentials were not provided.")
+	if request.method not in SAFE_METHODS and CsrfViewMiddleware(lambda r: None).process_view(request, None, (), {}):
+		raise ApiError(403, "CSRF check failed.")
+
+
+class Resource:
+	"""
+	A read-only listing of ``model``: ``fields`` maps each output name to a
+	model field (None) or an expression; ``filters`` maps query parameters to
+	lookups; ``search`` is the search helper used for ``?search=``.
+	"""
+
+	def __init__(self, model, fields, filters=None, search=None):
+		self.model = model
+		self.fields = fields
+		self.filters = filters or {}
+		self.search = search
+
+	def queryset(self, request):
+		queryset = self.model.objects.all()
+		try:
+			for param, lookup in self.filters.items():
+				if param in request.GET:
+					queryset = queryset.filter(**{lookup: request.GET[param]})
+		except (ValueError, ValidationError) as e:
+			raise ApiError(400, f"Invalid filter: {e}")
+		if self.search and request.GET.get("search"):
+			queryset = self.search(queryset, request.GET["search"])
+		return queryset
+
+	def field_names(self, request):
+		"""``?fields=a,b`` (sparse fieldset) or every field."""
+		if not request.GET.get("fields"):
+			return list(self.fields)
+		names = [name.strip() for name in request.GET["fields"].split(",") if name.strip()]
+		unknown = [name for name in names if name not in self.fields]
+		if unknown:
+			raise ApiError(400, f"Unknown field(s): {', '.join(unknown)}.", fields=list(self.fields))
+		return names
+
+	def values(self, queryset, names):
+		# Only the requested columns are selected, and only requested expressions joined.
+		plain = [name for name in names if self.fields[name] is None]
+		expressions = {name: self.fields[name] for name in names if self.fields[name] is not None}
+		return queryset.values(*plain, **expressions)
+
+
+PRODUCTS = Resource(
+	Product,
+	{
+		"id": None,
+		"sku": None,
+		"name": None,
+		"category_id": None,
+		"category_name": F("category__name"),
+		"reorder_level": None,
+		"on_hand": Coalesce("stock_level__on_hand", 0),
+		"description": None,
+		"created_at": None,
+	},
+	filters={"category": "category_id", "sku": "sku"},
+	search=search_products,
+)
+SUPPLIERS = Resource(
+	Supplier,
+	{"id": None, "name": None, "email": None, "mobile": None, "description": None, "created_at": None},
+	search=search_suppliers,
+)
+STOCK_ENTRIES = Resource(
+	StockEntry,
+	{
+		"id": None,
+		"product_id": None,
+		"sku": F("product__sku"),
+		"supplier_id": None,
+		"quantity": None,
+		"initial_quantity": None,
+		"unit_cost": None,
+		"expiry_date": None,
+		"received_at": None,
+		"description": None,
+		"created_at": None,
+	},
+	filters={"product": "product_id", "supplier": "supplier_id", "expires_before": "expiry_date__lte", "since": "created_at__gte"},
+)
+WITHDRAWALS = Resource(
+	StockWithdrawal,
+	{
+		"id": None,
+		"product_id": None,
+		"stock_entry_id": None,
+		"supplier_id": F("stock_entry__supplier_id"),
+		"quantity": None,
+		"reason": None,
+		"note": None,
+		"created_at": None,
+	},
+	filters={"product": "product_id", "stock_entry": "stock_entry_id", "reason": "reason", "since": "created_at__gte"},
+)
+
+
+def list_view(resource):
+	"""
+	``GET`` a cursor-paginated page of ``resource`` in id order, so a client
+	can page through (or resume syncing) a table of any size: ``?limit=``,
+	``?cursor=`` from the previous page's ``next``, ``?fields=``, filters.
+	"""
+	@api_view(["GET"])
+	def view(request):
+		names = resource.field_names(request)
+		try:
+			limit = min(int(request.GET.get("limit", API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+		except ValueError:
+			raise ApiError(400, "limit must be an integer.")
+		if limit < 1:
+			raise ApiError(400, "limit must be at least 1.")
+		# The cursor is built from the id, which is selected even when not requested.
+		rows = resource.values(resource.queryset(request), names + ["id"] if "id" not in names else names)
+		try:
+			page = KeysetPaginator(rows, limit, ["id"]).get_page(request.GET.get("cursor"))
+		except InvalidCursor:
+			raise ApiError(400, "Invalid cursor.")
+		return {
+			"results": [{name: row[name] for name in names} for row in page],
+			"next": page.next_cursor,
+			"previous": page.previous_cursor,
+		}, 200
+	return view
+
+
+def detail_view(resource):
+	@api_view(["GET"])
+	def view(request, pk):
+		names = resource.field_names(request)
+		row = resource.values(resource.model.objects.filter(pk=pk), names).first()
+		if row is None:
+			raise ApiError(404, "Not found.")
+		return row, 200
+	return view
+
+
+products_list = list_view(PRODUCTS)
+product_detail = detail_view(PRODUCTS)
+suppliers_list = list_view(SUPPLIERS)
+supplier_detail = detail_view(SUPPLIERS)
+stock_entries_list = list_view(STOCK_ENTRIES)
+stock_entry_detail = detail_view(STOCK_ENTRIES)
+withdrawals_list = list_view(WITHDRAWALS)
+withdrawal_detail = detail_view(WITHDRAWALS)
+
+
+def _batch_items(request):
+	"""``{"items": [...], "all_or_nothing": false}`` or a bare list of items."""
+	try:
+		body = json.loads(request.body or b"null")
+	except ValueError:
+		raise ApiError(400, "Request body must be JSON.")
+	all_or_nothing = False
+	if isinstance(body, dict):
+		all_or_nothing = bool(body.get("all_or_nothing", False))
+		body = body.get("items")
+	if not isinstance(body, list) or not all(isinstance(item, dict) for item in body):
+		raise ApiError(400, "Expected a list of objects in \"items\".")
+	limit = getattr(settings, "API_BATCH_LIMIT", 1000)
+	if len(body) > limit:
+		raise ApiError(400, f"At most {limit} items per batch.")
+	return body, all_or_nothing
+
+
+def _batch_response(results, committed):
+	failed = sum(1 for result in results if result["status"] == "error")
+	return {
+		"committed": committed,
+		"created": len(results) - failed if committed else 0,
+		"failed": failed,
+		"results": results,
+	}, 200 if committed else 400
+
+
+@api_view(["POST"], permissions=["main.add_stockentry"])
+def stock_entries_batch(request):
+	"""
+	Receive stock: each item has the CSV import columns (``sku``,
+	``supplier`` name, ``quantity``, ``unit_cost``, ``expiry_date``,
+	``received_at``, ``description``); ``product_id`` / ``supplier_id`` may
+	replace ``sku`` / ``supplier``. Valid items are written together with one
+	``bulk_create``; with ``all_or_nothing`` one invalid item rejects all.
+	"""
+	items, all_or_nothing = _batch_items(request)
+	importer = StockEntryImporter()
+	importer.prepare()
+	skus = {pk: sku for sku, pk in importer.products.items()}
+	supplier_names = {pk: name for name, pk in importer.suppliers.items()}
+
+	results, entries = [], []
+	for index, item in enumerate(items):
+		row = {key: "" if value is None else str(value) for key, value in item.items()}
+		if "sku" not in row and "product_id" in row:
+			row["sku"] = skus.get(_int(row["product_id"]), f"#{row['product_id']}")
+		if "supplier" not in row and "supplier_id" in row:
+			row["supplier"] = supplier_names.get(_int(row["supplier_id"]), f"#{row['supplier_id']}")
+		row.setdefault("sku", "")
+		row.setdefault("supplier", "")
+		try:
+			entries.append(importer.parse(row))
+		except ValidationError as e:
+			results.append({"index": index, "status": "error", "errors": e.messages})
+			continue
+		results.append({"index": index, "status": "created"})
+
+	if all_or_nothing and len(entries) < len(items):
+		return _batch_response(results, committed=False)
+	if entries:
+		with transaction.atomic():
+			importer.write(entries)
+		importer.finish()
+	created = iter(entries)
+	for result in results:
+		if result["status"] == "created":
+			result["id"] = next(created).pk
+	return _batch_response(results, committed=True)
+
+
+@api_view(["POST"], permissions=["main.add_stockwithdrawal", "main.change_stockentry"])
+def withdrawals_batch(request):
+	"""
+	Withdraw stock: each item names a ``stock_entry_id`` or a product
+	(``sku`` or ``product_id``, allocated by ``strategy``) with ``quantity``,
+	``reason`` and ``note``. The batch is one transaction with a savepoint
+	per item, so a failing item (e.g. not enough stock) leaves the others
+	applied, unless ``all_or_nothing`` is set.
+	"""
+	items, all_or_nothing = _batch_items(request)
+	products = Product.objects.in_bulk([str(item["sku"]) for item in items if item.get("sku")], field_name="sku")
+	products.update(Product.objects.in_bulk([_int(item["product_id"]) for item in items if "product_id" in item]))
+	entries = StockEntry.objects.in_bulk([_int(item["stock_entry_id"]) for item in items if "stock_entry_id" in item])
+
+	results, product_ids = [], set()
+	with transaction.atomic():
+		for index, item in enumerate(items):
+			try:
+				withdrawals = _withdraw(item, products, entries)
+			except ValidationError as e:
+				results.append({"index": index, "status": "error", "errors": e.messages})
+				continue
+			except InsufficientStock as e:
+				results.append({"index": index, "status": "error", "errors": [str(e)]})
+				continue
+			product_ids.add(withdrawals[0].product_id)
+			results.append({
+				"index": index,
+				"status": "created",
+				"withdrawals": [{"id": w.pk, "stock_entry_id": w.stock_entry_id, "quantity": w.quantity} for w in withdrawals],
+			})
+		committed = not (all_or_nothing and any(result["status"] == "error" for result in results))
+		if not committed:
+			transaction.set_rollback(True)
+	if committed and product_ids:
+		scan_alerts(product_ids=sorted(product_ids))
+	return _batch_response(results, committed)
+
+
+def _withdraw(item, products, entries):
+	data = {"quantity": item.get("quantity"), "reason": item.get("reason", "SALE"), "note": item.get("note", ""), "strategy": item.get("strategy", FEFO)}
+	if "stock_entry_id" in item:
+		entry = entries.get(_int(item["stock_entry_id"]))
+		if entry is None:
+			raise ValidationError(f"stock_entry_id: no stock entry {item['stock_entry_id']!r}.")
+		form = StockWithdrawalForm(data)
+	else:
+		product = products.get(str(item["sku"])) if item.get("sku") else products.get(_int(item.get("product_id")))
+		if product is None:
+			raise ValidationError("sku: no such product." if item.get("sku") else "product_id: no such product.")
+		form = ProductWithdrawalForm(data)
+	if not form.is_valid():
+		raise ValidationError([f"{field}: {' '.join(errors)}" for field, errors in form.errors.items()])
+	values = form.cleaned_data
+	if values["quantity"] <= 0:
+		raise ValidationError("quantity: must be at least 1.")
+	if "stock_entry_id" in item:
+		return [withdraw_from_entry(entry, values["quantity"], reason=values["reason"], note=values["note"])]
+	return withdraw_from_product(product, values["quantity"], reason=values["reason"], note=values["note"], strategy=values["strategy"])
+
+
+def _int(value):
+	try:
+		return int(value)
+	except (TypeError, ValueError):
+		return None
@@ -0,0 +1,165 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Sum, F
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils import dateformat, timezone
+
+from .models import Category, Supplier, Product, StockEntry, StockWithdrawal, StockLevel
+from .versioning import inventory_version, settled
+
+SNAPSHOT_KEY = "main:dashboard:snapshot:{}"
+LOCK_KEY = "main:dashboard:lock:{}"
+HITS_KEY = "main:dashboard:hits"
+MISSES_KEY = "main:dashboard:misses"
+# Products looked up per query for low-stock transitions (bounds the IN list).
+LIVE_PRODUCT_CHUNK_SIZE = 500
+
+
+RECENT_ROWS = 5
+
+# The dashboard's headline figures, each from one query; ``using`` is the
+# database alias (None routes as usual).
+TOTALS = {
+	'total_products': lambda using: Product.objects.db_manager(using).count(),
+	'total_categories': lambda using: Category.objects.db_manager(using).count(),
+	'total_suppliers': lambda using: Supplier.objects.db_manager(using).count(),
+	'total_stock_qty': lambda using: StockLevel.objects.db_manager(using).aggregate(total=Sum('on_hand'))['total'] or 0,
+	'low_stock_count': lambda using: Product.objects.db_manager(using).annotate(qty=Coalesce('stock_level__on_hand', 0)).filter(qty__lt=F('reorder_level')).count(),
+}
+
+
+def build_dashboard_snapshot():
+	return {
+		**{name: total(None) for name, total in TOTALS.items()},
+		'recent_entries': list(StockEntry.objects.select_related('product','supplier').order_by('-created_at')[:RECENT_ROWS]),
+		'recent_withdrawals': list(StockWithdrawal.objects.select_related('product','stock_entry__supplier').order_by('-created_at')[:RECENT_ROWS]),
+		'top_categories': list(Category.objects.annotate(qty=Sum('product__stock_level__on_hand', default=0)).order_by('-qty')[:5]),
+		'top_suppliers': list(Supplier.objects.annotate(qty=Sum('stockentry__quantity', default=0)).order_by('-qty')[:5]),
+	}
+
+
+def live_events(entry_ids, withdrawal_ids, stock, totals):
+	"""
+	``(event, data)`` pairs for the live dashboards (see main.live) from the
+	changes committed since the last batch: the newest of the new entries and
+	withdrawals, oldest first; the products whose stock crossed their reorder
+	level (``stock`` maps product id to its net change); and the current value
+	of the totals they affect. Read from the primary, which has the writes.
+	Every event states a value rather than a change, so replaying one is
+	harmless.
+	"""
+	using = router.db_for_write(Product)
+	events = []
+	if entry_ids:
+		newest = sorted(entry_ids)[-RECENT_ROWS:]
+		for entry in StockEntry.objects.using(using).filter(pk__in=newest).select_related('product', 'supplier').order_by('created_at', 'pk'):
+			events.append(("entry", {
+				'id': entry.pk,
+				'product': entry.product.name,
+				'supplier': entry.supplier.name,
+				'quantity': entry.quantity,
+				'unit_cost': str(entry.unit_cost),
+				'received_at': _format_time(entry.received_at),
+				'withdraw_url': reverse('main:withdraw_stock_entry', args=[entry.pk]),
+			}))
+	if withdrawal_ids:
+		newest = sorted(withdrawal_ids)[-RECENT_ROWS:]
+		for withdrawal in StockWithdrawal.objects.using(using).filter(pk__in=newest).select_related('product', 'stock_entry__supplier').order_by('created_at', 'pk'):
+			events.append(("withdrawal", {
+				'id': withdrawal.pk,
+				'product': withdrawal.product.name,
+				'supplier': withdrawal.stock_entry.supplier.name,
+				'quantity': withdrawal.quantity,
+				'reason': withdrawal.get_reason_display(),
+				'created_at': _format_time(withdrawal.created_at),
+			}))
+
+	names = set(totals)
+	changed = [product_id for product_id, delta in stock.items() if delta]
+	if changed:
+		names.update(('total_stock_qty', 'low_stock_count'))
+	for i in range(0, len(changed), LIVE_PRODUCT_CHUNK_SIZE):
+		products = Product.objects.using(using).filter(pk__in=changed[i:i + LIVE_PRODUCT_CHUNK_SIZE]).annotate(on_hand=Coalesce('stock_level__on_hand', 0))
+		for pk, sku, name, reorder_level, on_hand in products.values_list('pk', 'sku', 'name', 'reorder_level', 'on_hand'):
+			low = on_hand < reorder_level
+			if (on_hand - stock[pk] < reorder_level) != low:
+				events.append(("low_stock", {'id': pk, 'sku': sku, 'name': name, 'on_hand': on_hand, 'reorder_level': reorder_level, 'low': low}))
+	if names:
+		events.append(("totals", {name: TOTALS[name](using) for name in TOTALS if name in names}))
+	return events
+
+
+def get_dashboard_snapshot():
+	"""
+	Return the cached dashboard snapshot, rebuilding it at most once per
+	invalidation: the first request to miss takes the lock and rebuilds, the
+	others wait for its result instead of running the aggregates themselves.
+	Returns a ``(snapshot, hit)`` tuple.
+	"""
+	version = _current_version()
+	key = SNAPSHOT_KEY.format(version)
+	snapshot = cache.get(key)
+	if snapshot is not None:
+		_count(HITS_KEY)
+		return snapshot, True
+
+	_count(MISSES_KEY)
+	if not settled([version]):
+		# The replica may not show the latest write yet; don't cache it.
+		return build_dashboard_snapshot(), False
+	timeout = getattr(settings, "DASHBOARD_CACHE_TIMEOUT", 300)
+	lock_timeout = getattr(settings, "DASHBOARD_LOCK_TIMEOUT", 30)
+	lock_key = LOCK_KEY.format(version)
+	if cache.add(lock_key, 1, lock_timeout):
+		try:
+			snapshot = build_dashboard_snapshot()
+			cache.set(key, snapshot, timeout)
+		finally:
+			cache.delete(lock_key)
+		return snapshot, False
+
+	deadline = time.monotonic() + getattr(settings, "DASHBOARD_LOCK_WAIT", 5)
+	while time.monotonic() < deadline:
+		time.sleep(0.05)
+		snapshot = cache.get(key)
+		if snapshot is not None:
+			return snapshot, False
+	return build_dashboard_snapshot(), False
+
+
+def dashboard_cache_stats():
+	hits = cache.get(HITS_KEY, 0)
+	misses = cache.get(MISSES_KEY, 0)
+	total = hits + misses
+	return {
+		'hits': hits,
+		'misses': misses,
+		'hit_rate': hits / total if total else 0.0,
+		'version': _current_version(),
+	}
+
+
+def reset_dashboard_cache_stats():
+	cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def _current_version():
+	# The snapshot is keyed on the inventory-wide version shared with the
+	# conditional GET handling of the list pages (see main.versioning).
+	return inventory_version()
+
+
+def _count(key):
+	try:
+		cache.incr(key)
+	except ValueError:
+		if not cache.add(key, 1, None):
+			cache.incr(key)
+
+
+def _format_time(value):
+	return dateformat.format(timezone.localtime(value), "Y-m-d H:i") if value else ""
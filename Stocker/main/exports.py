@@ -0,0 +1,31 @@
+import csv
+
+from django.http import StreamingHttpResponse
+
+# Rows fetched per database round trip while streaming an export.
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+	"""File-like object whose ``write`` hands the formatted line back to the caller."""
+
+	def write(self, value):
+		return value
+
+
+def stream_csv(filename, header, rows):
+	"""
+	Stream ``rows`` (any iterable of tuples, typically
+	``values_list(...).iterator()``) as a CSV attachment. Lines are produced
+	one at a time, so memory use does not depend on the number of rows.
+	"""
+	writer = csv.writer(Echo())
+
+	def lines():
+		yield writer.writerow(header)
+		for row in rows:
+			yield writer.writerow(row)
+
+	response = StreamingHttpResponse(lines(), content_type="text/csv")
+	response["Content-Disposition"] = f'attachment; filename="{filename}"'
+	return response
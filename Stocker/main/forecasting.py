@@ -0,0 +1,95 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import ProductForecast, StockLevel, StockMovementDaily
+
+# Daily sales per product over the window, zero days included: the mean and
+# the sample variance come from the sum and the sum of squares of the days
+# that had sales, over the days the product was stocked (from its first
+# receipt, at most the whole window; counted in Python, date arithmetic
+# differs per backend).
+DEMAND_SQL = """
+WITH daily AS (
+	SELECT product_id, SUM(out_qty) AS q
+	-- The window covers much of the table: one scan beats a row lookup per index entry.
+	FROM {movements} {not_indexed}
+	WHERE reason = %(sale)s AND date >= %(first)s AND date <= %(last)s
+	GROUP BY product_id, date
+),
+sales AS (
+	SELECT product_id, SUM(q) AS total, SUM(q * q) AS squares FROM daily GROUP BY product_id HAVING SUM(q) > 0
+)
+SELECT s.product_id, s.total, s.squares, COALESCE(l.on_hand, 0), MIN(m.date)
+FROM sales s
+JOIN {movements} m ON m.product_id = s.product_id AND m.reason = %(receipt)s
+LEFT JOIN {levels} l ON l.product_id = s.product_id
+GROUP BY s.product_id, s.total, s.squares, l.on_hand
+"""
+# NOT INDEXED is SQLite's; other planners pick the scan on their own.
+NOT_INDEXED = {"sqlite": "NOT INDEXED"}
+
+
+def forecast_demand(today=None, window_days=None):
+	"""
+	Unsaved :class:`~main.models.ProductForecast` rows for every product sold
+	(withdrawals with reason SALE) in the ``window_days`` full days before
+	``today``, aggregated from the daily rollups for the whole catalog in one
+	query.
+
+	The suggested reorder level covers the demand over the supplier lead time
+	plus safety stock against its variability (``FORECAST_SERVICE_FACTOR``
+	standard deviations); the order quantity tops the stock up to the reorder
+	level plus one order cycle of demand.
+	"""
+	today = today or timezone.localdate()
+	window_days = window_days or getattr(settings, "FORECAST_WINDOW_DAYS", 90)
+	lead_time = getattr(settings, "FORECAST_LEAD_TIME_DAYS", 7)
+	cycle = getattr(settings, "FORECAST_ORDER_CYCLE_DAYS", 14)
+	service_factor = getattr(settings, "FORECAST_SERVICE_FACTOR", 1.65)
+
+	connection = connections[router.db_for_read(StockMovementDaily)]
+	sql = DEMAND_SQL.format(
+		movements=StockMovementDaily._meta.db_table,
+		levels=StockLevel._meta.db_table,
+		not_indexed=NOT_INDEXED.get(connection.vendor, ""),
+	)
+	first, last = today - timedelta(days=window_days), today - timedelta(days=1)
+	params = {
+		"sale": "SALE",
+		"receipt": StockMovementDaily.RECEIPT,
+		"first": connection.ops.adapt_datefield_value(first),
+		"last": connection.ops.adapt_datefield_value(last),
+	}
+	with connection.cursor() as cursor:
+		cursor.execute(sql, params)
+		rows = cursor.fetchall()
+
+	now = timezone.now()
+	forecasts = []
+	for product_id, total, squares, on_hand, stocked_since in rows:
+		# A raw cursor on SQLite returns dates as ISO strings.
+		if isinstance(stocked_since, str):
+			stocked_since = parse_date(stocked_since)
+		days = max(1, (last - max(first, stocked_since)).days + 1)
+		total, squares = float(total), float(squares)
+		demand = total / days
+		variance = max(0, (squares - total * total / days) / (days - 1)) if days > 1 else 0
+		std = math.sqrt(variance)
+		reorder_level = math.ceil(demand * lead_time + service_factor * std * math.sqrt(lead_time))
+		forecasts.append(ProductForecast(
+			product_id=product_id,
+			computed_at=now,
+			window_days=days,
+			daily_demand=demand,
+			demand_std=std,
+			on_hand=on_hand,
+			days_of_cover=max(on_hand, 0) / demand,
+			reorder_level=reorder_level,
+			order_quantity=max(0, math.ceil(reorder_level + demand * cycle - on_hand)),
+		))
+	return forecasts
@@ -1,5 +1,7 @@
 from django import forms
 from .models import Category, Supplier, Product, StockEntry, StockWithdrawal
+from .renditions import schedule_renditions
+from .services import ALLOCATION_STRATEGIES
 
 class CategoryForm(forms.ModelForm):
     class Meta:
@@ -13,6 +15,16 @@ class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
         fields = "__all__"
+
+    def save(self, commit=True):
+        image_changed = "image" in self.changed_data
+        if image_changed:
+            # Serve the new original until its renditions are built.
+            self.instance.image_hash = ""
+        product = super().save(commit)
+        if commit and (image_changed or not product.image_hash):
+            schedule_renditions(product.pk)
+        return product
 class StockEntryForm(forms.ModelForm):
     class Meta:
         model = StockEntry
@@ -21,3 +33,5 @@ class StockWithdrawalForm(forms.ModelForm):
     class Meta:
         model = StockWithdrawal
         fields = ['quantity', 'reason', 'note']
+class ProductWithdrawalForm(StockWithdrawalForm):
+    strategy = forms.ChoiceField(choices=ALLOCATION_STRATEGIES)
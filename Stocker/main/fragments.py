@@ -0,0 +1,46 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .versioning import inventory_version, settled
+
+FRAGMENT_KEY = "main:fragment:{}:{}:{}:{}"
+# The query parameters list and report pages filter, sort and page by.
+FILTER_PARAMS = ("search", "start", "end", "as_of", "order_by", "page", "cursor")
+
+
+class TableFragments:
+	"""
+	Cached HTML of the data-driven parts of a list or report page (``parts``,
+	e.g. the total and the table with its pagination), rendered by
+	``{% cached_fragment fragments "table" %}``.
+
+	Keys combine the page ``name``, the filter parameters of the request,
+	which of ``perms`` the user holds (rows show edit/delete links by
+	permission) and the inventory version: any write moves the version, so
+	fragments are never invalidated one by one. When :attr:`complete`, the
+	view can skip its queries altogether.
+	"""
+
+	def __init__(self, request, name, parts=("total", "table"), perms=()):
+		version = inventory_version()
+		params = [(param, request.GET.getlist(param)) for param in FILTER_PARAMS if param in request.GET]
+		granted = [perm for perm in perms if request.user.has_perm(perm)]
+		digest = hashlib.blake2b(json.dumps([params, granted]).encode(), digest_size=12).hexdigest()
+		self.keys = {part: FRAGMENT_KEY.format(name, version, digest, part) for part in parts}
+		# A lagging replica may not show the latest write yet: don't cache under its version.
+		self.enabled = settled([version])
+		self.found = cache.get_many(list(self.keys.values())) if self.enabled else {}
+
+	@property
+	def complete(self):
+		return len(self.found) == len(self.keys)
+
+	def get(self, part):
+		return self.found.get(self.keys[part])
+
+	def store(self, part, html):
+		if self.enabled:
+			cache.set(self.keys[part], html, getattr(settings, "FRAGMENT_CACHE_TIMEOUT", 3600))
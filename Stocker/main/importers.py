@@ -0,0 +1,327 @@
+import csv
+import io
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .live import entries_received, totals_changed
+from .models import Category, Supplier, Product, StockEntry, StockLevel, StockMovementDaily
+from .notifications import scan_alerts
+from .versioning import bump_versions
+
+IMPORT_BATCH_SIZE = 500
+
+
+class ImportResult:
+	"""
+	Outcome of one import: rows written and a ``(line, message)`` pair per
+	rejected row. ``stopped`` says why a file could not be read to the end
+	(not UTF-8, malformed CSV).
+	"""
+
+	def __init__(self):
+		self.created = 0
+		self.errors = []
+		self.stopped = None
+
+	def error(self, line, message):
+		self.errors.append((line, message))
+
+
+class _Importer:
+	"""
+	Shared import loop: rows are read one at a time, validated against
+	lookup maps built once per file, and written ``batch_size`` rows per
+	transaction with ``bulk_create``. Subclasses describe one model.
+	"""
+
+	model = None
+	required = ()
+	# Dashboard totals a successful import changes (see main.live).
+	totals = ()
+
+	def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+		self.batch_size = batch_size
+		self.product_ids = set()
+		self.supplier_ids = set()
+
+	def run(self, stream):
+		result = ImportResult()
+		if stream.seekable():
+			# Read the whole file once before writing anything, so an
+			# unreadable file is rejected instead of half imported.
+			result.stopped = _unreadable(stream)
+			if result.stopped:
+				return result
+			stream.seek(0)
+		reader = csv.DictReader(stream)
+		try:
+			reader.fieldnames = [_column(name) for name in reader.fieldnames or []]
+		except (csv.Error, UnicodeDecodeError) as e:
+			result.stopped = _read_error(e, reader)
+			return result
+		missing = [name for name in self.required if name not in reader.fieldnames]
+		if missing:
+			result.error(1, f"Missing column(s): {', '.join(missing)}.")
+			return result
+
+		self.prepare()
+		batch = []
+		try:
+			for row in reader:
+				try:
+					batch.append((reader.line_num, self.parse({key: (value or "").strip() for key, value in row.items() if key})))
+				except ValidationError as e:
+					result.error(reader.line_num, "; ".join(e.messages))
+					continue
+				if len(batch) >= self.batch_size:
+					self._flush(batch, result)
+					batch = []
+		except (csv.Error, UnicodeDecodeError) as e:
+			# Only reached for streams that can't be read twice: the batches
+			# saved so far stay, the rows read since are dropped.
+			result.stopped = _read_error(e, reader)
+		else:
+			if batch:
+				self._flush(batch, result)
+		self.finish()
+		return result
+
+	def _flush(self, batch, result):
+		try:
+			with transaction.atomic():
+				self.write([obj for _, obj in batch])
+		except IntegrityError as e:
+			for line, _ in batch:
+				result.error(line, f"Batch not saved: {e}")
+			self.rollback([obj for _, obj in batch])
+			return
+		result.created += len(batch)
+
+	def prepare(self):
+		pass
+
+	def parse(self, row):
+		raise NotImplementedError
+
+	def write(self, objs):
+		self.model.objects.bulk_create(objs)
+
+	def rollback(self, objs):
+		"""Forget the keys a failed batch reserved in the lookup maps."""
+
+	def finish(self):
+		# The other hooks of the form save path have nothing to do here: the
+		# search indexes follow bulk inserts through their triggers (see
+		# main.search), and no import carries product images to render.
+		bump_versions(self.product_ids, self.supplier_ids)
+		if self.totals:
+			totals_changed(*self.totals)
+		if self.product_ids:
+			scan_alerts(product_ids=sorted(self.product_ids))
+
+	def clean(self, row, name):
+		"""Validate ``row[name]`` with the model field's own validators."""
+		field = self.model._meta.get_field(name)
+		value = row.get(name, "")
+		if value == "":
+			if field.null:
+				return None
+			if field.has_default():
+				return field.get_default()
+			if field.blank:
+				return ""
+			raise ValidationError(f"{name}: this field is required.")
+		try:
+			return field.clean(value, None)
+		except ValidationError as e:
+			raise ValidationError(f"{name}: {' '.join(e.messages)}")
+
+
+class ProductImporter(_Importer):
+	"""Columns: sku, name, category, reorder_level, description. Unknown categories are created."""
+
+	model = Product
+	required = ("sku", "name", "category")
+	totals = ("total_products", "total_categories", "low_stock_count")
+
+	def prepare(self):
+		self.skus = set(Product.objects.values_list("sku", flat=True))
+		self.names = set(Product.objects.values_list("name", flat=True))
+		self.categories = {category.name: category for category in Category.objects.only("id", "name")}
+		self.created_categories = []
+
+	def parse(self, row):
+		sku, name = self.clean(row, "sku"), self.clean(row, "name")
+		if sku in self.skus:
+			raise ValidationError(f"sku: a product with SKU {sku!r} already exists.")
+		if name in self.names:
+			raise ValidationError(f"name: a product named {name!r} already exists.")
+		category = self.category(row.get("category", ""))
+		self.skus.add(sku)
+		self.names.add(name)
+		return Product(
+			sku=sku,
+			name=name,
+			category=category,
+			reorder_level=self.clean(row, "reorder_level"),
+			description=self.clean(row, "description"),
+		)
+
+	def category(self, name):
+		if not name:
+			raise ValidationError("category: this field is required.")
+		if name not in self.categories:
+			try:
+				Category._meta.get_field("name").clean(name, None)
+			except ValidationError as e:
+				raise ValidationError(f"category: {' '.join(e.messages)}")
+			# Saved by the first batch using it, in that batch's transaction.
+			self.categories[name] = Category(name=name)
+		return self.categories[name]
+
+	def write(self, products):
+		self.created_categories = []
+		for category in {p.category.name: p.category for p in products if p.category.pk is None}.values():
+			category.pk = Category.objects.get_or_create(name=category.name)[0].pk
+			self.created_categories.append(category)
+		Product.objects.bulk_create(products)
+		self.product_ids.update(
+			Product.objects.filter(sku__in=[p.sku for p in products], reorder_level__gt=0).values_list("id", flat=True)
+		)
+
+	def rollback(self, products):
+		self.skus.difference_update(p.sku for p in products)
+		self.names.difference_update(p.name for p in products)
+		# Rolled back with the batch: a later batch saves them again.
+		for category in self.created_categories:
+			category.pk = None
+
+
+class SupplierImporter(_Importer):
+	"""Columns: name, mobile, email, description."""
+
+	model = Supplier
+	required = ("name",)
+	totals = ("total_suppliers",)
+
+	def prepare(self):
+		self.names = set(Supplier.objects.values_list("name", flat=True))
+
+	def parse(self, row):
+		name = self.clean(row, "name")
+		if name in self.names:
+			raise ValidationError(f"name: a supplier named {name!r} already exists.")
+		supplier = Supplier(
+			name=name,
+			mobile=self.clean(row, "mobile"),
+			email=self.clean(row, "email"),
+			description=self.clean(row, "description"),
+		)
+		self.names.add(name)
+		return supplier
+
+	def rollback(self, suppliers):
+		self.names.difference_update(s.name for s in suppliers)
+
+
+class StockEntryImporter(_Importer):
+	"""Columns: sku, supplier, quantity, unit_cost, expiry_date, received_at, description."""
+
+	model = StockEntry
+	required = ("sku", "supplier", "quantity", "unit_cost")
+
+	def prepare(self):
+		self.products = dict(Product.objects.values_list("sku", "id"))
+		self.suppliers = dict(Supplier.objects.values_list("name", "id"))
+
+	def parse(self, row):
+		product_id = self.products.get(row["sku"])
+		if product_id is None:
+			raise ValidationError(f"sku: no product with SKU {row['sku']!r}.")
+		supplier_id = self.suppliers.get(row["supplier"])
+		if supplier_id is None:
+			raise ValidationError(f"supplier: no supplier named {row['supplier']!r}.")
+		quantity = self.clean(row, "quantity")
+		if quantity < 1:
+			raise ValidationError("quantity: must be at least 1.")
+		received_at = self.clean(row, "received_at")
+		if received_at is not None and timezone.is_naive(received_at):
+			received_at = timezone.make_aware(received_at)
+		return StockEntry(
+			product_id=product_id,
+			supplier_id=supplier_id,
+			quantity=quantity,
+			initial_quantity=quantity,
+			unit_cost=self.clean(row, "unit_cost"),
+			expiry_date=self.clean(row, "expiry_date"),
+			received_at=received_at,
+			description=self.clean(row, "description"),
+		)
+
+	def write(self, entries):
+		# bulk_create skips StockEntry.save(), so the ledger and the daily
+		# rollups get one aggregated update per product / supplier instead.
+		StockEntry.objects.bulk_create(entries)
+		entries_received(entries)
+		on_hand = defaultdict(int)
+		received = defaultdict(int)
+		for entry in entries:
+			on_hand[entry.product_id] += entry.quantity
+			received[entry.product_id, entry.supplier_id] += entry.quantity
+		for product_id, quantity in on_hand.items():
+			StockLevel.adjust(product_id, quantity)
+		today = timezone.localdate()
+		StockMovementDaily.add_many({
+			(today, product_id, supplier_id, StockMovementDaily.RECEIPT): (quantity, 0)
+			for (product_id, supplier_id), quantity in received.items()
+		})
+		self.product_ids.update(on_hand)
+		self.supplier_ids.update(supplier_id for _, supplier_id in received)
+
+
+IMPORTERS = {
+	"products": ProductImporter,
+	"suppliers": SupplierImporter,
+	"stock_entries": StockEntryImporter,
+}
+
+
+def import_csv(kind, stream, batch_size=IMPORT_BATCH_SIZE):
+	"""
+	Import a CSV of ``kind`` ("products", "suppliers" or "stock_entries")
+	from a text stream. Valid rows are saved even when others are rejected;
+	stock alerts run once for every affected product after the last batch.
+	A file that can't be read (see ``ImportResult.stopped``) imports nothing,
+	unless the stream can only be read once. Returns an :class:`ImportResult`.
+	"""
+	return IMPORTERS[kind](batch_size).run(stream)
+
+
+def text_stream(binary_file, encoding="utf-8-sig"):
+	"""Wrap an uploaded (binary) file so the csv module can read it lazily."""
+	return io.TextIOWrapper(binary_file, encoding=encoding, newline="")
+
+
+def _unreadable(stream):
+	"""Why the csv module can't read ``stream`` to the end, or None."""
+	reader = csv.reader(stream)
+	try:
+		for _ in reader:
+			pass
+	except (csv.Error, UnicodeDecodeError) as e:
+		return _read_error(e, reader)
+	return None
+
+
+def _read_error(error, reader):
+	if isinstance(error, UnicodeDecodeError):
+		# Text is decoded in chunks ahead of the reader: no line to point at.
+		return "The file is not UTF-8 encoded."
+	return f"Line {reader.line_num}: malformed CSV ({error})."
+
+
+def _column(name):
+	return (name or "").strip().lower().replace(" ", "_")
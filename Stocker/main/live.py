@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Sent to a client that missed events (its queue overflowed or it resumed
+# from an id no longer in the history): it reloads the dashboard instead.
+RELOAD = b"event: reload\ndata: {}\n\n"
+KEEPALIVE = b": keepalive\n\n"
+
+
+class _Changes:
+	"""Raw changes committed since the last flush, gathered on the hub's loop."""
+
+	def __init__(self):
+		self.entry_ids = set()
+		self.withdrawal_ids = set()
+		self.stock = {}
+		self.totals = set()
+
+
+class Hub:
+	"""
+	Fans dashboard events out to the Server-Sent Events streams of this
+	process (see :func:`main.views.dashboard_events`).
+
+	Writers only hand raw ids and deltas to the hub once their transaction
+	commits (:func:`stock_adjusted`, :func:`entries_received`...). The hub
+	gathers them for ``LIVE_COALESCE_SECONDS``, turns them into events with
+	one pass over the database (:func:`main.dashboard.live_events`), encodes
+	each event once and puts it on every client's queue, so open dashboards
+	cost no queries of their own. A client that falls ``LIVE_CLIENT_QUEUE_SIZE``
+	events behind is told to reload. Recent events are kept so a reconnecting
+	client resumes from its ``Last-Event-ID``.
+
+	Apart from :meth:`notify` and the properties, everything runs on the event
+	loop of the ASGI server. Each process has its own hub: run the ASGI server
+	with one worker process (it serves any number of streams) or clients only
+	see that worker's writes.
+	"""
+
+	def __init__(self):
+		self._loop = None
+		self._clients = set()
+		self._changes = None
+		self._flushing = None
+		self._history = deque(maxlen=getattr(settings, "LIVE_HISTORY", 256))
+		# Ids restart with the process; the boot prefix tells a client it must reload.
+		self._boot = f"{time.time_ns():x}"
+		self._sequence = 0
+
+	@property
+	def listening(self):
+		return bool(self._clients)
+
+	@property
+	def last_event_id(self):
+		return f"{self._boot}-{self._sequence}"
+
+	def notify(self, kind, value):
+		"""Record a committed change; safe to call from any thread."""
+		loop = self._loop
+		if loop is None or not self._clients:
+			return
+		try:
+			loop.call_soon_threadsafe(self._collect, kind, value)
+		except RuntimeError:
+			# The loop has been closed.
+			pass
+
+	def broadcast(self, event, data):
+		"""Send ``event`` to every connected client."""
+		self._sequence += 1
+		frame = f"id: {self.last_event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+		self._history.append((self._sequence, frame))
+		for queue in self._clients:
+			try:
+				queue.put_nowait(frame)
+			except asyncio.QueueFull:
+				while not queue.empty():
+					queue.get_nowait()
+				queue.put_nowait(RELOAD)
+
+	async def stream(self, last_event_id=None):
+		"""The frames of one client, from after ``last_event_id`` on, with keepalive comments."""
+		queue = self._subscribe()
+		try:
+			yield b"retry: 5000\n\n"
+			for frame in self._backlog(last_event_id):
+				yield frame
+			heartbeat = getattr(settings, "LIVE_HEARTBEAT_SECONDS", 15)
+			while True:
+				try:
+					yield await asyncio.wait_for(queue.get(), heartbeat)
+				except asyncio.TimeoutError:
+					yield KEEPALIVE
+		finally:
+			self._clients.discard(queue)
+
+	def _subscribe(self):
+		loop = asyncio.get_running_loop()
+		if loop is not self._loop:
+			# Clients of another loop (a closed one: tests, a restarted server) can't be served anymore.
+			self._loop, self._clients, self._changes, self._flushing = loop, set(), None, None
+		queue = asyncio.Queue(maxsize=getattr(settings, "LIVE_CLIENT_QUEUE_SIZE", 64))
+		self._clients.add(queue)
+		return queue
+
+	def _backlog(self, last_event_id):
+		if not last_event_id:
+			return []
+		boot, _, sequence = last_event_id.partition("-")
+		if boot != self._boot or not sequence.isdigit() or int(sequence) > self._sequence:
+			return [RELOAD]
+		sequence = int(sequence)
+		if sequence == self._sequence:
+			return []
+		if not self._history or self._history[0][0] > sequence + 1:
+			return [RELOAD]
+		return [frame for number, frame in self._history if number > sequence]
+
+	def _collect(self, kind, value):
+		if self._changes is None:
+			self._changes = _Changes()
+			self._loop.call_later(getattr(settings, "LIVE_COALESCE_SECONDS", 0.25), self._schedule_flush)
+		changes = self._changes
+		if kind == "stock":
+			product_id, delta = value
+			changes.stock[product_id] = changes.stock.get(product_id, 0) + delta
+		else:
+			getattr(changes, kind).update(value)
+
+	def _schedule_flush(self):
+		changes, self._changes = self._changes, None
+		previous = self._flushing
+		self._flushing = asyncio.ensure_future(self._flush(changes, previous))
+
+	async def _flush(self, changes, previous):
+		# Flushes publish in the order the changes were gathered.
+		if previous is not None:
+			await asyncio.wait([previous])
+		if not self._clients:
+			return
+		from .dashboard import live_events  # The dashboard needs the models, which call into this module.
+		try:
+			events = await sync_to_async(live_events)(changes.entry_ids, changes.withdrawal_ids, changes.stock, changes.totals)
+		except Exception:
+			logger.exception("Could not build live dashboard events")
+			events = [("reload", {})]
+		for event, data in events:
+			self.broadcast(event, data)
+
+
+hub = Hub()
+
+
+def stock_adjusted(product_id, delta):
+	"""The on-hand quantity of a product moved by ``delta`` (see StockLevel.adjust)."""
+	_on_commit("stock", (product_id, delta))
+
+
+def entries_received(entries):
+	_on_commit("entry_ids", [entry.pk for entry in entries])
+
+
+def withdrawals_made(withdrawals):
+	_on_commit("withdrawal_ids", [withdrawal.pk for withdrawal in withdrawals])
+
+
+def totals_changed(*names):
+	"""Dashboard totals (``total_products``...) to send again."""
+	_on_commit("totals", names)
+
+
+def _on_commit(kind, value):
+	# Nothing to do (not even a commit hook) while no dashboard is open.
+	if hub.listening:
+		transaction.on_commit(partial(hub.notify, kind, value))
@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from main.metrics import percentile
+from main.models import Product, StockEntry, StockLevel, StockMovementDaily
+from main.services import InsufficientStock, withdraw_from_product
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare read/write throughput of the database profiles (see settings.DB_PROFILE) under concurrent "
+        "readers and writers. Each profile runs in its own process on a throwaway copy of the database; "
+        "seed it first, e.g. STOCKER_DB=/tmp/bench.sqlite3 manage.py seed_benchmark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", nargs="+", default=["default", "production"])
+        parser.add_argument("--readers", type=int, default=8, help="Threads browsing product lists and reports.")
+        parser.add_argument("--writers", type=int, default=4, help="Threads withdrawing stock.")
+        parser.add_argument("--seconds", type=float, default=10.0, help="How long each profile runs.")
+        parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("benchmark_concurrency compares SQLite profiles only.")
+        if options["worker"]:
+            self.stdout.write(json.dumps(self.run_workload(options)))
+            return
+
+        results = [self.run_profile(profile, options) for profile in options["profiles"]]
+        self.stdout.write(
+            f"{'profile':<12} {'reads/s':>9} {'writes/s':>9} {'read p95':>10} {'write p95':>10} {'locked':>7}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r['profile']:<12} {r['reads'] / r['seconds']:>9.1f} {r['writes'] / r['seconds']:>9.1f} "
+                f"{r['read_p95_ms']:>8.1f}ms {r['write_p95_ms']:>8.1f}ms {r['locked']:>7}"
+            )
+
+    def run_profile(self, profile, options):
+        with tempfile.TemporaryDirectory() as tmp:
+            copy = Path(tmp) / "benchmark.sqlite3"
+            # The backup API copies a consistent snapshot, WAL content included.
+            source, target = sqlite3.connect(connection.settings_dict["NAME"]), sqlite3.connect(copy)
+            with target:
+                source.backup(target)
+            source.close()
+            target.close()
+            env = dict(os.environ, STOCKER_DB=str(copy), STOCKER_DB_PROFILE=profile)
+            command = [
+                sys.executable, str(Path(settings.BASE_DIR) / "manage.py"), "benchmark_concurrency", "--worker",
+                "--readers", str(options["readers"]), "--writers", str(options["writers"]), "--seconds", str(options["seconds"]),
+            ]
+            done = subprocess.run(command, env=env, capture_output=True, text=True)
+        if done.returncode:
+            raise CommandError(f"Profile {profile} failed:\n{done.stderr}")
+        return json.loads(done.stdout.strip().splitlines()[-1])
+
+    def run_workload(self, options):
+        product_ids = list(StockLevel.objects.filter(on_hand__gt=0).values_list("product_id", flat=True)[:500])
+        if not product_ids:
+            raise CommandError("No product holds stock; seed the database first.")
+        deadline = time.monotonic() + options["seconds"]
+        start = threading.Barrier(options["readers"] + options["writers"])
+        reads, writes, locked = [], [], []
+
+        def timed(samples, operation):
+            began = time.perf_counter()
+            try:
+                operation()
+            except OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                locked.append(1)
+                return
+            samples.append(time.perf_counter() - began)
+
+        def read(rnd):
+            list(
+                Product.objects.select_related("category").annotate(total_qty=Coalesce("stock_level__on_hand", 0))
+                .order_by("-created_at")[:10]
+            )
+            product_id = rnd.choice(product_ids)
+            StockMovementDaily.objects.filter(product_id=product_id).aggregate(Sum("in_qty"), Sum("out_qty"))
+            list(StockEntry.objects.filter(product_id=product_id).select_related("supplier").order_by("-created_at")[:10])
+
+        def write(rnd):
+            try:
+                withdraw_from_product(Product(pk=rnd.choice(product_ids)), 1)
+            except InsufficientStock:
+                pass
+
+        def worker(samples, operation, seed):
+            rnd = random.Random(seed)
+            try:
+                start.wait()
+                while time.monotonic() < deadline:
+                    timed(samples, lambda: operation(rnd))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(reads, read, n)) for n in range(options["readers"])]
+        threads += [threading.Thread(target=worker, args=(writes, write, -n)) for n in range(1, options["writers"] + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {
+            "profile": settings.DB_PROFILE,
+            "seconds": options["seconds"],
+            "reads": len(reads),
+            "writes": len(writes),
+            "read_p95_ms": percentile(sorted(reads), 95) * 1000 if reads else 0.0,
+            "write_p95_ms": percentile(sorted(writes), 95) * 1000 if writes else 0.0,
+            "locked": len(locked),
+        }
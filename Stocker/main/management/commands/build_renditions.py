@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from main.models import Product
+from main.renditions import RENDITIONS, RENDITIONS_DIR, generate_renditions, rendition_path
+from main.versioning import bump_versions
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the WebP renditions of every product image that lacks them. Rerun with --force "
+        "after changing main.renditions.RENDITIONS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Re-render every image, even those already built.")
+        parser.add_argument("--workers", type=int, default=4, help="Images rendered in parallel.")
+        parser.add_argument("--prune", action="store_true", help="Delete renditions no product uses any more.")
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image="")
+        if not options["force"]:
+            products = products.filter(image_hash="")
+        # Products sharing an image (the default one, mostly) are rendered once.
+        names = sorted(set(products.values_list("image", flat=True)))
+
+        built = failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for name, digest in zip(names, pool.map(lambda name: self.build(name, options["force"]), names)):
+                if digest is None:
+                    failed += 1
+                    continue
+                Product.objects.filter(image=name).exclude(image_hash=digest).update(image_hash=digest)
+                built += 1
+        if built:
+            bump_versions(Product.objects.filter(image__in=names).values_list("id", flat=True))
+        self.stdout.write(self.style.SUCCESS(f"Built renditions for {built} image(s)."))
+        if failed:
+            self.stderr.write(f"{failed} image(s) could not be rendered.")
+        if options["prune"]:
+            self.stdout.write(f"Pruned {self.prune()} unused rendition(s).")
+
+    def build(self, name, force):
+        try:
+            return generate_renditions(name, force=force)
+        except Exception as e:
+            self.stderr.write(f"{name}: {e}")
+            return None
+
+    def prune(self):
+        used = {
+            rendition_path(digest, kind)
+            for digest in Product.objects.exclude(image_hash="").values_list("image_hash", flat=True).distinct()
+            for kind in RENDITIONS
+        }
+        removed = 0
+        if not default_storage.exists(RENDITIONS_DIR):
+            return removed
+        for folder in default_storage.listdir(RENDITIONS_DIR)[0]:
+            for filename in default_storage.listdir(f"{RENDITIONS_DIR}/{folder}")[1]:
+                if f"{folder}/{filename}" not in used:
+                    default_storage.delete(f"{RENDITIONS_DIR}/{folder}/{filename}")
+                    removed += 1
+        return removed
@@ -0,0 +1,25 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import ApiToken
+
+
+class Command(BaseCommand):
+    help = "Issue a JSON API token for a user. The key is printed once and only its hash is stored."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--name", default="api", help="What the token is for, e.g. the scanner or integration using it.")
+        parser.add_argument("--revoke", action="store_true", help="Delete the user's tokens with this name instead.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+        if options["revoke"]:
+            deleted, _ = ApiToken.objects.filter(user=user, name=options["name"]).delete()
+            self.stdout.write(f"Revoked {deleted} token(s).")
+            return
+        _, key = ApiToken.issue(user, options["name"])
+        self.stdout.write(key)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.dashboard import dashboard_cache_stats, reset_dashboard_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counts of the dashboard snapshot cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = dashboard_cache_stats()
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} "
+            f"hit_rate={stats['hit_rate']:.1%} version={stats['version']}"
+        )
+        if options["reset"]:
+            reset_dashboard_cache_stats()
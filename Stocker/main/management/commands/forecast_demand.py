@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from main.forecasting import forecast_demand
+from main.models import Product, ProductForecast
+from main.versioning import bump_versions
+
+
+class Command(BaseCommand):
+    help = (
+        "Forecast daily sales demand, days of cover and suggested reorder levels and order quantities "
+        "for the whole catalog from the sales of the trailing window. Run nightly, after the day's sales."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=int, help="Days of sales history to use (default FORECAST_WINDOW_DAYS).")
+        parser.add_argument("--apply", action="store_true", help="Also replace the reorder level of every forecast product with the suggested one.")
+
+    def handle(self, *args, **options):
+        if options["window"] is not None and options["window"] < 1:
+            raise CommandError("--window must be at least one day.")
+        forecasts = forecast_demand(window_days=options["window"])
+        with transaction.atomic():
+            ProductForecast.objects.all().delete()
+            ProductForecast.objects.bulk_create(forecasts, batch_size=500)
+            applied = 0
+            if options["apply"]:
+                suggested = ProductForecast.objects.filter(product=OuterRef("pk")).values("reorder_level")
+                applied = Product.objects.filter(forecast__isnull=False).update(reorder_level=Subquery(suggested))
+        # Pages showing days of cover or reorder levels are cached per inventory version.
+        bump_versions()
+        below = sum(1 for forecast in forecasts if forecast.on_hand < forecast.reorder_level)
+        message = f"Forecast {len(forecasts)} product(s); {below} below their suggested reorder level."
+        if options["apply"]:
+            message += f" Applied {applied} reorder level(s)."
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importers import IMPORTERS, IMPORT_BATCH_SIZE, import_csv
+
+
+class Command(BaseCommand):
+    help = "Bulk import products, suppliers or stock entries from a CSV file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(IMPORTERS))
+        parser.add_argument("path", help="CSV file with a header row.")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument("--errors", metavar="PATH", help="Also write rejected rows as a CSV of (line, error).")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["path"], encoding="utf-8-sig", newline="") as stream:
+                result = import_csv(options["kind"], stream, batch_size=options["batch_size"])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for line, message in result.errors:
+            self.stderr.write(f"line {line}: {message}")
+        if options["errors"]:
+            with open(options["errors"], "w", newline="") as out:
+                writer = csv.writer(out)
+                writer.writerow(["line", "error"])
+                writer.writerows(result.errors)
+        if result.stopped:
+            raise CommandError(f"{result.stopped} Imported {result.created} row(s) before the error, rejected {len(result.errors)}.")
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(f"Imported {result.created} row(s), rejected {len(result.errors)}."))
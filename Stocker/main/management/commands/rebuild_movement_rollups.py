@@ -0,0 +1,135 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from main.models import Product, StockEntry, StockLevel, StockWithdrawal, StockMovementDaily
+from main.versioning import bump_versions
+
+# Products recomputed at a time, which bounds memory on long histories.
+PRODUCT_CHUNK_SIZE = 2000
+
+
+def movement_rows(first_product_id, last_product_id):
+    """
+    Daily movement rows recomputed from the entry and withdrawal history of
+    a product id range. Quantity corrections leave no history of their own:
+    the recorded ones are kept, and whatever still separates the movements
+    from the entries' quantities is corrected today.
+    """
+    rows = {}
+    products = {"product_id__gte": first_product_id, "product_id__lte": last_product_id}
+    receipts = (
+        StockEntry.objects.filter(**products).annotate(day=TruncDate("created_at"))
+        .values_list("day", "product_id", "supplier_id")
+        .annotate(total=Sum("initial_quantity"))
+        .order_by()
+    )
+    for day, product_id, supplier_id, total in receipts.iterator():
+        rows[(day, product_id, supplier_id, StockMovementDaily.RECEIPT)] = [total or 0, 0]
+    withdrawals = (
+        StockWithdrawal.objects.filter(**products).annotate(day=TruncDate("created_at"))
+        .values_list("day", "product_id", "stock_entry__supplier_id", "reason")
+        .annotate(total=Sum("quantity"))
+        .order_by()
+    )
+    for day, product_id, supplier_id, reason, total in withdrawals.iterator():
+        rows.setdefault((day, product_id, supplier_id, reason), [0, 0])[1] += total or 0
+    corrections = StockMovementDaily.objects.filter(reason=StockMovementDaily.CORRECTION, **products)
+    for day, product_id, supplier_id, in_qty, out_qty in corrections.values_list("date", "product_id", "supplier_id", "in_qty", "out_qty").iterator():
+        rows[(day, product_id, supplier_id, StockMovementDaily.CORRECTION)] = [in_qty, out_qty]
+
+    residual = defaultdict(int)
+    on_hand = StockEntry.objects.filter(**products).values_list("product_id", "supplier_id").annotate(total=Sum("quantity")).order_by()
+    for product_id, supplier_id, total in on_hand.iterator():
+        residual[product_id, supplier_id] += total or 0
+    for (_, product_id, supplier_id, _), (in_qty, out_qty) in rows.items():
+        residual[product_id, supplier_id] -= in_qty - out_qty
+    today = timezone.localdate()
+    for (product_id, supplier_id), delta in residual.items():
+        if delta:
+            row = rows.setdefault((today, product_id, supplier_id, StockMovementDaily.CORRECTION), [0, 0])
+            row[0 if delta > 0 else 1] += abs(delta)
+    return rows
+
+
+def ledger_drift(recorded, first_product_id, last_product_id):
+    """``(product_id, rollup_net, on_hand)`` for each product whose rollups don't add up to its StockLevel."""
+    net = defaultdict(int)
+    for (_, product_id, _, _), (in_qty, out_qty) in recorded.items():
+        net[product_id] += in_qty - out_qty
+    on_hand = dict(
+        StockLevel.objects.filter(product_id__gte=first_product_id, product_id__lte=last_product_id).values_list("product_id", "on_hand")
+    )
+    return [
+        (product_id, net.get(product_id, 0), on_hand.get(product_id, 0))
+        for product_id in sorted(net.keys() | on_hand.keys())
+        if net.get(product_id, 0) != on_hand.get(product_id, 0)
+    ]
+
+
+def product_id_ranges(chunk_size=PRODUCT_CHUNK_SIZE):
+    ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        yield chunk[0], chunk[-1]
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily stock movement rollups from entries, withdrawals and quantity corrections, or check them for drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Only report rollup rows that differ from the movement history, and products whose rollups don't add up to their on-hand stock.",
+        )
+
+    def handle(self, *args, **options):
+        total = fixed = 0
+        drifted = []
+        changed = set()
+        off_ledger = []
+        with transaction.atomic():
+            for first, last in product_id_ranges():
+                expected = movement_rows(first, last)
+                current = StockMovementDaily.objects.filter(product_id__gte=first, product_id__lte=last)
+                recorded = {
+                    (row.date, row.product_id, row.supplier_id, row.reason): [row.in_qty, row.out_qty]
+                    for row in current.iterator()
+                    if row.in_qty or row.out_qty
+                }
+                drift = {key for key in expected.keys() | recorded.keys() if expected.get(key) != recorded.get(key)}
+                total += len(expected)
+                fixed += len(drift)
+                if options["check"]:
+                    drifted.extend((key, recorded.get(key), expected.get(key)) for key in drift)
+                    off_ledger.extend(ledger_drift(recorded, first, last))
+                    continue
+                changed.update(drift)
+                current.delete()
+                StockMovementDaily.objects.bulk_create(
+                    [
+                        StockMovementDaily(date=day, product_id=product_id, supplier_id=supplier_id, reason=reason, in_qty=in_qty, out_qty=out_qty)
+                        for (day, product_id, supplier_id, reason), (in_qty, out_qty) in expected.items()
+                    ],
+                    batch_size=500,
+                )
+
+        if options["check"]:
+            for key, have, want in sorted(drifted, key=str):
+                self.stdout.write(f"{key[0]} product {key[1]} supplier {key[2]} {key[3]}: rollup={have} history={want}")
+            for product_id, have, want in off_ledger:
+                self.stdout.write(f"product {product_id}: rollups net {have}, ledger on hand {want}")
+            if drifted or off_ledger:
+                raise CommandError(
+                    f"{len(drifted)} rollup row(s) out of sync, {len(off_ledger)} product(s) off the ledger. "
+                    "Run rebuild_stock_levels and rebuild_movement_rollups to fix."
+                )
+            self.stdout.write(self.style.SUCCESS(f"Movement rollups in sync ({total} row(s))."))
+            return
+        # Bulk writes send no signals: retire the cached pages of what changed.
+        bump_versions({key[1] for key in changed}, {key[2] for key in changed})
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} movement rollup row(s), fixed {fixed}."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.search import fts_enabled, rebuild_search_index
+from main.versioning import bump_versions
+
+
+class Command(BaseCommand):
+    help = "Repopulate the product and supplier full-text search indexes."
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError("Full-text search indexes are only used on SQLite; nothing to rebuild.")
+        with transaction.atomic():
+            products, suppliers = rebuild_search_index()
+        # Searches on the list pages are cached per inventory version.
+        bump_versions()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {products} product(s) and {suppliers} supplier(s)."))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from main.models import Product, StockEntry, StockLevel
+from main.versioning import bump_versions
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-product on-hand ledger from stock entries, or check it for drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="Only report products whose ledger row differs from their entries.")
+
+    def handle(self, *args, **options):
+        expected = dict(
+            StockEntry.objects.values_list("product_id").annotate(total=Sum("quantity")).order_by()
+        )
+        recorded = dict(StockLevel.objects.values_list("product_id", "on_hand"))
+        product_ids = set(Product.objects.values_list("id", flat=True))
+
+        drift = {}
+        for product_id in product_ids:
+            want = expected.get(product_id) or 0
+            have = recorded.get(product_id)
+            if have is None and want == 0:
+                continue
+            if have != want:
+                drift[product_id] = (have, want)
+
+        if options["check"]:
+            for product_id, (have, want) in sorted(drift.items()):
+                self.stdout.write(f"product {product_id}: ledger={have} entries={want}")
+            if drift:
+                raise CommandError(f"{len(drift)} product(s) out of sync. Run rebuild_stock_levels to fix.")
+            self.stdout.write(self.style.SUCCESS(f"Stock ledger in sync for {len(product_ids)} product(s)."))
+            return
+
+        with transaction.atomic():
+            StockLevel.objects.all().delete()
+            StockLevel.objects.bulk_create(
+                [StockLevel(product_id=product_id, on_hand=expected.get(product_id) or 0) for product_id in product_ids],
+                batch_size=500,
+            )
+        # The rows were replaced in bulk: no signal moved the cached pages' versions.
+        bump_versions(drift)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock ledger for {len(product_ids)} product(s), fixed {len(drift)}."))
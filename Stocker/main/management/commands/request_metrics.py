@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from main.metrics import request_metrics, reset_request_metrics
+
+
+class Command(BaseCommand):
+    help = "Show per-view latency percentiles and query counts recorded by RequestMetricsMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Clear the recorded samples after printing them.")
+
+    def handle(self, *args, **options):
+        rows = request_metrics()
+        if not rows:
+            self.stdout.write("No requests recorded. Is REQUEST_METRICS_ENABLED set and REQUEST_METRICS_CACHE shared?")
+        else:
+            width = max(len(row["view"]) for row in rows)
+            self.stdout.write(f"{'view':<{width}}  {'requests':>8}  {'p50':>8}  {'p95':>8}  {'p99':>8}  {'queries':>8}  {'db_ms':>8}")
+            for row in rows:
+                self.stdout.write(
+                    f"{row['view']:<{width}}  {row['requests']:>8}  {row['p50']:>8.1f}  {row['p95']:>8.1f}  "
+                    f"{row['p99']:>8.1f}  {row['queries']:>8.1f}  {row['db_ms']:>8.1f}"
+                )
+        if options["reset"]:
+            reset_request_metrics()
@@ -0,0 +1,125 @@
+import json
+import statistics
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from main.metrics import QueryRecorder
+from main.models import Product, Supplier
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "baseline.json"
+# Requests run against a private cache: clearing it before each one must not
+# touch the version tokens, metrics and counters in the shared cache.
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "run-benchmarks",
+    },
+}
+
+
+def benchmark_cases():
+    """``(name, url)`` pairs for the hot views; seed_benchmark makes the first product the busiest."""
+    product = Product.objects.order_by("pk").values_list("pk", flat=True).first()
+    supplier = Supplier.objects.order_by("pk").values_list("pk", flat=True).first()
+    if product is None or supplier is None:
+        raise CommandError("Nothing to benchmark; run seed_benchmark first.")
+    return [
+        ("dashboard", reverse("main:dashboard_view")),
+        ("products", reverse("main:products_view")),
+        ("products_search", reverse("main:products_view") + "?search=fresh"),
+        ("stock_entries", reverse("main:stock_entries_view")),
+        ("withdrawals", reverse("main:withdrawals_view")),
+        ("withdrawals_by_reason", reverse("main:withdrawals_view") + "?order_by=reason"),
+        ("product_detail", reverse("main:product_detail", args=[product])),
+        ("supplier_detail", reverse("main:supplier_detail", args=[supplier])),
+        ("inventory_report", reverse("main:inventory_report_view")),
+        ("inventory_report_range", reverse("main:inventory_report_view") + "?start=2000-01-01&end=2100-01-01&order_by=out"),
+        ("supplier_report", reverse("main:supplier_report_view")),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot views through the test client and compare latency and query counts with a JSON baseline. "
+        "Run against a seeded database (see seed_benchmark)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON file.")
+        parser.add_argument("--save", action="store_true", help="Write the results as the new baseline instead of comparing.")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed requests per view; the median is reported.")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed latency growth over the baseline, as a fraction.")
+        parser.add_argument("--slack-ms", type=float, default=5.0, help="Absolute latency growth always tolerated, for very fast views.")
+        parser.add_argument("--only", nargs="*", help="Only run these cases.")
+
+    def handle(self, *args, **options):
+        client = Client(SERVER_NAME=(settings.ALLOWED_HOSTS or ["localhost"])[0].lstrip("."))
+        user = User.objects.filter(is_superuser=True).first() or User.objects.create_superuser("benchmark", "benchmark@example.com", None)
+
+        results = {}
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            client.force_login(user)
+            for name, url in benchmark_cases():
+                if options["only"] and name not in options["only"]:
+                    continue
+                results[name] = self.measure(client, url, options["repeat"])
+                self.stdout.write(f"{name:<24} {results[name]['median_ms']:>9.1f} ms  {results[name]['queries']:>4} queries")
+
+        path = Path(options["baseline"])
+        if options["save"]:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {path}."))
+            return
+        if not path.exists():
+            raise CommandError(f"No baseline at {path}; run with --save first.")
+
+        baseline = json.loads(path.read_text())
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            limit = before["median_ms"] * (1 + options["tolerance"]) + options["slack_ms"]
+            if result["median_ms"] > limit:
+                regressions.append(f"{name}: {result['median_ms']:.1f} ms, baseline {before['median_ms']:.1f} ms")
+            if result["queries"] > before["queries"]:
+                regressions.append(f"{name}: {result['queries']} queries, baseline {before['queries']}")
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}."))
+
+    def measure(self, client, url, repeat):
+        # Every request starts from a cold (private) cache so cached pages measure the work they save.
+        # The client fires request_started, which resets connection.queries,
+        # so queries are counted with an execute wrapper instead, on every
+        # alias: the read views query the replica.
+        cache.clear()
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"{url} answered {response.status_code}.")
+        timings = []
+        for _ in range(repeat):
+            cache.clear()
+            start = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+        return {
+            "url": url,
+            "median_ms": round(statistics.median(timings), 2),
+            "max_ms": round(max(timings), 2),
+            "queries": recorder.count,
+        }
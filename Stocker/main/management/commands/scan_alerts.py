@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.notifications import scan_alerts
+
+
+class Command(BaseCommand):
+    help = "Queue one digest email for entries nearing expiry and products below their reorder level."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=200, help="Maximum rows listed per section of the digest.")
+
+    def handle(self, *args, **options):
+        expiring, low_stock = scan_alerts(limit=options["limit"])
+        if expiring or low_stock:
+            self.stdout.write(f"Queued digest: {expiring} expiring entr(ies), {low_stock} low-stock product(s).")
+        else:
+            self.stdout.write("Nothing to report.")
@@ -0,0 +1,150 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import Category, Supplier, Product, StockEntry, StockWithdrawal
+from main.versioning import bump_versions
+
+ADJECTIVES = ["Fresh", "Organic", "Classic", "Premium", "Light", "Spicy", "Sweet", "Smoked", "Frozen", "Whole"]
+NOUNS = ["Milk", "Cheese", "Coffee", "Tea", "Rice", "Flour", "Juice", "Honey", "Olive Oil", "Dates", "Bread", "Yogurt"]
+REASONS = ["SALE"] * 85 + ["DAMAGE"] * 5 + ["RETURN"] * 5 + ["ADJUST"] * 3 + ["OTHER"] * 2
+
+
+@contextmanager
+def explicit_created_at(*models):
+    """Let bulk_create keep the generated created_at instead of stamping now()."""
+    fields = [model._meta.get_field("created_at") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an empty database with a synthetic catalog and movement history for benchmarking, "
+        "e.g. STOCKER_DB=/tmp/bench.sqlite3 manage.py seed_benchmark --products 100000 --suppliers 2000 "
+        "--entries 5000000 --withdrawals 10000000"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=100)
+        parser.add_argument("--suppliers", type=int, default=500)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--entries", type=int, default=200_000)
+        parser.add_argument("--withdrawals", type=int, default=400_000)
+        parser.add_argument("--days", type=int, default=730, help="Spread the history over this many days before today.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if Product.objects.exists():
+            raise CommandError("seed_benchmark expects an empty catalog; point STOCKER_DB at a fresh database and migrate it first.")
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = timezone.now()
+        self.days = options["days"]
+
+        categories = self.create(Category, [Category(name=f"Category {n}") for n in range(1, options["categories"] + 1)])
+        suppliers = self.create(Supplier, [
+            Supplier(name=f"Supplier {n}", email=f"supplier{n}@example.com", mobile=f"05{n:08d}") for n in range(1, options["suppliers"] + 1)
+        ])
+        category_ids = [c.pk for c in categories]
+        products = self.create(Product, (
+            Product(
+                sku=f"SKU-{n:07d}",
+                name=f"{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)} {n}",
+                category_id=self.random.choice(category_ids),
+                reorder_level=self.random.randint(0, 50),
+            )
+            for n in range(1, options["products"] + 1)
+        ))
+        self.product_ids = [p.pk for p in products]
+        self.supplier_ids = [s.pk for s in suppliers]
+        del categories, suppliers, products
+
+        entries, withdrawals = options["entries"], options["withdrawals"]
+        self.total_entries = entries
+        created = taken = 0
+        with explicit_created_at(StockEntry, StockWithdrawal):
+            while created < entries:
+                size = min(self.batch_size, entries - created)
+                # Spread the remaining withdrawals evenly over the remaining entries.
+                share = (withdrawals - taken) * size // (entries - created)
+                taken += self.seed_batch(created, size, share)
+                created += size
+                self.stdout.write(f"{created}/{entries} entries, {taken} withdrawals", ending="\r")
+        self.stdout.write("")
+
+        self.stdout.write("Rebuilding stock ledger and movement rollups...")
+        call_command("rebuild_stock_levels", stdout=self.stdout)
+        call_command("rebuild_movement_rollups", stdout=self.stdout)
+        bump_versions()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(self.product_ids)} products, {len(self.supplier_ids)} suppliers, {created} entries, {taken} withdrawals."
+        ))
+
+    def create(self, model, objs):
+        created, batch = [], []
+        for obj in objs:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                created += model.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            created += model.objects.bulk_create(batch)
+        return created
+
+    def seed_batch(self, offset, size, withdrawal_count):
+        rnd = self.random
+        span = self.days * 86400
+        entries = []
+        for i in range(size):
+            # Entries are spread evenly over the history in creation order.
+            created_at = self.now - timedelta(seconds=span * (1 - (offset + i + rnd.random()) / self.total_entries))
+            quantity = rnd.randint(10, 500)
+            expiry = created_at.date() + timedelta(days=rnd.randint(7, 540)) if rnd.random() < 0.6 else None
+            entries.append(StockEntry(
+                # Squaring skews stock (and so sales) towards a popular head of the catalog.
+                product_id=self.product_ids[int(len(self.product_ids) * rnd.random() ** 2)],
+                supplier_id=rnd.choice(self.supplier_ids),
+                quantity=quantity,
+                initial_quantity=quantity,
+                unit_cost=Decimal(rnd.randint(50, 50000)) / 100,
+                expiry_date=expiry,
+                received_at=created_at,
+                created_at=created_at,
+                expiry_notified=expiry is not None and expiry < self.now.date(),
+            ))
+
+        withdrawals, sources = [], []
+        for _ in range(withdrawal_count):
+            entry = entries[rnd.randrange(size)]
+            if entry.quantity == 0:
+                continue
+            take = min(entry.quantity, rnd.randint(1, 20))
+            entry.quantity -= take
+            age = (self.now - entry.created_at).total_seconds()
+            withdrawals.append(StockWithdrawal(
+                product_id=entry.product_id,
+                quantity=take,
+                reason=rnd.choice(REASONS),
+                created_at=entry.created_at + timedelta(seconds=age * rnd.random()),
+            ))
+            sources.append(entry)
+
+        with transaction.atomic():
+            StockEntry.objects.bulk_create(entries)
+            for withdrawal, entry in zip(withdrawals, sources):
+                withdrawal.stock_entry_id = entry.pk
+            StockWithdrawal.objects.bulk_create(withdrawals, batch_size=self.batch_size)
+        return len(withdrawals)
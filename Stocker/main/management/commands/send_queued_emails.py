@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.notifications import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Deliver queued low-stock and expiry emails from the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--loop", action="store_true", help="Keep running and poll the outbox every --interval seconds.")
+        parser.add_argument("--interval", type=float, default=10.0)
+
+    def handle(self, *args, **options):
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = send_queued_emails(batch_size=options["batch_size"])
+                total_sent += sent
+                total_failed += failed
+                if sent + failed < options["batch_size"]:
+                    break
+            if total_sent or total_failed or not options["loop"]:
+                self.stdout.write(f"Sent {total_sent} email(s), {total_failed} failed.")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
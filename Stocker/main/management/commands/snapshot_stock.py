@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from main.models import StockMovementDaily, StockSnapshot
+from main.versioning import bump_versions
+
+
+def on_hand_at_end_of(day, full=False):
+    """
+    ``{(product_id, supplier_id): on_hand}`` at the end of ``day``: the
+    previous snapshot plus the rollups since, or every rollup up to ``day``
+    with ``full``.
+    """
+    totals = {}
+    moves = StockMovementDaily.objects.filter(date__lte=day)
+    base = None if full else StockSnapshot.base_date(day - timedelta(days=1))
+    if base:
+        for product_id, supplier_id, on_hand in StockSnapshot.objects.filter(date=base).values_list("product_id", "supplier_id", "on_hand").iterator():
+            totals[(product_id, supplier_id)] = on_hand
+        moves = moves.filter(date__gt=base)
+    deltas = moves.values_list("product_id", "supplier_id").annotate(delta=Sum(F("in_qty") - F("out_qty"))).order_by()
+    for product_id, supplier_id, delta in deltas.iterator():
+        totals[(product_id, supplier_id)] = totals.get((product_id, supplier_id), 0) + delta
+    return totals, base
+
+
+class Command(BaseCommand):
+    help = (
+        "Record the units on hand per product and supplier at the end of a day (yesterday by default), "
+        "starting from the previous snapshot. Run nightly; the inventory report's \"as of\" date reads them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Day to snapshot (YYYY-MM-DD); it must have ended. Defaults to yesterday.")
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Sum the whole movement history instead of starting from the previous snapshot, e.g. after rebuild_movement_rollups.",
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        try:
+            day = parse_date(options["date"]) if options["date"] else today - timedelta(days=1)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f"Invalid date: {options['date']}")
+        if day >= today:
+            raise CommandError("Only days that have ended can be snapshotted.")
+
+        with transaction.atomic():
+            totals, base = on_hand_at_end_of(day, full=options["full"])
+            StockSnapshot.objects.filter(date=day).delete()
+            StockSnapshot.objects.bulk_create(
+                [
+                    StockSnapshot(date=day, product_id=product_id, supplier_id=supplier_id, on_hand=on_hand)
+                    for (product_id, supplier_id), on_hand in totals.items()
+                    if on_hand
+                ],
+                batch_size=500,
+            )
+        # "As of" reports read the snapshots and are cached per inventory version.
+        bump_versions()
+        source = f"the snapshot of {base}" if base else "the full history"
+        self.stdout.write(self.style.SUCCESS(f"Snapshot of {day} taken from {source}: {sum(1 for v in totals.values() if v)} row(s)."))
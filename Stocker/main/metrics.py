@@ -0,0 +1,126 @@
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Views are listed under numbered keys and each view's samples fill a ring
+# of numbered slots, both numbered by atomic counters (see record_request).
+VIEW_COUNT_KEY = "main:metrics:views"
+VIEW_KEY = "main:metrics:view:{}"
+SEQUENCE_KEY = "main:metrics:sequence:{}"
+SAMPLE_KEY = "main:metrics:sample:{}:{}"
+
+_IN_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+class QueryRecorder:
+	"""
+	``connection.execute_wrapper`` callable counting queries and the time
+	spent in the database, grouped by SQL shape (the statement with its
+	``IN (%s, %s, ...)`` lists and inline numbers collapsed).
+	"""
+
+	def __init__(self):
+		self.count = 0
+		self.duration = 0.0
+		self.shapes = Counter()
+		self.shape_time = Counter()
+
+	def __call__(self, execute, sql, params, many, context):
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			elapsed = time.perf_counter() - start
+			shape = sql_shape(sql)
+			self.count += 1
+			self.duration += elapsed
+			self.shapes[shape] += 1
+			self.shape_time[shape] += elapsed
+
+	def top_shapes(self, limit=5):
+		"""The most repeated statements as ``(shape, count, seconds)``."""
+		return [(shape, count, self.shape_time[shape]) for shape, count in self.shapes.most_common(limit)]
+
+
+def sql_shape(sql):
+	return _NUMBER.sub("N", _IN_LIST.sub("(...)", sql))
+
+
+def _cache():
+	return caches[getattr(settings, "REQUEST_METRICS_CACHE", "default")]
+
+
+def record_request(view, duration, queries, db_time):
+	"""
+	Store one request sample in its view's rolling window: a ring of
+	``REQUEST_METRICS_SAMPLES`` slots, the last requests overwriting the
+	oldest. Samples live in the cache so a shared backend aggregates every
+	worker process; each write is one atomic operation (a counter increment
+	picks the slot), so concurrent workers don't lose samples and no request
+	rewrites the whole window.
+	"""
+	cache = _cache()
+	limit = getattr(settings, "REQUEST_METRICS_SAMPLES", 1000)
+	sequence_key = SEQUENCE_KEY.format(view)
+	if cache.add(sequence_key, 0, None):
+		# The view's first sample: list it.
+		cache.set(VIEW_KEY.format(_incr(cache, VIEW_COUNT_KEY)), view, None)
+	cache.set(SAMPLE_KEY.format(view, _incr(cache, sequence_key) % limit), (duration, queries, db_time), None)
+
+
+def request_metrics():
+	"""Per-view request count, latency percentiles (ms) and average query count / DB time."""
+	cache = _cache()
+	limit = getattr(settings, "REQUEST_METRICS_SAMPLES", 1000)
+	rows = []
+	for view in _views(cache):
+		samples = list(cache.get_many([SAMPLE_KEY.format(view, slot) for slot in range(limit)]).values())
+		if not samples:
+			continue
+		durations = sorted(duration for duration, _, _ in samples)
+		rows.append({
+			'view': view,
+			'requests': len(samples),
+			'p50': percentile(durations, 50) * 1000,
+			'p95': percentile(durations, 95) * 1000,
+			'p99': percentile(durations, 99) * 1000,
+			'queries': sum(queries for _, queries, _ in samples) / len(samples),
+			'db_ms': sum(db_time for _, _, db_time in samples) / len(samples) * 1000,
+		})
+	return rows
+
+
+def reset_request_metrics():
+	cache = _cache()
+	limit = getattr(settings, "REQUEST_METRICS_SAMPLES", 1000)
+	count = cache.get(VIEW_COUNT_KEY) or 0
+	keys = [VIEW_COUNT_KEY] + [VIEW_KEY.format(number) for number in range(1, count + 1)]
+	for view in _views(cache):
+		keys.append(SEQUENCE_KEY.format(view))
+		keys += [SAMPLE_KEY.format(view, slot) for slot in range(limit)]
+	cache.delete_many(keys)
+
+
+def _views(cache):
+	count = cache.get(VIEW_COUNT_KEY) or 0
+	# A view whose counter was evicted is listed again: drop the duplicates.
+	return sorted(set(cache.get_many([VIEW_KEY.format(number) for number in range(1, count + 1)]).values()))
+
+
+def _incr(cache, key):
+	try:
+		return cache.incr(key)
+	except ValueError:
+		# Evicted since: start over.
+		cache.add(key, 0, None)
+		return cache.incr(key)
+
+
+def percentile(ordered, p):
+	"""Nearest-rank percentile of an already sorted, non-empty list."""
+	index = max(0, -(-len(ordered) * p // 100) - 1)
+	return ordered[int(index)]
@@ -0,0 +1,74 @@
+import logging
+import time
+from contextlib import ExitStack, nullcontext
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import QueryRecorder, record_request
+from .routers import pinned_to_primary
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+	"""
+	Time every request and the queries it runs, tagged with the URL name of
+	the view (``main:dashboard_view``...). Requests slower than
+	``REQUEST_METRICS_SLOW_MS`` or issuing more than
+	``REQUEST_METRICS_SLOW_QUERIES`` queries are logged with their most
+	repeated SQL. Only active when ``REQUEST_METRICS_ENABLED`` is set.
+	"""
+
+	def __init__(self, get_response):
+		if not getattr(settings, "REQUEST_METRICS_ENABLED", False):
+			raise MiddlewareNotUsed
+		self.get_response = get_response
+		self.slow_ms = getattr(settings, "REQUEST_METRICS_SLOW_MS", 500)
+		self.slow_queries = getattr(settings, "REQUEST_METRICS_SLOW_QUERIES", 50)
+
+	def __call__(self, request):
+		recorder = QueryRecorder()
+		start = time.perf_counter()
+		with ExitStack() as stack:
+			for connection in connections.all():
+				stack.enter_context(connection.execute_wrapper(recorder))
+			response = self.get_response(request)
+		duration = time.perf_counter() - start
+
+		match = request.resolver_match
+		view = match.view_name if match else "<unresolved>"
+		record_request(view, duration, recorder.count, recorder.duration)
+		if duration * 1000 >= self.slow_ms or recorder.count > self.slow_queries:
+			shapes = "".join(
+				f"\n  {count}x {seconds * 1000:.1f}ms {shape[:300]}" for shape, count, seconds in recorder.top_shapes()
+			)
+			logger.warning(
+				"Slow request %s %s (%s): %.0fms, %d queries, %.0fms in DB%s",
+				request.method, request.path, view, duration * 1000, recorder.count, recorder.duration * 1000, shapes,
+			)
+		return response
+
+
+class ReplicaPinningMiddleware:
+	"""
+	Read-your-writes for the replica: any request that may write (POST,
+	PUT, PATCH, DELETE) sets a short-lived cookie, and while it lasts the
+	browser's requests read from the primary instead of a replica that may
+	not have caught up yet. The pin lasts ``REPLICA_LAG_SECONDS``.
+	"""
+
+	cookie_name = "stocker_primary"
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		pinned = self.cookie_name in request.COOKIES
+		with pinned_to_primary() if pinned else nullcontext():
+			response = self.get_response(request)
+		lag = getattr(settings, "REPLICA_LAG_SECONDS", 5)
+		if request.method not in ("GET", "HEAD", "OPTIONS", "TRACE") and lag > 0:
+			response.set_cookie(self.cookie_name, "1", max_age=lag, httponly=True, samesite="Lax")
+		return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_stock_levels(apps, schema_editor):
+    StockEntry = apps.get_model('main', 'StockEntry')
+    StockLevel = apps.get_model('main', 'StockLevel')
+    totals = StockEntry.objects.values('product_id').annotate(total=Sum('quantity')).order_by()
+    StockLevel.objects.bulk_create(
+        [StockLevel(product_id=row['product_id'], on_hand=row['total'] or 0) for row in totals],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_product_low_stock_notified_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLevel',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_level', serialize=False, to='main.product')),
+                ('on_hand', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_stock_levels, migrations.RunPython.noop),
+    ]
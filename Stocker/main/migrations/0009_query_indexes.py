@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at'], name='product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['created_at'], name='entry_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['product', 'created_at'], name='entry_product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(fields=['supplier', 'created_at'], name='entry_supplier_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(condition=models.Q(('expiry_notified', False), ('quantity__gt', 0)), fields=['expiry_date'], name='entry_expiry_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockentry',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date'], name='entry_product_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockwithdrawal',
+            index=models.Index(fields=['created_at'], name='withdrawal_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockwithdrawal',
+            index=models.Index(fields=['reason', 'created_at'], name='withdrawal_reason_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockwithdrawal',
+            index=models.Index(fields=['product', 'created_at'], name='withdrawal_product_created_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+import django.db.models.deletion
+import main.models
+from django.db import migrations, models
+
+from main.search import DROP_PRODUCT_TRIGGERS, DROP_SUPPLIER_TRIGGERS, PRODUCT_TRIGGERS, SUPPLIER_TRIGGERS, run_on_sqlite
+
+# Full-text indexes for product and supplier search. They are plain FTS5
+# tables (not external-content) because the product index also carries the
+# category name; the triggers from main/search.py keep them in step with
+# every write. Other backends skip all of it and fall back to icontains.
+FORWARD = [
+    """
+    CREATE VIRTUAL TABLE main_product_fts USING fts5(
+        name, sku, description, category, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    # rank column = bm25 with a name hit outweighing SKU, category and description hits.
+    "INSERT INTO main_product_fts(main_product_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 2.0)')",
+    *PRODUCT_TRIGGERS,
+    """
+    CREATE VIRTUAL TABLE main_supplier_fts USING fts5(
+        name, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    *SUPPLIER_TRIGGERS,
+    """
+    INSERT INTO main_product_fts(rowid, name, sku, description, category)
+    SELECT p.id, p.name, p.sku, p.description, c.name FROM main_product p JOIN main_category c ON c.id = p.category_id
+    """,
+    "INSERT INTO main_supplier_fts(rowid, name) SELECT id, name FROM main_supplier",
+]
+
+BACKWARD = [
+    *DROP_SUPPLIER_TRIGGERS,
+    "DROP TABLE IF EXISTS main_supplier_fts",
+    *DROP_PRODUCT_TRIGGERS,
+    "DROP TABLE IF EXISTS main_product_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(FORWARD), run_on_sqlite(BACKWARD)),
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='main.product')),
+                ('document', main.models.SearchDocumentField(db_column='main_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'main_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SupplierSearchIndex',
+            fields=[
+                ('supplier', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='main.supplier')),
+                ('document', main.models.SearchDocumentField(db_column='main_supplier_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'main_supplier_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_movement_rollups(apps, schema_editor):
+    StockEntry = apps.get_model('main', 'StockEntry')
+    StockWithdrawal = apps.get_model('main', 'StockWithdrawal')
+    StockMovementDaily = apps.get_model('main', 'StockMovementDaily')
+    rows = {}
+    receipts = StockEntry.objects.annotate(day=TruncDate('created_at')).values_list('day', 'product_id', 'supplier_id').annotate(total=Sum('initial_quantity')).order_by()
+    for day, product_id, supplier_id, total in receipts:
+        rows[(day, product_id, supplier_id, 'RECEIPT')] = [total or 0, 0]
+    withdrawals = StockWithdrawal.objects.annotate(day=TruncDate('created_at')).values_list('day', 'product_id', 'stock_entry__supplier_id', 'reason').annotate(total=Sum('quantity')).order_by()
+    for day, product_id, supplier_id, reason, total in withdrawals:
+        rows.setdefault((day, product_id, supplier_id, reason), [0, 0])[1] += total or 0
+    StockMovementDaily.objects.bulk_create(
+        [
+            StockMovementDaily(date=day, product_id=product_id, supplier_id=supplier_id, reason=reason, in_qty=in_qty, out_qty=out_qty)
+            for (day, product_id, supplier_id, reason), (in_qty, out_qty) in rows.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovementDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('reason', models.CharField(choices=[('RECEIPT', 'Receipt'), ('SALE', 'Sale'), ('DAMAGE', 'Damage'), ('RETURN', 'Return to supplier'), ('ADJUST', 'Inventory adjust'), ('OTHER', 'Other')], max_length=12)),
+                ('in_qty', models.IntegerField(default=0)),
+                ('out_qty', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='main.product')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='main.supplier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'date'], name='movement_product_date_idx'), models.Index(fields=['supplier', 'date'], name='movement_supplier_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product', 'supplier', 'reason'), name='movement_daily_unique')],
+            },
+        ),
+        migrations.RunPython(populate_movement_rollups, migrations.RunPython.noop),
+    ]
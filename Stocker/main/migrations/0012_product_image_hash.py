@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:53
+
+from django.db import migrations, models
+
+from main.search import DROP_PRODUCT_TRIGGERS, PRODUCT_TRIGGERS, run_on_sqlite
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_stockmovementdaily'),
+    ]
+
+    # SQLite adds this column by rebuilding main_product, which drops the
+    # table's search triggers and trips over the category trigger that reads
+    # it; take the four of them down around the AddField.
+    operations = [
+        migrations.RunPython(run_on_sqlite(DROP_PRODUCT_TRIGGERS), run_on_sqlite(PRODUCT_TRIGGERS)),
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(run_on_sqlite(PRODUCT_TRIGGERS), run_on_sqlite(DROP_PRODUCT_TRIGGERS)),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 20:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_apitoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('on_hand', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='main.product')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='main.supplier')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'date'], name='snapshot_product_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product', 'supplier'), name='stock_snapshot_unique')],
+            },
+        ),
+    ]
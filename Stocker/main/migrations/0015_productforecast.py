@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductForecast',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='main.product')),
+                ('computed_at', models.DateTimeField()),
+                ('window_days', models.PositiveIntegerField()),
+                ('daily_demand', models.FloatField()),
+                ('demand_std', models.FloatField()),
+                ('on_hand', models.IntegerField()),
+                ('days_of_cover', models.FloatField()),
+                ('reorder_level', models.PositiveIntegerField()),
+                ('order_quantity', models.PositiveIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['days_of_cover'], name='forecast_cover_idx')],
+            },
+        ),
+    ]
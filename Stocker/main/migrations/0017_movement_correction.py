@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 21:49
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.utils import timezone
+
+
+def backfill_corrections(apps, schema_editor):
+    # Quantity edits used to leave no movement: record what separates the
+    # rollups from the entries as one correction today.
+    StockEntry = apps.get_model('main', 'StockEntry')
+    StockMovementDaily = apps.get_model('main', 'StockMovementDaily')
+    residual = {}
+    for product_id, supplier_id, total in StockEntry.objects.values_list('product_id', 'supplier_id').annotate(total=Sum('quantity')).order_by():
+        residual[(product_id, supplier_id)] = total or 0
+    moved = StockMovementDaily.objects.values_list('product_id', 'supplier_id').annotate(net=Sum(F('in_qty') - F('out_qty'))).order_by()
+    for product_id, supplier_id, net in moved:
+        residual[(product_id, supplier_id)] = residual.get((product_id, supplier_id), 0) - (net or 0)
+    today = timezone.localdate()
+    StockMovementDaily.objects.bulk_create(
+        [
+            StockMovementDaily(date=today, product_id=product_id, supplier_id=supplier_id, reason='CORRECTION', in_qty=max(delta, 0), out_qty=max(-delta, 0))
+            for (product_id, supplier_id), delta in residual.items()
+            if delta
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_outgoingemail_sending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovementdaily',
+            name='reason',
+            field=models.CharField(choices=[('RECEIPT', 'Receipt'), ('SALE', 'Sale'), ('DAMAGE', 'Damage'), ('RETURN', 'Return to supplier'), ('ADJUST', 'Inventory adjust'), ('OTHER', 'Other'), ('CORRECTION', 'Quantity correction')], max_length=12),
+        ),
+        migrations.RunPython(backfill_corrections, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,13 @@
-from django.db import models
+import hashlib
+import secrets
+from datetime import timedelta
+
+from django.db import connections, models, router, transaction
 from django.contrib.auth.models import User 
-from django.db.models import F
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from . import live
 
 class Supplier(models.Model):
     name = models.CharField(max_length=1024, unique=True)
@@ -19,10 +26,17 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     reorder_level = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to="images/products/", default="images/products/default.png")
+    # Content hash of `image` once its WebP renditions exist (see main.renditions).
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     low_stock_notified = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="product_created_idx"),
+        ]
+
 class StockEntry(models.Model):
     product = models.ForeignKey(Product,on_delete=models.PROTECT)
     supplier = models.ForeignKey(Supplier,on_delete=models.PROTECT)
@@ -35,10 +49,59 @@ class StockEntry(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expiry_notified = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="entry_created_idx"),
+            models.Index(fields=["product", "created_at"], name="entry_product_created_idx"),
+            models.Index(fields=["supplier", "created_at"], name="entry_supplier_created_idx"),
+            # Alert scan: only lots that still hold stock and were not reported yet.
+            models.Index(fields=["expiry_date"], condition=Q(quantity__gt=0, expiry_notified=False), name="entry_expiry_pending_idx"),
+            # FEFO/FIFO allocation walks the available lots of one product.
+            models.Index(fields=["product", "expiry_date"], condition=Q(quantity__gt=0), name="entry_product_available_idx"),
+        ]
+
     def save(self, *args, **kwargs):
-        if not self.pk:
-            self.initial_quantity = self.quantity
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not {"product", "product_id", "supplier", "supplier_id", "quantity"} & set(update_fields):
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = StockEntry.objects.filter(pk=self.pk).values("product_id", "supplier_id", "quantity").first()
+            else:
+                self.initial_quantity = self.quantity
+            super().save(*args, **kwargs)
+            day = timezone.localdate(self.created_at)
+            if previous is None:
+                StockLevel.adjust(self.product_id, self.quantity)
+                StockMovementDaily.add(day, self.product_id, self.supplier_id, StockMovementDaily.RECEIPT, in_qty=self.initial_quantity)
+                return
+            if previous["product_id"] != self.product_id:
+                StockLevel.adjust(previous["product_id"], -previous["quantity"])
+                StockLevel.adjust(self.product_id, self.quantity)
+            elif previous["quantity"] != self.quantity:
+                StockLevel.adjust(self.product_id, self.quantity - previous["quantity"])
+            if (previous["product_id"], previous["supplier_id"]) != (self.product_id, self.supplier_id):
+                # The receipt moves on its own day; whatever else the quantity
+                # went through moves as a correction today.
+                StockMovementDaily.add(day, previous["product_id"], previous["supplier_id"], StockMovementDaily.RECEIPT, in_qty=-self.initial_quantity)
+                StockMovementDaily.add(day, self.product_id, self.supplier_id, StockMovementDaily.RECEIPT, in_qty=self.initial_quantity)
+                StockMovementDaily.add_correction(previous["product_id"], previous["supplier_id"], self.initial_quantity - previous["quantity"])
+                StockMovementDaily.add_correction(self.product_id, self.supplier_id, self.quantity - self.initial_quantity)
+            else:
+                StockMovementDaily.add_correction(self.product_id, self.supplier_id, self.quantity - previous["quantity"])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            quantity = StockEntry.objects.filter(pk=self.pk).values_list("quantity", flat=True).first()
+            result = super().delete(*args, **kwargs)
+            if quantity:
+                StockLevel.adjust(self.product_id, -quantity)
+            StockMovementDaily.add(timezone.localdate(self.created_at), self.product_id, self.supplier_id, StockMovementDaily.RECEIPT, in_qty=-self.initial_quantity)
+            # Entries with withdrawals can't be deleted: the rest is corrections.
+            StockMovementDaily.add_correction(self.product_id, self.supplier_id, self.initial_quantity - (quantity or 0))
+        return result
 
 class StockWithdrawal(models.Model):
     REASON_CHOICES = [
@@ -55,3 +118,267 @@ class StockWithdrawal(models.Model):
     reason = models.CharField(max_length=12, choices=REASON_CHOICES, default="SALE")
     note = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="withdrawal_created_idx"),
+            models.Index(fields=["reason", "created_at"], name="withdrawal_reason_created_idx"),
+            models.Index(fields=["product", "created_at"], name="withdrawal_product_created_idx"),
+        ]
+
+class StockLevel(models.Model):
+    """On-hand quantity per product, kept in step with its stock entries."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="stock_level")
+    on_hand = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def adjust(cls, product_id, delta):
+        if not delta:
+            return
+        if not cls.objects.filter(product_id=product_id).update(on_hand=F("on_hand") + delta):
+            cls.objects.get_or_create(product_id=product_id)
+            cls.objects.filter(product_id=product_id).update(on_hand=F("on_hand") + delta)
+        live.stock_adjusted(product_id, delta)
+
+class StockMovementDaily(models.Model):
+    """
+    Units received and withdrawn per day, product, supplier and reason, kept
+    in step with stock entries and withdrawals so reports can sum a few rows
+    per product instead of scanning the movement history.
+    """
+    RECEIPT = "RECEIPT"
+    # Stock entry quantities edited by hand: in when raised, out when lowered.
+    CORRECTION = "CORRECTION"
+    REASON_CHOICES = [(RECEIPT, "Receipt")] + StockWithdrawal.REASON_CHOICES + [(CORRECTION, "Quantity correction")]
+
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="movements")
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name="movements")
+    reason = models.CharField(max_length=12, choices=REASON_CHOICES)
+    in_qty = models.IntegerField(default=0)
+    out_qty = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date", "product", "supplier", "reason"], name="movement_daily_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "date"], name="movement_product_date_idx"),
+            models.Index(fields=["supplier", "date"], name="movement_supplier_date_idx"),
+        ]
+
+    @classmethod
+    def add(cls, day, product_id, supplier_id, reason, in_qty=0, out_qty=0):
+        cls.add_many({(day, product_id, supplier_id, reason): (in_qty, out_qty)})
+
+    @classmethod
+    def add_correction(cls, product_id, supplier_id, delta):
+        """Record a hand edit of ``delta`` units to the stock of a product and supplier, today."""
+        cls.add(timezone.localdate(), product_id, supplier_id, cls.CORRECTION, in_qty=max(delta, 0), out_qty=max(-delta, 0))
+
+    @classmethod
+    def add_many(cls, totals):
+        """
+        Add ``{(day, product_id, supplier_id, reason): (in_qty, out_qty)}`` to
+        the rollups with one upsert per 500 keys, so a write touching many
+        suppliers costs no more queries than one touching a single supplier.
+        """
+        totals = [(key, quantities) for key, quantities in totals.items() if any(quantities)]
+        if not totals:
+            return
+        connection = connections[router.db_for_write(cls)]
+        ops = connection.ops
+        table = ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            for i in range(0, len(totals), 500):
+                chunk = totals[i:i + 500]
+                params = []
+                for (day, product_id, supplier_id, reason), (in_qty, out_qty) in chunk:
+                    params += [ops.adapt_datefield_value(day), product_id, supplier_id, reason, in_qty, out_qty]
+                cursor.execute(
+                    f"INSERT INTO {table} (date, product_id, supplier_id, reason, in_qty, out_qty) "
+                    f"VALUES {', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(chunk))} "
+                    f"ON CONFLICT (date, product_id, supplier_id, reason) DO UPDATE SET "
+                    f"in_qty = {table}.in_qty + excluded.in_qty, out_qty = {table}.out_qty + excluded.out_qty",
+                    params,
+                )
+        deltas = {}
+        for (day, product_id, supplier_id, _), (in_qty, out_qty) in totals:
+            deltas[day, product_id, supplier_id] = deltas.get((day, product_id, supplier_id), 0) + in_qty - out_qty
+        StockSnapshot.correct(deltas)
+
+    @classmethod
+    def add_withdrawals(cls, withdrawals, supplier_ids):
+        """Roll up freshly created withdrawals; ``supplier_ids`` maps stock entry id to supplier id."""
+        totals = {}
+        for withdrawal in withdrawals:
+            key = (timezone.localdate(withdrawal.created_at), withdrawal.product_id, supplier_ids[withdrawal.stock_entry_id], withdrawal.reason)
+            totals[key] = totals.get(key, 0) + withdrawal.quantity
+        cls.add_many({key: (0, quantity) for key, quantity in totals.items()})
+
+class StockSnapshot(models.Model):
+    """
+    Units on hand per product and supplier at the end of a day, according to
+    the movement rollups, written nightly by ``manage.py snapshot_stock``.
+    Stock as of any later day is the nearest snapshot plus the rollups since,
+    so it never replays the whole history. Pairs with nothing on hand are not
+    stored.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="snapshots")
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name="snapshots")
+    on_hand = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date", "product", "supplier"], name="stock_snapshot_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["product", "date"], name="snapshot_product_date_idx"),
+        ]
+
+    @classmethod
+    def base_date(cls, day):
+        """Date of the latest snapshot taken on or before ``day``, or None."""
+        return cls.objects.filter(date__lte=day).aggregate(base=Max("date"))["base"]
+
+    @classmethod
+    def correct(cls, deltas):
+        """
+        Carry rollup changes into the snapshots taken since: ``deltas`` maps
+        ``(day, product_id, supplier_id)`` to the change of on-hand units at
+        the end of ``day``. Snapshots only build on earlier snapshots, so a
+        backdated correction (deleting or moving an old stock entry) would
+        otherwise never reach them.
+        """
+        today = timezone.localdate()
+        # Only days that have ended are snapshotted: today's movements need nothing.
+        deltas = {key: delta for key, delta in deltas.items() if delta and key[0] < today}
+        if not deltas:
+            return
+        connection = connections[router.db_for_write(cls)]
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = (
+            f"INSERT INTO {table} (date, product_id, supplier_id, on_hand) "
+            f"SELECT DISTINCT date, %s, %s, %s FROM {table} WHERE date >= %s "
+            f"ON CONFLICT (date, product_id, supplier_id) DO UPDATE SET on_hand = {table}.on_hand + excluded.on_hand"
+        )
+        with connection.cursor() as cursor:
+            for (day, product_id, supplier_id), delta in deltas.items():
+                cursor.execute(sql, [product_id, supplier_id, delta, connection.ops.adapt_datefield_value(day)])
+                if cursor.rowcount:
+                    cls.objects.filter(date__gte=day, product_id=product_id, supplier_id=supplier_id, on_hand=0).delete()
+
+class ProductForecast(models.Model):
+    """
+    Sales demand of a product over the trailing window and the stock it
+    calls for, written by ``manage.py forecast_demand`` (see main.forecasting)
+    so pages read them instead of recomputing. Products without sales in the
+    window have no row.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="forecast")
+    computed_at = models.DateTimeField()
+    window_days = models.PositiveIntegerField()
+    daily_demand = models.FloatField()
+    demand_std = models.FloatField()
+    on_hand = models.IntegerField()
+    days_of_cover = models.FloatField()
+    reorder_level = models.PositiveIntegerField()
+    order_quantity = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["days_of_cover"], name="forecast_cover_idx"),
+        ]
+
+class OutgoingEmail(models.Model):
+    STATUS_CHOICES = [
+        ("PENDING", "Pending"),
+        ("SENDING", "Sending"),
+        ("SENT", "Sent"),
+        ("FAILED", "Failed"),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.TextField(help_text="Comma separated recipients.")
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default="PENDING")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+class ApiToken(models.Model):
+    """
+    Bearer token for the JSON API (``Authorization: Token <key>``). Only a
+    SHA-256 of the key is stored; the key itself is shown once, by
+    ``manage.py create_api_token``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="api_tokens")
+    name = models.CharField(max_length=100)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(blank=True, null=True)
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user, name):
+        """Create a token for ``user`` and return ``(token, key)``."""
+        key = secrets.token_urlsafe(32)
+        return cls.objects.create(user=user, name=name, key_hash=cls.hash_key(key)), key
+
+    @classmethod
+    def authenticate(cls, key):
+        """The active user owning ``key``, or None."""
+        token = cls.objects.select_related("user").filter(key_hash=cls.hash_key(key), user__is_active=True).first()
+        if token is None:
+            return None
+        now = timezone.now()
+        # Record usage at most once a minute rather than writing on every request.
+        if token.last_used_at is None or now - token.last_used_at > timedelta(minutes=1):
+            cls.objects.filter(pk=token.pk).update(last_used_at=now)
+        return token.user
+
+class SearchDocumentField(models.TextField):
+    """The hidden column an FTS5 table shares its name with; supports ``__match``."""
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+class ProductSearchIndex(models.Model):
+    """
+    Row of the ``main_product_fts`` FTS5 table (SQLite only). The table and
+    the triggers that fill it live in migration 0010; ``rank`` is FTS5's
+    bm25 score, lower is more relevant.
+    """
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid", related_name="search_index")
+    document = SearchDocumentField(db_column="main_product_fts")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "main_product_fts"
+
+class SupplierSearchIndex(models.Model):
+    """Row of the ``main_supplier_fts`` FTS5 table (SQLite only), see :class:`ProductSearchIndex`."""
+    supplier = models.OneToOneField(Supplier, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid", related_name="search_index")
+    document = SearchDocumentField(db_column="main_supplier_fts")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "main_supplier_fts"
@@ -0,0 +1,183 @@
+import logging
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OutgoingEmail, Product, StockEntry, StockLevel
+
+logger = logging.getLogger(__name__)
+
+UPDATE_CHUNK_SIZE = 500
+
+
+def manager_to_list():
+	to = []
+	if getattr(settings, "MANAGER_EMAIL", None):
+		to.append(settings.MANAGER_EMAIL)
+	return to
+
+
+def queue_email(subject, template_name, context, to=None):
+	"""Render an email and store it in the outbox; the worker delivers it later."""
+	to = to if to is not None else manager_to_list()
+	if not to:
+		return None
+	return OutgoingEmail.objects.create(
+		subject=subject,
+		body=render_to_string(template_name, context),
+		from_email=settings.DEFAULT_FROM_EMAIL or "",
+		to=",".join(to),
+	)
+
+
+def queue_low_stock_email(product, total_qty):
+	subject = f"[Stocker] Low stock: {product.name} ({product.sku})"
+	return queue_email(subject, "main/emails/low_stock.html", {"product": product, "total_qty": total_qty})
+
+
+def queue_expiry_email(entry):
+	subject = f"[Stocker] Expiry approaching: {entry.product.name}"
+	return queue_email(subject, "main/emails/expiry_alert.html", {"entry": entry})
+
+
+def check_low_stock(product):
+	total_qty = StockLevel.objects.filter(product_id=product.id).values_list('on_hand', flat=True).first() or 0
+	low = total_qty < (product.reorder_level or 0)
+	if low and not product.low_stock_notified:
+		queue_low_stock_email(product, total_qty)
+		product.low_stock_notified = True
+		product.save(update_fields=["low_stock_notified"])
+	elif not low and product.low_stock_notified:
+		product.low_stock_notified = False
+		product.save(update_fields=["low_stock_notified"])
+
+
+def check_expiry(entry):
+	days = int(getattr(settings, "EXPIRY_ALERT_DAYS", 7))
+	if entry.quantity and entry.expiry_date and not entry.expiry_notified:
+		if entry.expiry_date <= date.today() + timedelta(days=days):
+			queue_expiry_email(entry)
+			entry.expiry_notified = True
+			entry.save(update_fields=["expiry_notified"])
+
+
+def scan_alerts(product_ids=None, limit=200):
+	"""
+	Find every entry inside the expiry window and every product below its
+	reorder level with one query each, queue a single digest email for them
+	and flip their notified flags in bulk. Products that recovered get their
+	flag reset so they can alert again. ``product_ids`` restricts the scan.
+	Returns ``(expiring_count, low_stock_count)``.
+	"""
+	days = int(getattr(settings, "EXPIRY_ALERT_DAYS", 7))
+	expiring = StockEntry.objects.filter(expiry_notified=False, quantity__gt=0, expiry_date__lte=date.today() + timedelta(days=days))
+	products = Product.objects.annotate(qty=Coalesce('stock_level__on_hand', 0))
+	if product_ids is not None:
+		expiring = expiring.filter(product_id__in=product_ids)
+		products = products.filter(pk__in=product_ids)
+
+	with transaction.atomic():
+		expiring_rows = list(expiring.order_by('expiry_date', 'id').values('id', 'product__name', 'product__sku', 'supplier__name', 'quantity', 'expiry_date'))
+		low_rows = list(products.filter(low_stock_notified=False, qty__lt=F('reorder_level')).order_by('qty', 'id').values('id', 'name', 'sku', 'qty', 'reorder_level'))
+		products.filter(low_stock_notified=True, qty__gte=F('reorder_level')).update(low_stock_notified=False)
+		if not expiring_rows and not low_rows:
+			return 0, 0
+
+		_bulk_flag(StockEntry, [row['id'] for row in expiring_rows], expiry_notified=True)
+		_bulk_flag(Product, [row['id'] for row in low_rows], low_stock_notified=True)
+		subject = f"[Stocker] Stock alerts: {len(expiring_rows)} expiring, {len(low_rows)} low stock"
+		queue_email(subject, "main/emails/alert_digest.html", {
+			'expiring': expiring_rows[:limit],
+			'expiring_count': len(expiring_rows),
+			'expiring_more': max(len(expiring_rows) - limit, 0),
+			'low_stock': low_rows[:limit],
+			'low_stock_count': len(low_rows),
+			'low_stock_more': max(len(low_rows) - limit, 0),
+		})
+	return len(expiring_rows), len(low_rows)
+
+
+def _bulk_flag(model, ids, **values):
+	for i in range(0, len(ids), UPDATE_CHUNK_SIZE):
+		model.objects.filter(pk__in=ids[i:i + UPDATE_CHUNK_SIZE]).update(**values)
+
+
+def send_queued_emails(batch_size=50, connection=None):
+	"""
+	Deliver up to ``batch_size`` due emails over a single mail connection.
+
+	The batch is claimed (marked SENDING) in a short transaction and sent
+	outside of any, so the database isn't locked for the SMTP session; each
+	result is then recorded on its own. A claim left behind by a worker that
+	died expires after ``EMAIL_OUTBOX_CLAIM_SECONDS`` and the email is sent
+	again.
+
+	Failed messages are retried with exponential backoff until
+	``EMAIL_OUTBOX_MAX_ATTEMPTS`` is reached, after which they are marked
+	FAILED. Returns a ``(sent, failed)`` tuple for this batch.
+	"""
+	max_attempts = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 5)
+	retry_base = getattr(settings, "EMAIL_OUTBOX_RETRY_SECONDS", 60)
+	batch = _claim_emails(batch_size)
+	if not batch:
+		return 0, 0
+	sent = failed = 0
+	connection = connection or get_connection()
+	try:
+		connection.open()
+	except Exception as e:
+		logger.warning("Could not open mail connection: %s", e)
+		connection = None
+		error = str(e)
+	for email in batch:
+		email.attempts += 1
+		if connection is not None:
+			try:
+				if not connection.send_messages([_as_message(email, connection)]):
+					raise RuntimeError("Mail backend did not accept the message.")
+			except Exception as e:
+				error = str(e)
+			else:
+				email.status = "SENT"
+				email.sent_at = timezone.now()
+				email.last_error = ""
+				email.save(update_fields=["status", "attempts", "last_error", "sent_at"])
+				sent += 1
+				continue
+		email.last_error = error
+		email.next_attempt_at = timezone.now() + timedelta(seconds=retry_base * 2 ** (email.attempts - 1))
+		email.status = "FAILED" if email.attempts >= max_attempts else "PENDING"
+		email.save(update_fields=["status", "attempts", "next_attempt_at", "last_error"])
+		failed += 1
+	if connection is not None:
+		connection.close()
+	return sent, failed
+
+
+def _claim_emails(batch_size):
+	now = timezone.now()
+	with transaction.atomic():
+		# SENDING rows are due again once their claim expired.
+		ids = list(
+			OutgoingEmail.objects.select_for_update(skip_locked=True)
+			.filter(status__in=["PENDING", "SENDING"], next_attempt_at__lte=now)
+			.order_by("next_attempt_at", "id")
+			.values_list("id", flat=True)[:batch_size]
+		)
+		if not ids:
+			return []
+		claim_expires = now + timedelta(seconds=getattr(settings, "EMAIL_OUTBOX_CLAIM_SECONDS", 600))
+		OutgoingEmail.objects.filter(pk__in=ids).update(status="SENDING", next_attempt_at=claim_expires)
+	return list(OutgoingEmail.objects.filter(pk__in=ids).order_by("id"))
+
+
+def _as_message(email, connection):
+	message = EmailMessage(email.subject, email.body, email.from_email or None, email.to.split(","), connection=connection)
+	message.content_subtype = "html"
+	return message
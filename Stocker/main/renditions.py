@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from .models import Product
+from .versioning import bump_versions
+
+logger = logging.getLogger(__name__)
+
+# kind: (width, height, crop). Cropped renditions fill the box exactly;
+# the others fit inside it without upscaling. Sizes are 2x the CSS box.
+RENDITIONS = {
+	"thumb": (256, 256, True),
+	"detail": (800, 800, False),
+}
+RENDITIONS_DIR = "renditions"
+WEBP_QUALITY = 80
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def rendition_path(digest, kind):
+	"""Storage-relative path of one rendition; it changes with the image content and the rendition size."""
+	width, height, _ = RENDITIONS[kind]
+	return f"{digest[:2]}/{digest}-{kind}-{width}x{height}.webp"
+
+
+def rendition_url(product, kind):
+	"""URL of ``product``'s ``kind`` rendition, or of the original until the renditions exist."""
+	if not product.image:
+		return ""
+	if not product.image_hash:
+		return product.image.url
+	return reverse("main:rendition_view", args=[rendition_path(product.image_hash, kind)])
+
+
+def render(data, width, height, crop):
+	with Image.open(BytesIO(data)) as original:
+		image = ImageOps.exif_transpose(original)
+		image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+		if crop:
+			image = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+		else:
+			image.thumbnail((width, height), Image.Resampling.LANCZOS)
+		out = BytesIO()
+		image.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+		return out.getvalue()
+
+
+def generate_renditions(name, force=False):
+	"""
+	Write every rendition of the stored image ``name`` and return its
+	content hash. Renditions already on disk are kept unless ``force``, so
+	products sharing an image (or re-uploading the same file) reuse them.
+	"""
+	with default_storage.open(name, "rb") as f:
+		data = f.read()
+	digest = hashlib.sha256(data).hexdigest()[:32]
+	for kind, (width, height, crop) in RENDITIONS.items():
+		path = f"{RENDITIONS_DIR}/{rendition_path(digest, kind)}"
+		if force and default_storage.exists(path):
+			default_storage.delete(path)
+		if not default_storage.exists(path):
+			default_storage.save(path, ContentFile(render(data, width, height, crop)))
+	return digest
+
+
+def build_product_renditions(product_id):
+	"""Render the product's current image and record its hash once every rendition exists."""
+	name = Product.objects.filter(pk=product_id).values_list("image", flat=True).first()
+	if not name:
+		return None
+	digest = generate_renditions(name)
+	# Only stamp the hash if the image was not replaced meanwhile.
+	if Product.objects.filter(pk=product_id, image=name).update(image_hash=digest):
+		bump_versions([product_id])
+	return digest
+
+
+def schedule_renditions(product_id):
+	"""
+	Build the product's renditions once the current transaction commits:
+	on the background pool, or inline when ``IMAGE_RENDITIONS_ASYNC`` is off.
+	Until then ``rendition_url`` keeps serving the original.
+	"""
+	if getattr(settings, "IMAGE_RENDITIONS_ASYNC", True):
+		transaction.on_commit(lambda: _get_executor().submit(_build_in_background, product_id))
+	else:
+		transaction.on_commit(lambda: build_product_renditions(product_id))
+
+
+def _get_executor():
+	global _executor
+	with _executor_lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(
+				max_workers=getattr(settings, "IMAGE_RENDITION_WORKERS", 2), thread_name_prefix="renditions",
+			)
+		return _executor
+
+
+def _build_in_background(product_id):
+	try:
+		build_product_renditions(product_id)
+	except Exception:
+		logger.exception("Could not build image renditions for product %s", product_id)
+	finally:
+		# Pool threads are long lived; don't leave their connections open.
+		connections.close_all()
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY = "default"
+REPLICA = "replica"
+
+_replica_reads = ContextVar("replica_reads", default=False)
+_pinned = ContextVar("pinned_to_primary", default=False)
+
+
+class ReplicaRouter:
+	"""
+	Send reads made under :func:`replica_reads` to the ``replica`` alias and
+	everything else (writes, ``select_for_update``, reads inside a
+	transaction, pinned requests) to ``default``. Only ``default`` is
+	migrated; the replica gets its schema and rows by replication.
+	"""
+
+	def db_for_read(self, model, **hints):
+		if not _replica_reads.get() or _pinned.get() or REPLICA not in settings.DATABASES:
+			return PRIMARY
+		# A read in the middle of a write must see that write.
+		if connections[PRIMARY].in_atomic_block:
+			return PRIMARY
+		return REPLICA
+
+	def db_for_write(self, model, **hints):
+		return PRIMARY
+
+	def allow_relation(self, obj1, obj2, **hints):
+		return True
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		return db == PRIMARY
+
+
+@contextmanager
+def replica_reads():
+	token = _replica_reads.set(True)
+	try:
+		yield
+	finally:
+		_replica_reads.reset(token)
+
+
+@contextmanager
+def pinned_to_primary():
+	token = _pinned.set(True)
+	try:
+		yield
+	finally:
+		_pinned.reset(token)
+
+
+def read_from_replica(view):
+	"""Run a read-only view's queries on the replica (unless the request is pinned to the primary)."""
+	@wraps(view)
+	def wrapper(request, *args, **kwargs):
+		with replica_reads():
+			return view(request, *args, **kwargs)
+	return wrapper
+
+
+def separate_replica():
+	"""Whether ``replica`` is another database, which may lag behind ``default``."""
+	replica = settings.DATABASES.get(REPLICA)
+	return replica is not None and replica["NAME"] != settings.DATABASES[PRIMARY]["NAME"]
@@ -0,0 +1,145 @@
+import re
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.db.models import F, Q
+
+PRODUCT_FIELDS = ("name", "sku")
+SUPPLIER_FIELDS = ("name",)
+
+# Triggers keeping the FTS tables in step with every write, including
+# bulk_create and raw updates that bypass model signals. Migrations that
+# make SQLite rebuild main_product take the product ones down around it.
+PRODUCT_TRIGGERS = [
+	"""
+	CREATE TRIGGER main_product_fts_insert AFTER INSERT ON main_product BEGIN
+		INSERT INTO main_product_fts(rowid, name, sku, description, category)
+		VALUES (new.id, new.name, new.sku, new.description, (SELECT name FROM main_category WHERE id = new.category_id));
+	END
+	""",
+	"""
+	CREATE TRIGGER main_product_fts_update AFTER UPDATE OF name, sku, description, category_id ON main_product BEGIN
+		UPDATE main_product_fts
+		SET name = new.name, sku = new.sku, description = new.description,
+			category = (SELECT name FROM main_category WHERE id = new.category_id)
+		WHERE rowid = new.id;
+	END
+	""",
+	"""
+	CREATE TRIGGER main_product_fts_delete AFTER DELETE ON main_product BEGIN
+		DELETE FROM main_product_fts WHERE rowid = old.id;
+	END
+	""",
+	"""
+	CREATE TRIGGER main_category_fts_update AFTER UPDATE OF name ON main_category BEGIN
+		UPDATE main_product_fts SET category = new.name
+		WHERE rowid IN (SELECT id FROM main_product WHERE category_id = new.id);
+	END
+	""",
+]
+DROP_PRODUCT_TRIGGERS = [
+	"DROP TRIGGER IF EXISTS main_category_fts_update",
+	"DROP TRIGGER IF EXISTS main_product_fts_delete",
+	"DROP TRIGGER IF EXISTS main_product_fts_update",
+	"DROP TRIGGER IF EXISTS main_product_fts_insert",
+]
+SUPPLIER_TRIGGERS = [
+	"""
+	CREATE TRIGGER main_supplier_fts_insert AFTER INSERT ON main_supplier BEGIN
+		INSERT INTO main_supplier_fts(rowid, name) VALUES (new.id, new.name);
+	END
+	""",
+	"""
+	CREATE TRIGGER main_supplier_fts_update AFTER UPDATE OF name ON main_supplier BEGIN
+		UPDATE main_supplier_fts SET name = new.name WHERE rowid = new.id;
+	END
+	""",
+	"""
+	CREATE TRIGGER main_supplier_fts_delete AFTER DELETE ON main_supplier BEGIN
+		DELETE FROM main_supplier_fts WHERE rowid = old.id;
+	END
+	""",
+]
+DROP_SUPPLIER_TRIGGERS = [
+	"DROP TRIGGER IF EXISTS main_supplier_fts_delete",
+	"DROP TRIGGER IF EXISTS main_supplier_fts_update",
+	"DROP TRIGGER IF EXISTS main_supplier_fts_insert",
+]
+
+
+def fts_enabled(using="default"):
+	"""The FTS5 indexes from migration 0010 only exist on SQLite."""
+	return connections[using].vendor == "sqlite"
+
+
+def run_on_sqlite(statements):
+	"""A RunPython callable executing ``statements``; other backends have no FTS and skip it."""
+	def run(apps, schema_editor):
+		if schema_editor.connection.vendor != "sqlite":
+			return
+		for statement in statements:
+			schema_editor.execute(statement)
+	return run
+
+
+def match_query(term):
+	"""
+	Turn free text into an FTS5 MATCH expression: every word must appear,
+	the last one as a prefix ("choc bar" -> ``"choc" "bar"*``). Punctuation
+	is dropped so user input can never form FTS query syntax.
+	"""
+	words = re.findall(r"\w+", term or "")
+	if not words:
+		return ""
+	return " ".join(f'"{word}"' for word in words) + "*"
+
+
+def search_products(queryset, term, rank=False):
+	"""
+	Filter a Product queryset to the rows matching ``term`` (name, SKU,
+	description or category name). With ``rank`` the rows are annotated with
+	``search_rank``, lower is more relevant.
+	"""
+	return _search(queryset, term, PRODUCT_FIELDS, rank)
+
+
+def search_suppliers(queryset, term, rank=False):
+	"""Like :func:`search_products`, for Supplier names."""
+	return _search(queryset, term, SUPPLIER_FIELDS, rank)
+
+
+def search_ranked(queryset):
+	"""True when ``queryset`` carries the ``search_rank`` annotation and can be ordered by relevance."""
+	return "search_rank" in queryset.query.annotations
+
+
+def _search(queryset, term, fields, rank):
+	query = match_query(term)
+	if not query:
+		return queryset
+	if not fts_enabled(queryset.db):
+		return queryset.filter(reduce(or_, (Q(**{f"{field}__icontains": term.strip()}) for field in fields)))
+	# Joining the FTS table (rather than ``pk IN (SELECT rowid ...)``) lets
+	# SQLite drive the query from the index and read bm25 once per match.
+	queryset = queryset.filter(search_index__document__match=query)
+	if rank:
+		queryset = queryset.annotate(search_rank=F('search_index__rank'))
+	return queryset
+
+
+def rebuild_search_index(using="default"):
+	"""Repopulate both FTS tables from scratch; returns ``(products, suppliers)`` indexed."""
+	if not fts_enabled(using):
+		return 0, 0
+	with connections[using].cursor() as cursor:
+		cursor.execute("DELETE FROM main_product_fts")
+		cursor.execute(
+			"INSERT INTO main_product_fts(rowid, name, sku, description, category) "
+			"SELECT p.id, p.name, p.sku, p.description, c.name FROM main_product p JOIN main_category c ON c.id = p.category_id"
+		)
+		products = cursor.rowcount
+		cursor.execute("DELETE FROM main_supplier_fts")
+		cursor.execute("INSERT INTO main_supplier_fts(rowid, name) SELECT id, name FROM main_supplier")
+		suppliers = cursor.rowcount
+	return products, suppliers
@@ -0,0 +1,110 @@
+from django.db import transaction
+from django.db.models import F, Q, Sum, Case, When, Window, RowRange
+from django.db.models.functions import Coalesce
+
+from .live import withdrawals_made
+from .models import StockEntry, StockWithdrawal, StockLevel, StockMovementDaily
+from .versioning import bump_versions
+
+FEFO = "fefo"
+FIFO = "fifo"
+ALLOCATION_STRATEGIES = [
+	(FEFO, "First expiry, first out"),
+	(FIFO, "First in, first out"),
+]
+
+
+class InsufficientStock(Exception):
+	pass
+
+
+def withdraw_from_entry(stock_entry, quantity, reason="SALE", note=""):
+	"""
+	Take ``quantity`` units out of ``stock_entry`` and record the withdrawal.
+
+	The decrement is a single conditional ``UPDATE ... WHERE quantity >= n``
+	so concurrent withdrawals never read-modify-write the row; if no row was
+	affected the entry did not hold enough stock and nothing is written.
+	"""
+	if quantity <= 0:
+		raise ValueError("Quantity must be greater than 0.")
+	with transaction.atomic():
+		updated = StockEntry.objects.filter(pk=stock_entry.pk, quantity__gte=quantity).update(quantity=F('quantity') - quantity)
+		if not updated:
+			raise InsufficientStock("Not enough quantity in this entry.")
+		StockLevel.adjust(stock_entry.product_id, -quantity)
+		withdrawal = StockWithdrawal.objects.create(stock_entry=stock_entry, product_id=stock_entry.product_id, quantity=quantity, reason=reason, note=note)
+		StockMovementDaily.add_withdrawals([withdrawal], {stock_entry.pk: stock_entry.supplier_id})
+	return withdrawal
+
+
+def _allocation_order(strategy):
+	received = Coalesce('received_at', 'created_at')
+	if strategy == FEFO:
+		return [F('expiry_date').asc(nulls_last=True), received.asc(), F('id').asc()]
+	if strategy == FIFO:
+		return [received.asc(), F('id').asc()]
+	raise ValueError(f"Unknown allocation strategy: {strategy}")
+
+
+def allocate_withdrawal(product_id, quantity, strategy=FEFO):
+	"""
+	Pick the lots of a product that cover ``quantity`` in ``strategy`` order.
+
+	A running total computed by the database limits the result to the lots
+	actually needed, so this is one query however many lots the product has.
+	Returns a list of ``(entry_id, take)`` pairs.
+	"""
+	order = _allocation_order(strategy)
+	lots = (
+		StockEntry.objects.filter(product_id=product_id, quantity__gt=0)
+		.annotate(running=Window(Sum('quantity'), order_by=order, frame=RowRange(start=None, end=0)))
+		.filter(running__lt=F('quantity') + quantity)
+		.order_by(*order)
+		.values_list('id', 'quantity')
+	)
+	allocation = []
+	remaining = quantity
+	for entry_id, available in lots:
+		take = min(available, remaining)
+		allocation.append((entry_id, take))
+		remaining -= take
+	if remaining:
+		raise InsufficientStock(f"Only {quantity - remaining} unit(s) in stock.")
+	return allocation
+
+
+def withdraw_from_product(product, quantity, reason="SALE", note="", strategy=FEFO):
+	"""
+	Withdraw ``quantity`` units of ``product`` spread over as many lots as needed.
+
+	Runs a constant number of queries: the allocation, one conditional UPDATE
+	that decrements (and so locks) only the allocated lots, the ledger update,
+	a single ``bulk_create`` for the withdrawal rows and one daily rollup
+	upsert covering every supplier the lots came from. If another withdrawal
+	drained one of the lots in between, the UPDATE touches fewer rows than
+	allocated and the whole transaction is rolled back.
+	"""
+	if quantity <= 0:
+		raise ValueError("Quantity must be greater than 0.")
+	with transaction.atomic():
+		allocation = allocate_withdrawal(product.pk, quantity, strategy)
+		guard = Q()
+		for entry_id, take in allocation:
+			guard |= Q(pk=entry_id, quantity__gte=take)
+		updated = StockEntry.objects.filter(guard).update(
+			quantity=Case(*[When(pk=entry_id, then=F('quantity') - take) for entry_id, take in allocation])
+		)
+		if updated != len(allocation):
+			raise InsufficientStock("Stock changed while allocating, please try again.")
+		StockLevel.adjust(product.pk, -quantity)
+		withdrawals = StockWithdrawal.objects.bulk_create([
+			StockWithdrawal(stock_entry_id=entry_id, product_id=product.pk, quantity=take, reason=reason, note=note)
+			for entry_id, take in allocation
+		])
+		supplier_ids = dict(StockEntry.objects.filter(pk__in=[entry_id for entry_id, _ in allocation]).values_list('id', 'supplier_id'))
+		StockMovementDaily.add_withdrawals(withdrawals, supplier_ids)
+	# bulk_create sends no post_save signals.
+	bump_versions([product.pk], set(supplier_ids.values()))
+	withdrawals_made(withdrawals)
+	return withdrawals
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .live import entries_received, totals_changed, withdrawals_made
+from .models import Category, Supplier, Product, StockEntry, StockWithdrawal
+from .versioning import bump_versions
+
+
+# Every write moves the inventory version (dashboard snapshot, list and
+# report pages) and the versions of the product and supplier pages that
+# show the changed row. What the dashboard shows is also sent to the open
+# live dashboards (see main.live).
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Product and supplier pages show the category name.
+    products = Product.objects.filter(category_id=instance.pk)
+    bump_versions(
+        products.values_list("id", flat=True),
+        StockEntry.objects.filter(product__in=products).values_list("supplier_id", flat=True).distinct(),
+    )
+    if kwargs.get("created", True):
+        totals_changed("total_categories")
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    bump_versions([instance.pk], StockEntry.objects.filter(product_id=instance.pk).values_list("supplier_id", flat=True).distinct())
+    # An edit may change the reorder level.
+    totals_changed("total_products", "low_stock_count")
+
+
+@receiver([post_save, post_delete], sender=Supplier)
+def supplier_changed(sender, instance, **kwargs):
+    bump_versions(StockEntry.objects.filter(supplier_id=instance.pk).values_list("product_id", flat=True).distinct(), [instance.pk])
+    if kwargs.get("created", True):
+        totals_changed("total_suppliers")
+
+
+@receiver(pre_save, sender=StockEntry)
+def remember_entry_owner(sender, instance, update_fields=None, **kwargs):
+    # An edit can move the entry to another product or supplier, whose pages change too.
+    instance._previous_owner = None
+    if instance.pk and (update_fields is None or {"product", "product_id", "supplier", "supplier_id"} & set(update_fields)):
+        instance._previous_owner = StockEntry.objects.filter(pk=instance.pk).values_list("product_id", "supplier_id").first()
+
+
+@receiver([post_save, post_delete], sender=StockEntry)
+def entry_changed(sender, instance, **kwargs):
+    product_ids, supplier_ids = {instance.product_id}, {instance.supplier_id}
+    previous = getattr(instance, "_previous_owner", None)
+    if previous:
+        product_ids.add(previous[0])
+        supplier_ids.add(previous[1])
+    bump_versions(product_ids, supplier_ids)
+    if kwargs.get("created"):
+        entries_received([instance])
+
+
+@receiver([post_save, post_delete], sender=StockWithdrawal)
+def withdrawal_changed(sender, instance, **kwargs):
+    if StockWithdrawal.stock_entry.is_cached(instance):
+        supplier_id = instance.stock_entry.supplier_id
+    else:
+        supplier_id = StockEntry.objects.filter(pk=instance.stock_entry_id).values_list("supplier_id", flat=True).first()
+    bump_versions([instance.product_id], [supplier_id] if supplier_id else [])
+    if kwargs.get("created"):
+        withdrawals_made([instance])
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Run ``SQLITE_PRAGMAS`` (see settings.DB_PROFILE) on every new SQLite connection."""
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,37 @@
+from django import template
+
+register = template.Library()
+
+
+class CachedFragmentNode(template.Node):
+
+	def __init__(self, fragments, part, nodelist):
+		self.fragments = fragments
+		self.part = part
+		self.nodelist = nodelist
+
+	def render(self, context):
+		fragments = self.fragments.resolve(context)
+		if not fragments:
+			return self.nodelist.render(context)
+		part = self.part.resolve(context)
+		html = fragments.get(part)
+		if html is None:
+			html = self.nodelist.render(context)
+			fragments.store(part, html)
+		return html
+
+
+@register.tag
+def cached_fragment(parser, token):
+	"""
+	``{% cached_fragment fragments "table" %}...{% endcached_fragment %}``:
+	output the cached HTML of a part of a :class:`main.fragments.TableFragments`,
+	rendering and storing it on a miss.
+	"""
+	bits = token.split_contents()
+	if len(bits) != 3:
+		raise template.TemplateSyntaxError(f"'{bits[0]}' takes a TableFragments and a part name.")
+	nodelist = parser.parse(("endcached_fragment",))
+	parser.delete_first_token()
+	return CachedFragmentNode(parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), nodelist)
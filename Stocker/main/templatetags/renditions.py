@@ -0,0 +1,11 @@
+from django import template
+
+from ..renditions import rendition_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_image(product, kind="thumb"):
+	"""``{% product_image product "thumb" %}``: URL of a product image rendition (see main.renditions.RENDITIONS)."""
+	return rendition_url(product, kind)
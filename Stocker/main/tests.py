@@ -1,3 +1,1702 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO, TextIOWrapper
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.contrib.messages import constants as message_constants
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.http import HttpRequest
+from django.urls import reverse
+from django.utils import timezone
+from django.db import connection, connections, router, transaction, IntegrityError, OperationalError
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import sync_to_async
+from PIL import Image
+
+from .models import Category, Supplier, Product, StockEntry, StockWithdrawal, StockLevel, StockMovementDaily, OutgoingEmail, ApiToken, StockSnapshot, ProductForecast
+from .notifications import check_low_stock, check_expiry, send_queued_emails, scan_alerts
+from .pagination import KeysetPaginator
+from .renditions import RENDITIONS_DIR, rendition_url
+from .routers import pinned_to_primary, replica_reads
+from .importers import import_csv
+from .live import RELOAD, Hub, hub
+from .forecasting import forecast_demand
+from .metrics import percentile, record_request, request_metrics, reset_request_metrics, sql_shape
+from .search import search_products, search_suppliers, match_query
+from .services import withdraw_from_entry, withdraw_from_product, InsufficientStock, FEFO, FIFO
+from .valuation import value_inventory
+from .versioning import INVENTORY_KEY, inventory_version, settled
+from . import dashboard
+
+
+class StockLevelTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Phones")
+        self.supplier = Supplier.objects.create(name="Acme")
+        self.product = Product.objects.create(sku="P-1", name="Phone", category=category)
+        self.other = Product.objects.create(sku="P-2", name="Tablet", category=category)
+
+    def on_hand(self, product):
+        return StockLevel.objects.get(product=product).on_hand
+
+    def add_entry(self, quantity, product=None):
+        return StockEntry.objects.create(product=product or self.product, supplier=self.supplier, quantity=quantity, unit_cost=1)
+
+    def test_entries_update_ledger(self):
+        entry = self.add_entry(10)
+        self.add_entry(5)
+        self.assertEqual(self.on_hand(self.product), 15)
+        entry.quantity = 4
+        entry.save()
+        self.assertEqual(self.on_hand(self.product), 9)
+        entry.delete()
+        self.assertEqual(self.on_hand(self.product), 5)
+
+    def test_moving_entry_to_another_product(self):
+        entry = self.add_entry(10)
+        entry.product = self.other
+        entry.save()
+        self.assertEqual(self.on_hand(self.product), 0)
+        self.assertEqual(self.on_hand(self.other), 10)
+
+    def test_rebuild_command_detects_and_fixes_drift(self):
+        self.add_entry(10)
+        StockLevel.objects.filter(product=self.product).update(on_hand=3)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_stock_levels", "--check", stdout=StringIO())
+        call_command("rebuild_stock_levels", stdout=StringIO())
+        self.assertEqual(self.on_hand(self.product), 10)
+        call_command("rebuild_stock_levels", "--check", stdout=StringIO())
+
+
+class DashboardSnapshotTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Phones")
+
+    def test_snapshot_is_cached_until_a_model_changes(self):
+        snapshot, hit = dashboard.get_dashboard_snapshot()
+        self.assertFalse(hit)
+        self.assertEqual(snapshot["total_categories"], 1)
+        with self.assertNumQueries(0):
+            snapshot, hit = dashboard.get_dashboard_snapshot()
+        self.assertTrue(hit)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name="Laptops")
+        snapshot, hit = dashboard.get_dashboard_snapshot()
+        self.assertFalse(hit)
+        self.assertEqual(snapshot["total_categories"], 2)
+        stats = dashboard.dashboard_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_invalidation_waits_for_the_commit(self):
+        dashboard.get_dashboard_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            # The signal moves the version only once the write commits.
+            Category.objects.create(name="Laptops")
+            snapshot, hit = dashboard.get_dashboard_snapshot()
+            self.assertTrue(hit)
+        snapshot, hit = dashboard.get_dashboard_snapshot()
+        self.assertFalse(hit)
+        self.assertEqual(snapshot["total_categories"], 2)
+
+    def test_waits_for_the_rebuild_in_progress(self):
+        version = dashboard._current_version()
+        cache.add(dashboard.LOCK_KEY.format(version), 1)
+        rebuilt = {"total_categories": 42}
+
+        def other_worker_finishes(seconds):
+            cache.set(dashboard.SNAPSHOT_KEY.format(version), rebuilt)
+
+        with mock.patch.object(dashboard.time, "sleep", other_worker_finishes), \
+                mock.patch.object(dashboard, "build_dashboard_snapshot") as build:
+            snapshot, hit = dashboard.get_dashboard_snapshot()
+        build.assert_not_called()
+        self.assertEqual(snapshot, rebuilt)
+
+
+class WithdrawFromEntryTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Phones")
+        supplier = Supplier.objects.create(name="Acme")
+        self.product = Product.objects.create(sku="P-1", name="Phone", category=category)
+        self.entry = StockEntry.objects.create(product=self.product, supplier=supplier, quantity=10, unit_cost=1)
+
+    def test_withdrawal_decrements_entry_and_ledger(self):
+        withdrawal = withdraw_from_entry(self.entry, 4, reason="DAMAGE")
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.quantity, 6)
+        self.assertEqual(StockLevel.objects.get(product=self.product).on_hand, 6)
+        self.assertEqual((withdrawal.product_id, withdrawal.reason), (self.product.id, "DAMAGE"))
+
+    def test_insufficient_stock_writes_nothing(self):
+        with self.assertRaises(InsufficientStock):
+            withdraw_from_entry(self.entry, 11)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.quantity, 10)
+        self.assertFalse(StockWithdrawal.objects.exists())
+
+
+class WithdrawFromProductTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Food")
+        self.supplier = Supplier.objects.create(name="Farm")
+        self.product = Product.objects.create(sku="F-1", name="Milk", category=category)
+
+    def add_lot(self, quantity, expires_in=None, supplier=None):
+        expiry = date.today() + timedelta(days=expires_in) if expires_in is not None else None
+        return StockEntry.objects.create(product=self.product, supplier=supplier or self.supplier, quantity=quantity, unit_cost=1, expiry_date=expiry)
+
+    def quantities(self, *lots):
+        return [StockEntry.objects.get(pk=lot.pk).quantity for lot in lots]
+
+    def test_fefo_takes_soonest_expiry_first(self):
+        late, never, soon = self.add_lot(5, expires_in=30), self.add_lot(5), self.add_lot(5, expires_in=3)
+        withdrawals = withdraw_from_product(self.product, 7, strategy=FEFO)
+        self.assertEqual(self.quantities(soon, late, never), [0, 3, 5])
+        self.assertEqual([(w.stock_entry_id, w.quantity) for w in withdrawals], [(soon.pk, 5), (late.pk, 2)])
+        self.assertEqual(StockLevel.objects.get(product=self.product).on_hand, 8)
+
+    def test_fifo_takes_oldest_receipt_first(self):
+        first, second = self.add_lot(5, expires_in=30), self.add_lot(5, expires_in=3)
+        withdraw_from_product(self.product, 6, strategy=FIFO)
+        self.assertEqual(self.quantities(first, second), [0, 4])
+
+    def test_insufficient_stock_writes_nothing(self):
+        lot = self.add_lot(5)
+        with self.assertRaises(InsufficientStock):
+            withdraw_from_product(self.product, 6)
+        self.assertEqual(self.quantities(lot), [5])
+        self.assertFalse(StockWithdrawal.objects.exists())
+
+    def test_query_count_does_not_grow_with_lots(self):
+        # The first withdrawal of the day also creates its rollup row.
+        self.add_lot(1)
+        withdraw_from_product(self.product, 1)
+        for _ in range(3):
+            self.add_lot(1)
+        with CaptureQueriesContext(connection) as few:
+            withdraw_from_product(self.product, 3)
+        for _ in range(30):
+            self.add_lot(1)
+        with CaptureQueriesContext(connection) as many:
+            withdraw_from_product(self.product, 30)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(StockWithdrawal.objects.count(), 34)
+
+    def test_view_reports_invalid_input(self):
+        lot = self.add_lot(5)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        response = self.client.post(
+            reverse("main:withdraw_product", args=[self.product.id]),
+            {"quantity": 2, "reason": "SALE", "strategy": "random"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Strategy: Select a valid choice.")
+        self.assertEqual(self.quantities(lot), [5])
+
+    def test_query_count_does_not_grow_with_suppliers(self):
+        suppliers = [self.supplier] + [Supplier.objects.create(name=f"Farm {n}") for n in range(9)]
+        self.add_lot(1)
+        with CaptureQueriesContext(connection) as one:
+            withdraw_from_product(self.product, 1)
+        for supplier in suppliers:
+            self.add_lot(3, supplier=supplier)
+        with CaptureQueriesContext(connection) as several:
+            withdraw_from_product(self.product, 30)
+        self.assertEqual(len(one), len(several))
+        rollups = StockMovementDaily.objects.filter(product=self.product, reason="SALE")
+        self.assertEqual(sorted(rollups.values_list("supplier", "out_qty")), sorted([(self.supplier.pk, 4)] + [(s.pk, 3) for s in suppliers[1:]]))
+
+
+@skipIf(connection.vendor == "sqlite" and connection.is_in_memory_db(), "needs one connection per thread")
+class ConcurrentWithdrawalTests(TransactionTestCase):
+
+    threads = 8
+    attempts_per_thread = 25
+
+    def setUp(self):
+        category = Category.objects.create(name="Phones")
+        supplier = Supplier.objects.create(name="Acme")
+        self.product = Product.objects.create(sku="P-1", name="Phone", category=category)
+        self.entry = StockEntry.objects.create(product=self.product, supplier=supplier, quantity=150, unit_cost=1)
+
+    def test_no_lost_or_negative_quantity_under_contention(self):
+        start = threading.Barrier(self.threads)
+        succeeded = []
+        errors = []
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.attempts_per_thread):
+                    while True:
+                        try:
+                            withdraw_from_entry(self.entry, 1)
+                        except InsufficientStock:
+                            break
+                        except OperationalError:
+                            continue  # SQLite reports lock contention instead of blocking
+                        succeeded.append(1)
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.entry.refresh_from_db()
+        withdrawn = StockWithdrawal.objects.filter(stock_entry=self.entry).count()
+        self.assertEqual(len(succeeded), 150)
+        self.assertEqual(withdrawn, 150)
+        self.assertEqual(self.entry.quantity, 0)
+        self.assertEqual(StockLevel.objects.get(product=self.product).on_hand, 0)
+
+
+class ProductionProfileTests(TransactionTestCase):
+
+    production_pragmas = {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 10000}
+
+    def setUp(self):
+        category = Category.objects.create(name="Phones")
+        supplier = Supplier.objects.create(name="Acme")
+        self.product = Product.objects.create(sku="P-1", name="Phone", category=category)
+        for _ in range(4):
+            StockEntry.objects.create(product=self.product, supplier=supplier, quantity=30, unit_cost=1)
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        connection.close()
+        with self.settings(SQLITE_PRAGMAS=dict(self.production_pragmas, cache_size=-2048)):
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.assertEqual(cursor.fetchone()[0], "wal")
+                cursor.execute("PRAGMA busy_timeout")
+                self.assertEqual(cursor.fetchone()[0], 10000)
+                cursor.execute("PRAGMA cache_size")
+                self.assertEqual(cursor.fetchone()[0], -2048)
+        connection.close()
+
+    def test_immediate_transactions_never_report_a_locked_database(self):
+        threads = 8
+        start = threading.Barrier(threads)
+        errors = []
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(20):
+                    try:
+                        withdraw_from_product(self.product, 1)
+                    except InsufficientStock:
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        connection.close()
+        with self.settings(SQLITE_PRAGMAS=self.production_pragmas), \
+             mock.patch.dict(connection.settings_dict["OPTIONS"], {"transaction_mode": "IMMEDIATE"}):
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+        connection.close()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(StockLevel.objects.get(product=self.product).on_hand, 0)
+        self.assertEqual(StockWithdrawal.objects.aggregate(total=Sum("quantity"))["total"], 120)
+
+
+@override_settings(MANAGER_EMAIL="manager@example.com", EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class EmailOutboxTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Food")
+        supplier = Supplier.objects.create(name="Farm")
+        self.product = Product.objects.create(sku="F-1", name="Milk", category=category, reorder_level=10)
+        self.entry = StockEntry.objects.create(product=self.product, supplier=supplier, quantity=5, unit_cost=1, expiry_date=date.today())
+
+    def test_alerts_are_queued_not_sent(self):
+        check_low_stock(self.product)
+        check_expiry(self.entry)
+        check_low_stock(self.product)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.objects.filter(status="PENDING").count(), 2)
+
+    def test_worker_sends_batch_over_one_connection(self):
+        check_low_stock(self.product)
+        check_expiry(self.entry)
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open") as opened:
+            self.assertEqual(send_queued_emails(), (2, 0))
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(sorted(m.subject for m in mail.outbox), [
+            "[Stocker] Expiry approaching: Milk",
+            "[Stocker] Low stock: Milk (F-1)",
+        ])
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        check_low_stock(self.product)
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("down")):
+            self.assertEqual(send_queued_emails(), (0, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts, email.last_error), ("PENDING", 1, "down"))
+        self.assertGreater(email.next_attempt_at, email.created_at)
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt_at=email.created_at)
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("down")):
+            send_queued_emails()
+        self.assertEqual(OutgoingEmail.objects.get().status, "FAILED")
+
+    def test_sends_outside_the_claiming_transaction(self):
+        check_low_stock(self.product)
+        depth = len(connection.atomic_blocks)
+
+        def send_messages(messages):
+            self.assertEqual(len(connection.atomic_blocks), depth)
+            self.assertEqual(OutgoingEmail.objects.get().status, "SENDING")
+            return len(messages)
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=send_messages):
+            self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual(OutgoingEmail.objects.get().status, "SENT")
+
+    def test_expired_claims_are_sent_again(self):
+        check_low_stock(self.product)
+        check_expiry(self.entry)
+        now = timezone.now()
+        OutgoingEmail.objects.filter(subject__contains="Low stock").update(status="SENDING", next_attempt_at=now - timedelta(seconds=1))
+        OutgoingEmail.objects.filter(subject__contains="Expiry").update(status="SENDING", next_attempt_at=now + timedelta(minutes=5))
+        self.assertEqual(send_queued_emails(), (1, 0))
+        self.assertEqual([m.subject for m in mail.outbox], ["[Stocker] Low stock: Milk (F-1)"])
+
+
+@override_settings(MANAGER_EMAIL="manager@example.com", EXPIRY_ALERT_DAYS=7)
+class ScanAlertsTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name="Food")
+        supplier = Supplier.objects.create(name="Farm")
+        self.low = Product.objects.create(sku="F-1", name="Milk", category=category, reorder_level=10)
+        self.ok = Product.objects.create(sku="F-2", name="Bread", category=category, reorder_level=1)
+        self.soon = StockEntry.objects.create(product=self.ok, supplier=supplier, quantity=5, unit_cost=1, expiry_date=date.today() + timedelta(days=2))
+        self.later = StockEntry.objects.create(product=self.ok, supplier=supplier, quantity=5, unit_cost=1, expiry_date=date.today() + timedelta(days=30))
+        self.empty = StockEntry.objects.create(product=self.ok, supplier=supplier, quantity=0, unit_cost=1, expiry_date=date.today())
+
+    def test_single_digest_and_flags_flipped(self):
+        self.assertEqual(scan_alerts(), (1, 1))
+        email = OutgoingEmail.objects.get()
+        self.assertIn("1 expiring, 1 low stock", email.subject)
+        self.assertIn("Milk", email.body)
+        self.assertEqual(list(StockEntry.objects.filter(expiry_notified=True)), [self.soon])
+        self.assertEqual(list(Product.objects.filter(low_stock_notified=True)), [self.low])
+        self.assertEqual(scan_alerts(), (0, 0))
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+    def test_recovered_products_are_rearmed(self):
+        scan_alerts()
+        StockEntry.objects.create(product=self.low, supplier=self.soon.supplier, quantity=20, unit_cost=1)
+        scan_alerts()
+        self.low.refresh_from_db()
+        self.assertFalse(self.low.low_stock_notified)
+
+    def test_query_count_does_not_grow_with_matches(self):
+        with CaptureQueriesContext(connection) as few:
+            scan_alerts()
+        StockEntry.objects.update(expiry_notified=False, expiry_date=date.today())
+        Product.objects.update(low_stock_notified=False, reorder_level=100)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(scan_alerts(), (2, 2))
+        self.assertEqual(len(few), len(many))
+
+
+@skipIf(connection.vendor != "sqlite", "EXPLAIN QUERY PLAN is SQLite specific")
+class QueryPlanTests(TestCase):
+    """The list and report pages must reach the movement tables through an index."""
+
+    large_tables = ("main_stockentry", "main_stockwithdrawal")
+    pages = [
+        ("main:stock_entries_view", ["", "?search=Pho&order_by=category", "?search=Pho&order_by=supplier"]),
+        ("main:withdrawals_view", ["", "?search=Pho&order_by=date", "?search=P-&order_by=product", "?search=P&order_by=reason"]),
+        ("main:products_view", ["", "?search=Pho&order_by=created_at"]),
+        ("main:inventory_report_view", ["", "?start=2020-01-01&end=2100-01-01&order_by=out"]),
+        ("main:supplier_report_view", ["", "?start=2020-01-01&end=2100-01-01&order_by=current"]),
+        ("main:dashboard_view", [""]),
+    ]
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones")
+        self.supplier = Supplier.objects.create(name="Acme")
+        self.product = Product.objects.create(sku="P-1", name="Phone", category=category)
+        for _ in range(3):
+            entry = StockEntry.objects.create(product=self.product, supplier=self.supplier, quantity=10, unit_cost=1)
+            withdraw_from_entry(entry, 1)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            details = [row[-1] for row in cursor.fetchall()]
+        pattern = re.compile(r"^SCAN (%s)$" % "|".join(self.large_tables))
+        return [detail for detail in details if pattern.match(detail)]
+
+    def assertNoFullScans(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in ctx.captured_queries:
+            sql = query["sql"]
+            if sql.startswith("SELECT") and any(table in sql for table in self.large_tables):
+                self.assertEqual(self.full_scans(sql), [], f"{url} ran a full table scan:\n{sql}")
+
+    def test_list_and_report_pages_use_indexes(self):
+        for name, queries in self.pages:
+            for query in queries:
+                with self.subTest(page=name, query=query):
+                    self.assertNoFullScans(reverse(name) + query)
+
+    def test_detail_pages_use_indexes(self):
+        self.assertNoFullScans(reverse("main:product_detail", args=[self.product.id]))
+        self.assertNoFullScans(reverse("main:supplier_detail", args=[self.supplier.id]))
+
+    def test_alert_scan_uses_partial_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            scan_alerts()
+        entry_query = next(q["sql"] for q in ctx.captured_queries if q["sql"].startswith("SELECT") and "main_stockentry" in q["sql"])
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + entry_query)
+            self.assertIn("entry_expiry_pending_idx", " ".join(row[-1] for row in cursor.fetchall()))
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        category = Category.objects.create(name="Category")
+        # Two products per reorder level so the sort key has ties.
+        for n in range(10):
+            Product.objects.create(sku=f"P-{n}", name=f"Product {n}", category=category, reorder_level=n // 2)
+
+    def walk(self, paginator):
+        pages, page = [], paginator.get_page()
+        pages.append([p.sku for p in page])
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append([p.sku for p in page])
+        return pages, page
+
+    def test_pages_forward_and_back_over_ties(self):
+        paginator = KeysetPaginator(Product.objects.all(), 3, ['-reorder_level'])
+        pages, last = self.walk(paginator)
+        expected = [p.sku for p in Product.objects.order_by('-reorder_level', '-pk')]
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(p) for p in pages], [3, 3, 3, 1])
+        previous = paginator.get_page(last.previous_cursor)
+        self.assertEqual([p.sku for p in previous], pages[2])
+        self.assertTrue(previous.has_next())
+        first = paginator.get_page(paginator.get_page(previous.previous_cursor).previous_cursor)
+        self.assertEqual([p.sku for p in first], pages[0])
+        self.assertFalse(first.has_previous())
+
+    @override_settings(KEYSET_PAGINATION_THRESHOLD=1)
+    def test_list_page_uses_cursor_past_threshold(self):
+        response = self.client.get(reverse("main:products_view"), {"search": "Product"})
+        page = response.context["products"]
+        self.assertTrue(page.is_keyset)
+        self.assertIsNone(response.context["total_products"])
+        self.assertIn("search=Product", page.next_query)
+        response = self.client.get(reverse("main:products_view") + "?" + page.next_query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["products"].has_previous())
+        self.assertEqual(self.client.get(reverse("main:products_view"), {"cursor": "garbage"}).status_code, 200)
+
+    @override_settings(KEYSET_PAGINATION_THRESHOLD=1)
+    def test_cached_page_links_carry_only_the_filters(self):
+        response = self.client.get(reverse("main:products_view"), {"search": "Product", "utm_source": "mail"})
+        self.assertEqual(response.context["products"].first_query, "search=Product")
+        self.assertNotContains(response, "utm_source")
+        # Same filters, same cached table: nothing of the first request leaks in.
+        response = self.client.get(reverse("main:products_view"), {"search": "Product", "ref": "x"})
+        self.assertContains(response, "search=Product&amp;cursor=")
+        self.assertNotContains(response, "utm_source")
+
+    def test_rows_created_in_the_same_millisecond(self):
+        base = timezone.now().replace(microsecond=123000)
+        for n in range(10):
+            Product.objects.filter(sku=f"P-{n}").update(created_at=base + timedelta(microseconds=n * 50))
+        for ordering in (["created_at"], ["-created_at"]):
+            with self.subTest(ordering=ordering):
+                pages, _ = self.walk(KeysetPaginator(Product.objects.all(), 3, ordering))
+                expected = [p.sku for p in Product.objects.order_by(*ordering, ("-" if ordering[0][0] == "-" else "") + "pk")]
+                self.assertEqual(sum(pages, []), expected)
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.drinks = Category.objects.create(name="Drinks")
+        self.cola = Product.objects.create(sku="DR-100", name="Cola Zero", category=self.drinks, description="Sugar free soda")
+        self.juice = Product.objects.create(sku="DR-200", name="Orange Juice", category=self.drinks, description="Contains cola nut extract")
+        self.supplier = Supplier.objects.create(name="Acme Beverages")
+
+    def skus(self, term, **kwargs):
+        return [p.sku for p in search_products(Product.objects.all(), term, **kwargs)]
+
+    def test_match_query_quotes_words_and_prefixes_last(self):
+        self.assertEqual(match_query('cola "zer'), '"cola" "zer"*')
+        self.assertEqual(match_query("  -- "), "")
+
+    def test_prefix_sku_and_category_matches(self):
+        self.assertEqual(self.skus("Oran"), ["DR-200"])
+        self.assertEqual(self.skus("dr-1"), ["DR-100"])
+        self.assertCountEqual(self.skus("drink"), ["DR-100", "DR-200"])
+        self.assertEqual(self.skus("nothing here"), [])
+
+    def test_name_hits_rank_above_description_hits(self):
+        ranked = search_products(Product.objects.all(), "cola", rank=True).order_by("search_rank")
+        self.assertEqual([p.sku for p in ranked], ["DR-100", "DR-200"])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.cola.name = "Root Beer"
+        self.cola.save()
+        self.drinks.name = "Beverages"
+        self.drinks.save()
+        self.assertEqual(self.skus("root"), ["DR-100"])
+        self.assertCountEqual(self.skus("bever"), ["DR-100", "DR-200"])
+        self.juice.delete()
+        self.assertEqual(self.skus("orange"), [])
+        self.supplier.name = "Globex"
+        self.supplier.save()
+        self.assertEqual([s.name for s in search_suppliers(Supplier.objects.all(), "glob")], ["Globex"])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM main_product_fts")
+        self.assertEqual(self.skus("cola"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertCountEqual(self.skus("cola"), ["DR-100", "DR-200"])
+
+
+class MovementRollupTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        category = Category.objects.create(name="Food")
+        self.farm = Supplier.objects.create(name="Farm")
+        self.dairy = Supplier.objects.create(name="Dairy")
+        self.milk = Product.objects.create(sku="F-1", name="Milk", category=category)
+        self.cheese = Product.objects.create(sku="F-2", name="Cheese", category=category)
+
+    def test_reports_do_not_multiply_entries_by_withdrawals(self):
+        first = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=10, unit_cost=1)
+        second = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=5, unit_cost=1)
+        withdraw_from_entry(first, 2)
+        withdraw_from_entry(second, 1, reason="DAMAGE")
+        withdraw_from_product(self.milk, 3)
+        products = {p.name: (p.in_qty, p.out_qty, p.current_stock) for p in self.client.get(reverse("main:inventory_report_view")).context["products"]}
+        self.assertEqual(products, {"Milk": (15, 6, 9), "Cheese": (0, 0, 0)})
+        suppliers = {s.name: (s.in_qty, s.out_qty, s.current_stock) for s in self.client.get(reverse("main:supplier_report_view")).context["suppliers"]}
+        self.assertEqual(suppliers, {"Farm": (15, 6, 9), "Dairy": (0, 0, 0)})
+
+    def test_date_range_and_entry_moves(self):
+        entry = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=10, unit_cost=1)
+        entry.product, entry.supplier = self.cheese, self.dairy
+        entry.save()
+        today = date.today()
+        in_range = {"start": today.isoformat(), "end": today.isoformat()}
+        products = {p.name: p.in_qty for p in self.client.get(reverse("main:inventory_report_view"), in_range).context["products"]}
+        self.assertEqual(products, {"Milk": 0, "Cheese": 10})
+        yesterday = (today - timedelta(days=1)).isoformat()
+        products = {p.name: p.in_qty for p in self.client.get(reverse("main:inventory_report_view"), {"start": yesterday, "end": yesterday}).context["products"]}
+        self.assertEqual(products, {"Milk": 0, "Cheese": 0})
+        entry.delete()
+        self.assertFalse(StockMovementDaily.objects.exclude(in_qty=0, out_qty=0).exists())
+
+    def test_rebuild_command_matches_incremental_rollups(self):
+        entry = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=10, unit_cost=1)
+        withdraw_from_entry(entry, 4)
+        call_command("rebuild_movement_rollups", "--check", stdout=StringIO())
+        StockMovementDaily.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command("rebuild_movement_rollups", "--check", stdout=StringIO())
+        call_command("rebuild_movement_rollups", stdout=StringIO())
+        row = StockMovementDaily.objects.get(reason="SALE")
+        self.assertEqual((row.product_id, row.supplier_id, row.out_qty), (self.milk.pk, self.farm.pk, 4))
+
+    def test_quantity_edits_are_movements(self):
+        entry = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=10, unit_cost=1)
+        withdraw_from_entry(entry, 3)
+        url = reverse("main:inventory_report_view")
+        for quantity in (12, 2):
+            entry.refresh_from_db()
+            entry.quantity = quantity
+            with self.captureOnCommitCallbacks(execute=True):
+                entry.save()
+            with self.subTest(quantity=quantity):
+                as_of = {p.name: p.current_stock for p in self.client.get(url, {"as_of": date.today().isoformat()}).context["products"]}
+                self.assertEqual(as_of["Milk"], StockLevel.objects.get(product=self.milk).on_hand)
+                self.assertEqual(as_of["Milk"], quantity)
+        row = StockMovementDaily.objects.get(reason=StockMovementDaily.CORRECTION)
+        self.assertEqual((row.in_qty, row.out_qty), (5, 10))
+        call_command("rebuild_movement_rollups", "--check", stdout=StringIO())
+        # Moving the edited entry carries its corrections along.
+        entry.refresh_from_db()
+        entry.product, entry.supplier = self.cheese, self.dairy
+        entry.save()
+        net = {(r.product_id, r.supplier_id): 0 for r in StockMovementDaily.objects.all()}
+        for r in StockMovementDaily.objects.all():
+            net[r.product_id, r.supplier_id] += r.in_qty - r.out_qty
+        self.assertEqual(net, {(self.milk.pk, self.farm.pk): 0, (self.cheese.pk, self.dairy.pk): 2})
+
+    def test_rebuild_backfills_unrecorded_corrections(self):
+        entry = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=10, unit_cost=1)
+        withdraw_from_entry(entry, 4)
+        # An edit that bypassed save(), e.g. raw SQL.
+        StockEntry.objects.filter(pk=entry.pk).update(quantity=9)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_movement_rollups", "--check", stdout=StringIO())
+        call_command("rebuild_stock_levels", stdout=StringIO())
+        call_command("rebuild_movement_rollups", stdout=StringIO())
+        call_command("rebuild_movement_rollups", "--check", stdout=StringIO())
+        # Rollups that match the history but not the ledger are reported too.
+        StockLevel.objects.filter(product=self.milk).update(on_hand=1)
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, "1 product(s) off the ledger"):
+            call_command("rebuild_movement_rollups", "--check", stdout=out)
+        self.assertIn("rollups net 9, ledger on hand 1", out.getvalue())
+        row = StockMovementDaily.objects.get(reason=StockMovementDaily.CORRECTION)
+        self.assertEqual((row.date, row.in_qty, row.out_qty), (timezone.localdate(), 3, 0))
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        category = Category.objects.create(name="Food")
+        self.farm = Supplier.objects.create(name="Farm")
+        milk = Product.objects.create(sku="F-1", name="Milk", category=category)
+        Product.objects.create(sku="F-2", name="Cheese", category=category)
+        entry = StockEntry.objects.create(product=milk, supplier=self.farm, quantity=10, unit_cost=1)
+        withdraw_from_entry(entry, 3, note="table 4")
+        withdraw_from_entry(entry, 2, reason="DAMAGE")
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        return [line.split(",") for line in b"".join(response.streaming_content).decode().splitlines()]
+
+    def test_inventory_export_honours_filters_and_order(self):
+        rows = self.export("main:inventory_report_export", order_by="out")
+        self.assertEqual(rows[0][0], "SKU")
+        self.assertEqual(rows[1:], [["F-1", "Milk", "Food", "5", "10", "5", "5"], ["F-2", "Cheese", "Food", "0", "0", "0", "0"]])
+        self.assertEqual([row[0] for row in self.export("main:inventory_report_export", search="chee")[1:]], ["F-2"])
+
+    def test_supplier_and_withdrawal_exports(self):
+        self.assertEqual(self.export("main:supplier_report_export")[1:], [["Farm", "", "", "5", "10", "5"]])
+        rows = self.export("main:withdrawals_export", order_by="reason")
+        self.assertEqual([row[5:] for row in rows[1:]], [["2", "DAMAGE", ""], ["3", "SALE", "table 4"]])
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.export("main:withdrawals_export", start=yesterday, end=yesterday)), 1)
+
+
+class ImportTests(TestCase):
+
+    def setUp(self):
+        Supplier.objects.create(name="Farm")
+        Product.objects.create(sku="F-1", name="Milk", category=Category.objects.create(name="Food"), reorder_level=5)
+
+    def test_products_resolve_and_create_categories(self):
+        result = import_csv("products", StringIO(
+            "SKU,Name,Category,Reorder Level\n"
+            "F-2,Cheese,Food,3\n"
+            "T-1,Hammer,Tools,\n"
+            "F-1,Other milk,Food,\n"
+            "F-3,Cheese,Food,\n"
+            "F-4,Butter,Food,lots\n"
+        ), batch_size=1)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [4, 5, 6])
+        self.assertEqual(Product.objects.get(sku="T-1").category.name, "Tools")
+        self.assertEqual(Product.objects.get(sku="F-2").reorder_level, 3)
+        # The search indexes follow bulk inserts without a save hook.
+        self.assertEqual([p.sku for p in search_products(Product.objects.all(), "hammer")], ["T-1"])
+        self.assertEqual([p.sku for p in search_products(Product.objects.all(), "tools")], ["T-1"])
+
+    def test_stock_entries_update_ledger_rollups_and_alerts_once(self):
+        csv_text = "sku,supplier,quantity,unit_cost,expiry_date\n" + "F-1,Farm,1,2.50,\n" * 3 + "F-1,Nobody,1,1,\nX-9,Farm,1,1,\nF-1,Farm,0,1,\n"
+        with self.settings(MANAGER_EMAIL="manager@example.com"):
+            result = import_csv("stock_entries", StringIO(csv_text), batch_size=2)
+        self.assertEqual(result.created, 3)
+        self.assertEqual([line for line, _ in result.errors], [5, 6, 7])
+        self.assertEqual(StockLevel.objects.get(product__sku="F-1").on_hand, 3)
+        self.assertEqual(set(StockEntry.objects.values_list("initial_quantity", flat=True)), {1})
+        self.assertEqual(StockMovementDaily.objects.get(reason="RECEIPT").in_qty, 3)
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+        self.assertTrue(Product.objects.get(sku="F-1").low_stock_notified)
+
+    def test_missing_columns_and_upload_view(self):
+        result = import_csv("suppliers", StringIO("mobile\n123\n"))
+        self.assertEqual(result.errors, [(1, "Missing column(s): name.")])
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        upload = StringIO("name,email\nAcme,acme@example.com\nBad,not-an-email\n")
+        upload.name = "suppliers.csv"
+        response = self.client.post(reverse("main:import_view"), {"kind": "suppliers", "file": upload})
+        self.assertEqual(response.context["result"].created, 1)
+        self.assertEqual([line for line, _ in response.context["result"].errors], [3])
+        self.assertTrue(Supplier.objects.filter(name="Acme").exists())
+        self.assertEqual([s.name for s in search_suppliers(Supplier.objects.all(), "acme")], ["Acme"])
+
+    def test_unreadable_files_import_nothing(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        for content, error in (
+            (b"name\nAcme\nBest\n" + b'"' + b"x" * 200000 + b'"\n', "Line 4: malformed CSV"),
+            (b"name\nAcme\nBest\n" + "Caf\u00e9\n".encode("latin-1"), "not UTF-8"),
+        ):
+            with self.subTest(error=error):
+                upload = BytesIO(content)
+                upload.name = "suppliers.csv"
+                response = self.client.post(reverse("main:import_view"), {"kind": "suppliers", "file": upload}, follow=True)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, error)
+                self.assertContains(response, "Nothing was imported.")
+                self.assertFalse(Supplier.objects.filter(name="Acme").exists())
+
+    def test_streams_read_once_report_the_rows_kept(self):
+        stream = TextIOWrapper(_NonSeekable(b"name\nAcme\nBest\n" + b"x" * 10000 + b"\nCaf\xe9\n"), encoding="utf-8", newline="")
+        result = import_csv("suppliers", stream, batch_size=1)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.stopped, "The file is not UTF-8 encoded.")
+        self.assertEqual(Supplier.objects.filter(name__in=["Acme", "Best"]).count(), 2)
+
+    def test_new_categories_roll_back_with_their_batch(self):
+        bulk_create = Product.objects.bulk_create
+        calls = []
+
+        def fail_first_batch(objs, *args, **kwargs):
+            calls.append(objs)
+            if len(calls) == 1:
+                raise IntegrityError("boom")
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(Product.objects, "bulk_create", side_effect=fail_first_batch):
+            result = import_csv("products", StringIO("sku,name,category\nT-1,Hammer,Tools\nT-2,Saw,Tools\n"), batch_size=1)
+        self.assertEqual((result.created, [line for line, _ in result.errors]), (1, [2]))
+        self.assertEqual(Category.objects.filter(name="Tools").count(), 1)
+        self.assertEqual(Product.objects.get(sku="T-2").category.name, "Tools")
+
+
+class _NonSeekable(BytesIO):
+
+    def seekable(self):
+        return False
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SLOW_MS=60000, REQUEST_METRICS_SLOW_QUERIES=1000)
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        reset_request_metrics()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(self.admin)
+
+    def test_records_latency_and_queries_per_url_name(self):
+        for _ in range(3):
+            self.client.get(reverse("main:products_view"))
+        row = {row["view"]: row for row in request_metrics()}["main:products_view"]
+        self.assertEqual(row["requests"], 3)
+        self.assertGreater(row["queries"], 0)
+        self.assertLessEqual(row["p50"], row["p99"])
+        out = StringIO()
+        call_command("request_metrics", "--reset", stdout=out)
+        self.assertIn("main:products_view", out.getvalue())
+        self.assertEqual(request_metrics(), [])
+
+    @override_settings(REQUEST_METRICS_SAMPLES=3)
+    def test_keeps_the_latest_samples_per_view(self):
+        for n in range(1, 6):
+            record_request("main:products_view", n, n, 0)
+        record_request("main:dashboard_view", 1, 1, 0)
+        rows = {row["view"]: row for row in request_metrics()}
+        self.assertEqual(sorted(rows), ["main:dashboard_view", "main:products_view"])
+        self.assertEqual((rows["main:products_view"]["requests"], rows["main:products_view"]["queries"]), (3, 4))
+        self.assertEqual(rows["main:products_view"]["p99"], 5000)
+
+    def test_slow_requests_are_logged_with_repeated_sql(self):
+        with self.settings(REQUEST_METRICS_SLOW_QUERIES=0):
+            with self.assertLogs("main.middleware", "WARNING") as logs:
+                self.client.get(reverse("main:dashboard_view"))
+        self.assertIn("main:dashboard_view", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+    def test_metrics_page_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse("main:metrics_view")).status_code, 200)
+        self.client.force_login(User.objects.create_user("clerk", "clerk@example.com", "pass"))
+        self.assertEqual(self.client.get(reverse("main:metrics_view")).status_code, 302)
+
+    def test_helpers(self):
+        self.assertEqual(sql_shape('SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 21'), "SELECT * FROM t WHERE id IN (...) LIMIT N")
+        self.assertEqual([percentile(list(range(1, 101)), p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 99), 7)
+
+
+class QueryCountTests(TestCase):
+    """A page must issue the same number of queries for one row as for a full page."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        self.supplier = Supplier.objects.create(name="Supplier 0")
+        self.product = None
+        self.rows = 0
+        self.add_rows(1)
+
+    def add_rows(self, count):
+        for _ in range(count):
+            n = self.rows = self.rows + 1
+            category = Category.objects.create(name=f"Category {n}")
+            supplier = Supplier.objects.create(name=f"Supplier {n}")
+            product = Product.objects.create(sku=f"P-{n}", name=f"Product {n}", category=category)
+            self.product = self.product or product
+            for owner in (product, self.product):
+                entry = StockEntry.objects.create(product=owner, supplier=supplier, quantity=10, unit_cost=1)
+                StockEntry.objects.create(product=product, supplier=self.supplier, quantity=10, unit_cost=1)
+                withdraw_from_entry(entry, 1)
+
+    def query_count(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(ctx)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        urls = [
+            reverse("main:dashboard_view"),
+            reverse("main:products_view"),
+            reverse("main:products_view") + "?search=Product&order_by=category",
+            reverse("main:categories_view"),
+            reverse("main:suppliers_view"),
+            reverse("main:stock_entries_view"),
+            reverse("main:stock_entries_view") + "?search=Product&order_by=supplier",
+            reverse("main:withdrawals_view"),
+            reverse("main:withdrawals_view") + "?search=Product&order_by=supplier",
+            reverse("main:inventory_report_view"),
+            reverse("main:supplier_report_view"),
+            reverse("main:product_detail", args=[self.product.id]),
+            reverse("main:supplier_detail", args=[self.supplier.id]),
+        ]
+        baseline = {url: self.query_count(url) for url in urls}
+        self.add_rows(12)
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                with self.assertNumQueries(baseline[url]):
+                    self.client.get(url)
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def test_seed_then_compare_against_saved_baseline(self):
+        call_command(
+            "seed_benchmark", categories=3, suppliers=4, products=20, entries=120, withdrawals=200, batch_size=50,
+            stdout=StringIO(),
+        )
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(StockEntry.objects.count(), 120)
+        # The seeded history spans the requested days and stays consistent.
+        self.assertGreater(StockEntry.objects.dates("created_at", "day").count(), 30)
+        call_command("rebuild_stock_levels", check=True, stdout=StringIO())
+        call_command("rebuild_movement_rollups", check=True, stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("seed_benchmark", products=1, stdout=StringIO())
+
+        cache.set(INVENTORY_KEY, "1", None)
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = f"{tmp}/baseline.json"
+            call_command("run_benchmarks", baseline=baseline, save=True, repeat=1, stdout=StringIO())
+            # The shared cache is left alone.
+            self.assertEqual(cache.get(INVENTORY_KEY), "1")
+            saved = json.loads(open(baseline).read())
+            self.assertIn("dashboard", saved)
+            self.assertGreater(saved["products"]["queries"], 0)
+
+            # Slower views or extra queries fail the comparison.
+            saved["products"]["median_ms"] = 0
+            saved["dashboard"]["queries"] = 0
+            with open(baseline, "w") as f:
+                json.dump(saved, f)
+            with self.assertRaisesMessage(CommandError, "dashboard:"):
+                call_command("run_benchmarks", baseline=baseline, repeat=1, slack_ms=0, tolerance=0, stdout=StringIO())
+
+
+def _png(size=(600, 400), color="red"):
+    out = BytesIO()
+    Image.new("RGB", size, color).save(out, "PNG")
+    return out.getvalue()
+
+
+class ImageRenditionTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name, IMAGE_RENDITIONS_ASYNC=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(name="Phones")
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+
+    def add_product(self, sku, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("main:add_product"), {
+                "sku": sku, "name": f"Phone {sku}", "category": self.category.id, "reorder_level": 0,
+                "image": SimpleUploadedFile(f"{sku}.png", image, content_type="image/png"),
+            })
+        return Product.objects.get(sku=sku)
+
+    def test_upload_builds_cropped_webp_renditions_shared_by_content(self):
+        product = self.add_product("P-1", _png())
+        self.assertTrue(product.image_hash)
+        url = rendition_url(product, "thumb")
+        self.assertIn(product.image_hash, url)
+        with default_storage.open(f"{RENDITIONS_DIR}/{url.rsplit('/renditions/', 1)[1]}") as f:
+            thumb = Image.open(f)
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (256, 256)))
+        with default_storage.open(f"{RENDITIONS_DIR}/{rendition_url(product, 'detail').rsplit('/renditions/', 1)[1]}") as f:
+            self.assertEqual(Image.open(f).size, (600, 400))
+
+        # Same bytes under another name reuse the renditions.
+        self.assertEqual(self.add_product("P-2", _png()).image_hash, product.image_hash)
+
+        page = self.client.get(reverse("main:products_view")).content.decode()
+        self.assertIn(url, page)
+        self.assertNotIn(product.image.url, page)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        # Behind the login, so no shared cache may keep it.
+        self.assertIn("private", response["Cache-Control"])
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_original_is_served_until_renditions_exist(self):
+        product = self.add_product("P-1", _png())
+        with self.captureOnCommitCallbacks(execute=False):
+            self.client.post(reverse("main:edit_product", args=[product.id]), {
+                "sku": "P-1", "name": product.name, "category": self.category.id, "reorder_level": 0,
+                "image": SimpleUploadedFile("new.png", _png(color="blue"), content_type="image/png"),
+            })
+        product.refresh_from_db()
+        self.assertEqual(product.image_hash, "")
+        self.assertEqual(rendition_url(product, "thumb"), product.image.url)
+
+    def test_backfill_command(self):
+        default_storage.save("images/products/old.png", BytesIO(_png(color="green")))
+        Product.objects.create(sku="P-1", name="Old", category=self.category, image="images/products/old.png")
+        Product.objects.create(sku="P-2", name="Also old", category=self.category, image="images/products/old.png")
+        default_storage.save(f"{RENDITIONS_DIR}/ab/stale-thumb-256x256.webp", BytesIO(b"x"))
+
+        call_command("build_renditions", prune=True, stdout=StringIO())
+        hashes = set(Product.objects.values_list("image_hash", flat=True))
+        self.assertEqual(len(hashes), 1)
+        self.assertNotEqual(hashes, {""})
+        self.assertFalse(default_storage.exists(f"{RENDITIONS_DIR}/ab/stale-thumb-256x256.webp"))
+        self.assertEqual(self.client.get(rendition_url(Product.objects.first(), "detail")).status_code, 200)
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Phones")
+        self.supplier = Supplier.objects.create(name="Acme")
+        self.phone = Product.objects.create(sku="P-1", name="Phone", category=self.category)
+        self.other = Product.objects.create(sku="P-2", name="Other", category=Category.objects.create(name="Misc"))
+        self.entry = StockEntry.objects.create(product=self.phone, supplier=self.supplier, quantity=10, unit_cost=1)
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(self.user)
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        # The dashboard's ETag also covers the live stream, which no date does.
+        self.assertEqual(response.has_header("Last-Modified"), url != reverse("main:dashboard_view"))
+        return response["ETag"]
+
+    def test_matching_etag_answers_304_without_running_the_view(self):
+        urls = [
+            reverse("main:dashboard_view"),
+            reverse("main:products_view") + "?search=Phone",
+            reverse("main:stock_entries_view"),
+            reverse("main:inventory_report_view"),
+            reverse("main:product_detail", args=[self.phone.id]),
+            reverse("main:supplier_detail", args=[self.supplier.id]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.etag(url)
+                # Only the session and the user are loaded.
+                with self.assertNumQueries(2):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_only_the_affected_versions(self):
+        products = reverse("main:products_view")
+        phone = reverse("main:product_detail", args=[self.phone.id])
+        other = reverse("main:product_detail", args=[self.other.id])
+        supplier = reverse("main:supplier_detail", args=[self.supplier.id])
+        before = {url: self.etag(url) for url in (products, phone, other, supplier)}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            withdraw_from_product(self.phone, 2)
+        after = {url: self.etag(url) for url in before}
+        self.assertNotEqual(after[products], before[products])
+        self.assertNotEqual(after[phone], before[phone])
+        self.assertNotEqual(after[supplier], before[supplier])
+        self.assertEqual(after[other], before[other])
+
+        # Moving the entry to another product changes both products' pages.
+        self.entry.product = self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entry.save()
+        moved = {url: self.etag(url) for url in before}
+        self.assertNotEqual(moved[phone], after[phone])
+        self.assertNotEqual(moved[other], after[other])
+
+        # A category rename shows on the pages of its products.
+        self.category.name = "Mobiles"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertNotEqual(self.etag(phone), moved[phone])
+        self.assertEqual(self.etag(other), moved[other])
+
+    def test_bulk_repairs_change_the_versions(self):
+        products = reverse("main:products_view")
+        phone = reverse("main:product_detail", args=[self.phone.id])
+        other = reverse("main:product_detail", args=[self.other.id])
+        before = {url: self.etag(url) for url in (products, phone, other)}
+
+        # Bulk writes send no signals: the command itself moves the versions.
+        StockLevel.objects.filter(product=self.phone).update(on_hand=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("rebuild_stock_levels", stdout=StringIO())
+        after = {url: self.etag(url) for url in before}
+        self.assertNotEqual(after[products], before[products])
+        self.assertNotEqual(after[phone], before[phone])
+        self.assertEqual(after[other], before[other])
+
+        for command in ("rebuild_movement_rollups", "snapshot_stock"):
+            with self.subTest(command=command):
+                with self.captureOnCommitCallbacks(execute=True):
+                    call_command(command, stdout=StringIO())
+                self.assertNotEqual(self.etag(products), after[products])
+                after[products] = self.etag(products)
+
+    def test_versions_move_when_the_write_commits(self):
+        version = inventory_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            withdraw_from_product(self.phone, 1)
+            # A reader during the transaction still sees the old version.
+            self.assertEqual(inventory_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(inventory_version(), version)
+
+    def test_etag_depends_on_user_and_flash_messages(self):
+        url = reverse("main:products_view")
+        etag = self.etag(url)
+        self.client.force_login(User.objects.create_user("clerk", "clerk@example.com", "pass"))
+        self.assertNotEqual(self.etag(url), etag)
+
+        # A pending message is always rendered, never answered with a 304.
+        self.client.force_login(self.user)
+        self.client.cookies["messages"] = CookieStorage(HttpRequest())._encode([Message(message_constants.ERROR, "Not enough stock.")])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Not enough stock.")
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        Product.objects.create(sku="P-1", name="Phone", category=Category.objects.create(name="Phones"))
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+
+    def test_router(self):
+        self.assertEqual(Product.objects.all().db, "default")
+        with replica_reads():
+            self.assertEqual(Product.objects.all().db, "replica")
+            self.assertEqual(Product.objects.select_for_update().db, "default")
+            self.assertEqual(router.db_for_write(Product), "default")
+            with transaction.atomic():
+                self.assertEqual(Product.objects.all().db, "default")
+            with pinned_to_primary():
+                self.assertEqual(Product.objects.all().db, "default")
+        self.assertFalse(router.allow_migrate("replica", "main"))
+
+    def replica_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(replica)
+
+    def test_reports_read_from_the_replica_until_the_user_writes(self):
+        report = reverse("main:inventory_report_view")
+        self.assertGreater(self.replica_queries(report), 0)
+        self.assertGreater(self.replica_queries(reverse("main:dashboard_view")), 0)
+
+        with self.settings(REPLICA_LAG_SECONDS=30):
+            response = self.client.post(reverse("main:add_category"), {"name": "Laptops"})
+        self.assertEqual(response.cookies["stocker_primary"]["max-age"], 30)
+        self.assertEqual(self.replica_queries(report), 0)
+
+        self.client.cookies.pop("stocker_primary")
+        self.assertGreater(self.replica_queries(report), 0)
+
+    def test_pages_are_not_cached_while_a_separate_replica_may_lag(self):
+        url = reverse("main:products_view")
+        with self.settings(REPLICA_LAG_SECONDS=60), mock.patch("main.versioning.separate_replica", return_value=True):
+            self.assertFalse(settled([dashboard.inventory_version()]))
+            response = self.client.get(url)
+            self.assertFalse(response.has_header("ETag"))
+            self.assertTrue(settled([f"{time.time_ns() - 61 * 10**9:x}"]))
+            self.assertFalse(dashboard.get_dashboard_snapshot()[1])
+            self.assertFalse(dashboard.get_dashboard_snapshot()[1])
+        self.assertTrue(self.client.get(url).has_header("ETag"))
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Phones")
+        self.supplier = Supplier.objects.create(name="Acme")
+        self.products = [
+            Product.objects.create(sku=f"P-{n}", name=f"Phone {n}", category=self.category, reorder_level=2) for n in range(1, 6)
+        ]
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pass")
+        _, self.key = ApiToken.issue(self.admin, "scanner")
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {self.key}"}
+
+    def post(self, name, body, **extra):
+        return self.client.post(reverse(name), json.dumps(body), content_type="application/json", **{**self.auth, **extra})
+
+    def test_authentication_and_permissions(self):
+        url = reverse("main:api_products")
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Token nope").status_code, 401)
+        self.assertEqual(self.client.get(url, **self.auth).status_code, 200)
+
+        clerk = User.objects.create_user("clerk", "clerk@example.com", "pass")
+        _, key = ApiToken.issue(clerk, "erp")
+        response = self.post("main:api_withdrawals_batch", [], HTTP_AUTHORIZATION=f"Token {key}")
+        self.assertEqual(response.status_code, 403)
+
+        # Session clients keep CSRF protection.
+        browser = Client(enforce_csrf_checks=True)
+        browser.force_login(self.admin)
+        self.assertEqual(browser.get(url).status_code, 200)
+        response = browser.post(reverse("main:api_withdrawals_batch"), "[]", content_type="application/json")
+        self.assertEqual((response.status_code, response.json()["error"]), (403, "CSRF check failed."))
+
+    def test_cursor_pagination_and_sparse_fields(self):
+        url = reverse("main:api_products")
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, "fields": "sku,on_hand"}
+            if cursor:
+                params["cursor"] = cursor
+            data = self.client.get(url, params, **self.auth).json()
+            seen += data["results"]
+            cursor = data["next"]
+            if not cursor:
+                break
+        self.assertEqual([row["sku"] for row in seen], [f"P-{n}" for n in range(1, 6)])
+        self.assertEqual(seen[0], {"sku": "P-1", "on_hand": 0})
+
+        detail = self.client.get(reverse("main:api_product", args=[self.products[0].id]), **self.auth).json()
+        self.assertEqual(detail["category_name"], "Phones")
+        self.assertEqual(self.client.get(url, {"fields": "sku,price"}, **self.auth).status_code, 400)
+        self.assertEqual(self.client.get(url, {"cursor": "garbage"}, **self.auth).status_code, 400)
+        self.assertEqual(self.client.get(url, {"category": "x"}, **self.auth).status_code, 400)
+        self.assertEqual(self.client.get(reverse("main:api_product", args=[999]), **self.auth).status_code, 404)
+
+    def test_receipt_batch_reports_each_item(self):
+        items = [
+            {"sku": "P-1", "supplier": "Acme", "quantity": 10, "unit_cost": "2.50"},
+            {"product_id": self.products[1].id, "supplier_id": self.supplier.id, "quantity": 4, "unit_cost": 1},
+            {"sku": "P-404", "supplier": "Acme", "quantity": 1, "unit_cost": 1},
+        ]
+        response = self.post("main:api_stock_entries_batch", {"items": items, "all_or_nothing": True})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StockEntry.objects.exists())
+
+        data = self.post("main:api_stock_entries_batch", {"items": items}).json()
+        self.assertEqual((data["created"], data["failed"]), (2, 1))
+        self.assertEqual([r["status"] for r in data["results"]], ["created", "created", "error"])
+        self.assertEqual(StockEntry.objects.get(pk=data["results"][1]["id"]).product, self.products[1])
+        self.assertEqual(StockLevel.objects.get(product=self.products[0]).on_hand, 10)
+
+        # One bulk write per batch: the query count does not grow with the items.
+        def receive(count):
+            with CaptureQueriesContext(connection) as ctx:
+                self.post("main:api_stock_entries_batch", [{"sku": "P-3", "supplier": "Acme", "quantity": 1, "unit_cost": 1}] * count)
+            return len(ctx)
+        receive(1)  # first receipt of P-3 creates its ledger rows
+        self.assertEqual(receive(5), receive(50))
+
+    def test_withdrawal_batch_applies_items_in_savepoints(self):
+        first = StockEntry.objects.create(product=self.products[0], supplier=self.supplier, quantity=3, unit_cost=1)
+        StockEntry.objects.create(product=self.products[0], supplier=self.supplier, quantity=3, unit_cost=1)
+        items = [
+            {"sku": "P-1", "quantity": 5, "reason": "SALE"},
+            {"stock_entry_id": first.id, "quantity": 5},
+            {"product_id": self.products[0].id, "quantity": 1, "reason": "DAMAGE"},
+            {"sku": "P-2", "quantity": 1, "reason": "BOGUS"},
+        ]
+        response = self.post("main:api_withdrawals_batch", {"items": items, "all_or_nothing": True})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StockWithdrawal.objects.exists())
+        self.assertEqual(StockLevel.objects.get(product=self.products[0]).on_hand, 6)
+
+        data = self.post("main:api_withdrawals_batch", {"items": items}).json()
+        self.assertEqual([r["status"] for r in data["results"]], ["created", "error", "created", "error"])
+        self.assertEqual(len(data["results"][0]["withdrawals"]), 2)
+        self.assertEqual(StockLevel.objects.get(product=self.products[0]).on_hand, 0)
+        self.assertEqual(StockWithdrawal.objects.aggregate(total=Sum("quantity"))["total"], 6)
+        # The product fell below its reorder level: one alert for the batch.
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+
+
+class FragmentCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Phones")
+        self.supplier = Supplier.objects.create(name="Acme")
+        self.phone = Product.objects.create(sku="P-1", name="Phone", category=category)
+        self.cable = Product.objects.create(sku="C-1", name="Cable", category=category)
+        entry = StockEntry.objects.create(product=self.phone, supplier=self.supplier, quantity=10, unit_cost=1)
+        withdraw_from_entry(entry, 2)
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(self.admin)
+
+    def test_repeat_loads_skip_queries_and_rendering(self):
+        urls = [
+            reverse("main:categories_view"),
+            reverse("main:suppliers_view") + "?search=Acme",
+            reverse("main:products_view") + "?order_by=category",
+            reverse("main:stock_entries_view"),
+            reverse("main:withdrawals_view") + "?page=1",
+            reverse("main:inventory_report_view") + "?order_by=net",
+            reverse("main:supplier_report_view"),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                first = self.client.get(url).content
+                with CaptureQueriesContext(connection) as ctx:
+                    second = self.client.get(url).content
+                self.assertEqual(second, first)
+                # Only the session and user lookups remain.
+                self.assertFalse([q["sql"] for q in ctx.captured_queries if '"main_' in q["sql"]])
+
+    def test_filters_and_writes_change_the_fragments(self):
+        url = reverse("main:inventory_report_view")
+        self.assertContains(self.client.get(url, {"search": "Phone"}), "P-1")
+        self.assertNotContains(self.client.get(url, {"search": "Cable"}), "P-1")
+        with self.captureOnCommitCallbacks(execute=True):
+            StockEntry.objects.create(product=self.cable, supplier=self.supplier, quantity=7, unit_cost=1)
+        cable = {p.sku: p.current_stock for p in self.client.get(url, {"search": "Cable"}).context["products"]}
+        self.assertEqual(cable, {"C-1": 7})
+
+    def test_fragments_vary_with_permissions(self):
+        url = reverse("main:products_view")
+        edit = reverse("main:edit_product", args=[self.phone.id])
+        self.assertContains(self.client.get(url), edit)
+        viewer = User.objects.create_user("viewer", "viewer@example.com", "pass")
+        self.client.force_login(viewer)
+        response = self.client.get(url)
+        self.assertNotContains(response, edit)
+        self.assertContains(response, reverse("main:product_detail", args=[self.phone.id]))
+
+
+class StockSnapshotTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Food")
+        self.farm = Supplier.objects.create(name="Farm")
+        self.dairy = Supplier.objects.create(name="Dairy")
+        self.milk = Product.objects.create(sku="F-1", name="Milk", category=category)
+        self.cheese = Product.objects.create(sku="F-2", name="Cheese", category=category)
+        self.today = timezone.localdate()
+        self.day = lambda n: self.today - timedelta(days=n)
+        # Ten days of history: receipts every other day, withdrawals every day.
+        for n in range(10, 0, -1):
+            if n % 2 == 0:
+                StockMovementDaily.add(self.day(n), self.milk.id, self.farm.id, StockMovementDaily.RECEIPT, in_qty=10)
+                StockMovementDaily.add(self.day(n), self.cheese.id, self.dairy.id, StockMovementDaily.RECEIPT, in_qty=4)
+            StockMovementDaily.add(self.day(n), self.milk.id, self.farm.id, "SALE", out_qty=3)
+        StockMovementDaily.add(self.day(7), self.milk.id, self.dairy.id, StockMovementDaily.RECEIPT, in_qty=6)
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "pass")
+        self.client.force_login(self.admin)
+
+    def replayed(self, day):
+        stock = {}
+        for row in StockMovementDaily.objects.filter(date__lte=day):
+            stock[row.product.name] = stock.get(row.product.name, 0) + row.in_qty - row.out_qty
+        return stock
+
+    def report(self, day):
+        response = self.client.get(reverse("main:inventory_report_view"), {"as_of": day.isoformat()})
+        return {p.name: p.current_stock for p in response.context["products"]}
+
+    def test_as_of_matches_replaying_the_history(self):
+        call_command("snapshot_stock", date=self.day(8).isoformat(), stdout=StringIO())
+        call_command("snapshot_stock", date=self.day(4).isoformat(), stdout=StringIO())
+        for n in range(12, -1, -1):
+            with self.subTest(days_ago=n):
+                expected = {"Milk": 0, "Cheese": 0, **self.replayed(self.day(n))}
+                self.assertEqual(self.report(self.day(n)), expected)
+
+    def test_snapshots_build_on_each_other(self):
+        out = StringIO()
+        call_command("snapshot_stock", date=self.day(6).isoformat(), stdout=out)
+        self.assertIn("full history", out.getvalue())
+        call_command("snapshot_stock", stdout=out)
+        self.assertIn(f"snapshot of {self.day(6)}", out.getvalue())
+        incremental = set(StockSnapshot.objects.filter(date=self.day(1)).values_list("product", "supplier", "on_hand"))
+        call_command("snapshot_stock", date=self.day(1).isoformat(), full=True, stdout=StringIO())
+        self.assertEqual(set(StockSnapshot.objects.filter(date=self.day(1)).values_list("product", "supplier", "on_hand")), incremental)
+        self.assertEqual(incremental, {(self.milk.id, self.farm.id, 20), (self.milk.id, self.dairy.id, 6), (self.cheese.id, self.dairy.id, 20)})
+        with self.assertRaises(CommandError):
+            call_command("snapshot_stock", date=self.today.isoformat(), stdout=StringIO())
+
+    def test_backdated_corrections_reach_later_snapshots(self):
+        entry = StockEntry.objects.create(product=self.cheese, supplier=self.farm, quantity=5, unit_cost=Decimal("2.00"))
+        # Received five days ago, as if entered back then.
+        StockEntry.objects.filter(pk=entry.pk).update(created_at=timezone.now() - timedelta(days=5))
+        StockMovementDaily.objects.filter(product=self.cheese, supplier=self.farm, date=self.today).update(date=self.day(5))
+        entry.refresh_from_db()
+        call_command("snapshot_stock", date=self.day(6).isoformat(), stdout=StringIO())
+        call_command("snapshot_stock", date=self.day(3).isoformat(), stdout=StringIO())
+        call_command("snapshot_stock", stdout=StringIO())
+        self.assertEqual(self.report(self.day(2))["Cheese"], 25)
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.delete()
+        for n in (6, 4, 3, 2, 1):
+            with self.subTest(days_ago=n):
+                self.assertEqual(self.report(self.day(n)), {"Milk": 0, "Cheese": 0, **self.replayed(self.day(n))})
+        self.assertFalse(StockSnapshot.objects.filter(product=self.cheese, supplier=self.farm).exists())
+        call_command("snapshot_stock", date=self.day(1).isoformat(), full=True, stdout=StringIO())
+        self.assertEqual(StockSnapshot.objects.get(date=self.day(1), product=self.cheese).on_hand, 20)
+
+
+class ValuationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.farm = Supplier.objects.create(name="Farm")
+        self.dairy = Supplier.objects.create(name="Dairy")
+        self.milk = Product.objects.create(sku="F-1", name="Milk", category=Category.objects.create(name="Drinks"))
+        self.cheese = Product.objects.create(sku="F-2", name="Cheese", category=Category.objects.create(name="Food"))
+        now = timezone.now()
+        self.day = lambda n: timezone.localdate() - timedelta(days=n)
+
+        def backdate(model, obj, days):
+            model.objects.filter(pk=obj.pk).update(created_at=now - timedelta(days=days))
+
+        first = StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=10, unit_cost="1.00")
+        second = StockEntry.objects.create(product=self.milk, supplier=self.dairy, quantity=10, unit_cost="2.00")
+        backdate(StockEntry, first, 3)
+        backdate(StockEntry, second, 2)
+        # FIFO values by receipt order, whichever lot a withdrawal physically took.
+        backdate(StockWithdrawal, withdraw_from_entry(second, 5), 2)
+        for withdrawal in withdraw_from_product(self.milk, 8):
+            backdate(StockWithdrawal, withdrawal, 1)
+        StockEntry.objects.create(product=self.milk, supplier=self.farm, quantity=4, unit_cost="3.00")
+        StockEntry.objects.create(product=self.cheese, supplier=self.farm, quantity=2, unit_cost="5.00")
+        call_command("rebuild_movement_rollups", stdout=StringIO())
+
+    def figures(self, line):
+        return {column: (line.units[column], line.values[column]) for column in line.units}
+
+    def test_fifo_consumes_the_oldest_receipts(self):
+        valuation = value_inventory(method="fifo")
+        self.assertEqual(self.figures(valuation.by_id[self.milk.id]), {
+            "opening": (0, Decimal("0.00")),
+            "received": (24, Decimal("42.00")),
+            "withdrawn": (13, Decimal("16.00")),
+            "closing": (11, Decimal("26.00")),
+        })
+        self.assertEqual(valuation.total.values["closing"], Decimal("36.00"))
+        suppliers = value_inventory(method="fifo", group="suppliers")
+        self.assertEqual(self.figures(suppliers.by_id[self.dairy.id])["withdrawn"], (3, Decimal("6.00")))
+        self.assertEqual(self.figures(suppliers.by_id[self.farm.id])["closing"], (6, Decimal("22.00")))
+        self.assertEqual(suppliers.total.values, valuation.total.values)
+        categories = value_inventory(method="fifo", group="categories")
+        self.assertEqual([line.label for line in categories.lines], ["Drinks", "Food"])
+
+        period = value_inventory(self.day(1), self.day(1), "fifo")
+        self.assertEqual(self.figures(period.by_id[self.milk.id]), {
+            "opening": (15, Decimal("25.00")),
+            "received": (0, Decimal("0.00")),
+            "withdrawn": (8, Decimal("11.00")),
+            "closing": (7, Decimal("14.00")),
+        })
+        self.assertNotIn(self.cheese.id, period.by_id)
+
+    def test_closing_units_follow_quantity_edits(self):
+        lot = StockEntry.objects.get(product=self.cheese)
+        for quantity in (1, 2):
+            lot.quantity = quantity
+            lot.save()
+            for method in ("fifo", "average"):
+                with self.subTest(quantity=quantity, method=method):
+                    closing = value_inventory(method=method).by_id[self.cheese.id].units["closing"]
+                    self.assertEqual(closing, StockLevel.objects.get(product=self.cheese).on_hand)
+        call_command("rebuild_movement_rollups", "--check", stdout=StringIO())
+
+    def test_weighted_average_pools_opening_stock_and_receipts(self):
+        valuation = value_inventory(method="average")
+        milk = self.figures(valuation.by_id[self.milk.id])
+        self.assertEqual((milk["withdrawn"], milk["closing"]), ((13, Decimal("22.75")), (11, Decimal("19.25"))))
+        period = self.figures(value_inventory(self.day(1), self.day(1), "average").by_id[self.milk.id])
+        self.assertEqual(period["opening"], (15, Decimal("22.50")))
+        self.assertEqual(period["withdrawn"], (8, Decimal("12.00")))
+        self.assertEqual(period["closing"], (7, Decimal("10.50")))
+        with self.assertRaises(ValueError):
+            value_inventory(method="lifo")
+
+    def test_standard_sql_matches_the_sqlite_spelling(self):
+        # SQLite lacks GREATEST/LEAST: stand them in to run what other backends get.
+        connection.ensure_connection()
+        connection.connection.create_function("GREATEST", 2, max)
+        connection.connection.create_function("LEAST", 2, min)
+        periods = [(None, None), (self.day(2), self.day(1)), (self.day(1), None)]
+        for method in ("fifo", "average"):
+            for group in ("products", "suppliers"):
+                for start, end in periods:
+                    with self.subTest(method=method, group=group, start=start, end=end):
+                        native = value_inventory(start, end, method, group)
+                        with mock.patch.dict("main.valuation.DIALECTS", clear=True):
+                            portable = value_inventory(start, end, method, group)
+                        self.assertEqual(
+                            {pk: self.figures(line) for pk, line in portable.by_id.items()},
+                            {pk: self.figures(line) for pk, line in native.by_id.items()},
+                        )
+
+    def test_report_and_export(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        response = self.client.get(reverse("main:valuation_report_view"), {"group": "suppliers", "method": "average"})
+        self.assertEqual([line.label for line in response.context["lines"]], ["Dairy", "Farm"])
+        self.assertContains(response, "Weighted average")
+        response = self.client.get(reverse("main:valuation_report_export"), {"group": "categories"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "Category,Opening Qty,Opening Value,Received Qty,Received Value,Withdrawn Qty,Withdrawn Value,Closing Qty,Closing Value")
+        self.assertEqual(lines[1], "Drinks,0,0.00,24,42.00,13,16.00,11,26.00")
+
+
+@override_settings(FORECAST_WINDOW_DAYS=7, FORECAST_LEAD_TIME_DAYS=7, FORECAST_ORDER_CYCLE_DAYS=14, FORECAST_SERVICE_FACTOR=1.65)
+class ForecastTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Food")
+        farm = Supplier.objects.create(name="Farm")
+        self.milk = Product.objects.create(sku="F-1", name="Milk", category=category, reorder_level=5)
+        self.cheese = Product.objects.create(sku="F-2", name="Cheese", category=category, reorder_level=5)
+        self.bread = Product.objects.create(sku="F-3", name="Bread", category=category, reorder_level=5)
+        day = lambda n: timezone.localdate() - timedelta(days=n)
+        for product, received, n in ((self.milk, 100, 30), (self.cheese, 10, 3), (self.bread, 10, 30)):
+            StockMovementDaily.add(day(n), product.id, farm.id, StockMovementDaily.RECEIPT, in_qty=received)
+            StockLevel.adjust(product.id, received)
+        for product, quantity, n, reason in (
+            (self.milk, 4, 1, "SALE"), (self.milk, 2, 2, "SALE"), (self.milk, 50, 1, "DAMAGE"),
+            (self.milk, 9, 8, "SALE"),  # before the window
+            (self.cheese, 3, 1, "SALE"),
+            (self.bread, 2, 0, "SALE"),  # today has not ended
+        ):
+            StockMovementDaily.add(day(n), product.id, farm.id, reason, out_qty=quantity)
+            StockLevel.adjust(product.id, -quantity)
+
+    def test_demand_cover_and_suggestions(self):
+        forecasts = {forecast.product_id: forecast for forecast in forecast_demand()}
+        self.assertEqual(set(forecasts), {self.milk.id, self.cheese.id})
+
+        milk = forecasts[self.milk.id]
+        # 4 and 2 units over 7 days, zero days included.
+        self.assertEqual(milk.window_days, 7)
+        self.assertAlmostEqual(milk.daily_demand, 6 / 7)
+        self.assertAlmostEqual(milk.demand_std, ((20 - 36 / 7) / 6) ** 0.5)
+        self.assertEqual(milk.on_hand, 35)
+        self.assertAlmostEqual(milk.days_of_cover, 35 / (6 / 7))
+        self.assertEqual((milk.reorder_level, milk.order_quantity), (13, 0))
+
+        # Stocked three days ago: its demand is averaged over those days only.
+        cheese = forecasts[self.cheese.id]
+        self.assertEqual(cheese.window_days, 3)
+        self.assertAlmostEqual(cheese.daily_demand, 1)
+        self.assertAlmostEqual(cheese.days_of_cover, 7)
+        self.assertEqual((cheese.reorder_level, cheese.order_quantity), (15, 22))
+
+    def test_command_stores_forecasts_for_the_products_page(self):
+        call_command("forecast_demand", stdout=StringIO())
+        self.assertEqual(ProductForecast.objects.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.cheese.pk).reorder_level, 5)
+        call_command("forecast_demand", "--apply", stdout=StringIO())
+        self.assertEqual(ProductForecast.objects.count(), 2)
+        self.assertEqual(Product.objects.get(pk=self.cheese.pk).reorder_level, 15)
+        self.assertEqual(Product.objects.get(pk=self.bread.pk).reorder_level, 5)
+
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        response = self.client.get(reverse("main:products_view"))
+        cover = {product.name: product.days_of_cover for product in response.context["products"]}
+        self.assertAlmostEqual(cover["Cheese"], 7)
+        self.assertIsNone(cover["Bread"])
+        response = self.client.get(reverse("main:forecast_report_view"))
+        self.assertEqual([f.product.name for f in response.context["forecasts"]], ["Cheese", "Milk"])
+        with self.assertRaises(CommandError):
+            call_command("forecast_demand", "--window", "0", stdout=StringIO())
+
+
+class LiveDashboardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def parse(self, frame):
+        fields = dict(line.split(": ", 1) for line in frame.decode().strip().splitlines())
+        return fields["event"], json.loads(fields["data"])
+
+    async def test_hub_fans_out_and_resumes(self):
+        local = Hub()
+        first, second = local.stream(), local.stream()
+        self.assertEqual(await anext(first), b"retry: 5000\n\n")
+        await anext(second)
+        self.assertTrue(local.listening)
+        local.broadcast("totals", {"total_stock_qty": 3})
+        frame = await anext(first)
+        self.assertEqual(await anext(second), frame)
+        self.assertEqual(self.parse(frame), ("totals", {"total_stock_qty": 3}))
+
+        seen = local.last_event_id
+        local.broadcast("totals", {"total_stock_qty": 5})
+        resumed = local.stream(seen)
+        await anext(resumed)
+        self.assertEqual(self.parse(await anext(resumed)), ("totals", {"total_stock_qty": 5}))
+        # An id from another process (or one that left the history) can't be resumed.
+        stale = local.stream("0-1")
+        await anext(stale)
+        self.assertEqual(await anext(stale), RELOAD)
+        for stream in (first, second, resumed, stale):
+            await stream.aclose()
+        self.assertFalse(local.listening)
+
+    def test_dashboard_etag_changes_with_the_hub(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        url = reverse("main:dashboard_view")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+        # A restarted process has a new boot id: the old page would only be told to reload.
+        with mock.patch.object(hub, "_boot", "restarted"):
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "restarted-")
+
+    @override_settings(LIVE_CLIENT_QUEUE_SIZE=2)
+    async def test_slow_clients_are_told_to_reload(self):
+        local = Hub()
+        stream = local.stream()
+        await anext(stream)
+        for n in range(3):
+            local.broadcast("totals", {"total_stock_qty": n})
+        self.assertEqual(await anext(stream), RELOAD)
+        await stream.aclose()
+
+    def receive(self, product, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            StockEntry.objects.create(product=product, supplier=self.supplier, quantity=quantity, unit_cost="1.00")
+
+    def withdraw(self, product, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            withdraw_from_product(product, quantity)
+
+    async def next_events(self, stream, until):
+        events = {}
+        while until not in events:
+            event, data = self.parse(await asyncio.wait_for(anext(stream), 5))
+            events.setdefault(event, []).append(data)
+        return events
+
+    @override_settings(LIVE_COALESCE_SECONDS=0.05)
+    async def test_stock_changes_reach_every_open_dashboard(self):
+        category = await Category.objects.acreate(name="Food")
+        self.supplier = await Supplier.objects.acreate(name="Farm")
+        milk = await Product.objects.acreate(sku="F-1", name="Milk", category=category, reorder_level=5)
+        await sync_to_async(self.receive)(milk, 6)
+        user = await sync_to_async(User.objects.create_superuser)("admin", "admin@example.com", "pass")
+        await self.async_client.aforce_login(user)
+
+        response = await self.async_client.get(reverse("main:dashboard_events"))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        await anext(stream)
+        other = hub.stream()
+        await anext(other)
+
+        await sync_to_async(self.withdraw)(milk, 4)
+        events = await self.next_events(stream, "totals")
+        self.assertEqual([w["quantity"] for w in events["withdrawal"]], [4])
+        self.assertEqual(events["low_stock"], [{"id": milk.id, "sku": "F-1", "name": "Milk", "on_hand": 2, "reorder_level": 5, "low": True}])
+        self.assertEqual(events["totals"], [{"total_stock_qty": 2, "low_stock_count": 1}])
+        self.assertEqual(await self.next_events(other, "totals"), events)
+
+        await sync_to_async(self.receive)(milk, 10)
+        events = await self.next_events(stream, "totals")
+        self.assertEqual([(e["product"], e["supplier"], e["quantity"]) for e in events["entry"]], [("Milk", "Farm", 10)])
+        self.assertFalse(events["low_stock"][0]["low"])
+        self.assertEqual(events["totals"], [{"total_stock_qty": 12, "low_stock_count": 0}])
+        await other.aclose()
+        await stream.aclose()
+
+    def test_dashboard_carries_the_resume_point_and_wsgi_gets_no_stream(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "pass"))
+        response = self.client.get(reverse("main:dashboard_view"))
+        self.assertEqual(response.context["live_last_event_id"], hub.last_event_id)
+        self.assertEqual(self.client.get(reverse("main:dashboard_events")).status_code, 204)
@@ -1,17 +1,21 @@
 from django.urls import path 
 from . import views  
+from . import api
 
 app_name = "main"
 
 urlpatterns = [ 
     path('', views.home_view, name='home_view'),
     path('dashboard/', views.dashboard_view, name='dashboard_view'),
+    path('dashboard/events/', views.dashboard_events, name='dashboard_events'),
     # Product
     path('products/', views.products_view, name='products_view'),
     path('products/add/', views.add_product, name='add_product'),
     path('products/details/<product_id>', views.product_detail, name='product_detail'),
     path('products/edit/<product_id>', views.edit_product, name='edit_product'),
     path('products/delete/<product_id>', views.delete_product, name='delete_product'),
+    path('products/withdraw/<product_id>', views.withdraw_product, name='withdraw_product'),
+    path('renditions/<path:path>', views.rendition_view, name='rendition_view'),
     # Category
     path('categories/', views.categories_view, name='categories_view'),
     path('categories/add/', views.add_category, name='add_category'),
@@ -30,7 +34,27 @@ urlpatterns = [
     path('stock_entry/delete/<stock_entry_id>', views.delete_stock_entry, name='delete_stock_entry'),
     path('stock_entry/withdraw/<stock_entry_id>', views.withdraw_stock_entry, name='withdraw_stock_entry'),
     path('stock_withdraw/all/', views.withdrawals_view, name='withdrawals_view'),
+    path('stock_withdraw/export/', views.withdrawals_export, name='withdrawals_export'),
+    path('import/', views.import_view, name='import_view'),
+    path('metrics/', views.metrics_view, name='metrics_view'),
+    # JSON API
+    path('api/products/', api.products_list, name='api_products'),
+    path('api/products/<int:pk>/', api.product_detail, name='api_product'),
+    path('api/suppliers/', api.suppliers_list, name='api_suppliers'),
+    path('api/suppliers/<int:pk>/', api.supplier_detail, name='api_supplier'),
+    path('api/stock-entries/', api.stock_entries_list, name='api_stock_entries'),
+    path('api/stock-entries/<int:pk>/', api.stock_entry_detail, name='api_stock_entry'),
+    path('api/stock-entries/batch/', api.stock_entries_batch, name='api_stock_entries_batch'),
+    path('api/withdrawals/', api.withdrawals_list, name='api_withdrawals'),
+    path('api/withdrawals/<int:pk>/', api.withdrawal_detail, name='api_withdrawal'),
+    path('api/withdrawals/batch/', api.withdrawals_batch, name='api_withdrawals_batch'),
     # Reports 
     path('reports/inventory/', views.inventory_report_view, name='inventory_report_view'),
+    path('reports/inventory/export/', views.inventory_report_export, name='inventory_report_export'),
     path('reports/supplier/', views.supplier_report_view, name='supplier_report_view'),
+    path('reports/supplier/export/', views.supplier_report_export, name='supplier_report_export'),
+    path('reports/valuation/', views.valuation_report_view, name='valuation_report_view'),
+    path('reports/valuation/export/', views.valuation_report_export, name='valuation_report_export'),
+    path('reports/forecast/', views.forecast_report_view, name='forecast_report_view'),
+    path('reports/forecast/export/', views.forecast_report_export, name='forecast_report_export'),
 ] 
\ No newline at end of file
@@ -0,0 +1,131 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import partial, wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .routers import separate_replica
+
+INVENTORY_KEY = "main:version:inventory"
+OBJECT_KEY = "main:version:{}:{}"
+
+
+def inventory_version():
+	"""Token that changes on every write to the inventory (see :func:`bump_versions`)."""
+	return _versions([INVENTORY_KEY])[0]
+
+
+def object_version(kind, pk):
+	"""Token of one product or supplier page; ``kind`` is "product" or "supplier"."""
+	return _versions([OBJECT_KEY.format(kind, pk)])[0]
+
+
+def bump_versions(product_ids=(), supplier_ids=()):
+	"""
+	Record a write: move the inventory-wide token (which also retires the
+	cached dashboard snapshot) and drop the tokens of the given products and
+	suppliers, so their pages get fresh ones on the next read.
+
+	Inside a transaction this happens once it commits: a token moved earlier
+	would let a concurrent reader cache the pre-commit data under it.
+	"""
+	keys = [OBJECT_KEY.format("product", pk) for pk in product_ids]
+	keys += [OBJECT_KEY.format("supplier", pk) for pk in supplier_ids]
+	transaction.on_commit(partial(_bump, keys))
+
+
+def version_time(token):
+	"""When ``token`` was issued: tokens are hex nanosecond timestamps."""
+	return datetime.fromtimestamp(int(token, 16) / 1e9, tz=timezone.utc)
+
+
+def settled(tokens):
+	"""
+	Whether a page built now reflects every write behind ``tokens``. A
+	separate replica may lag up to ``REPLICA_LAG_SECONDS`` behind a write;
+	until then the page must not be cached under the new version.
+	"""
+	if not separate_replica():
+		return True
+	lag = getattr(settings, "REPLICA_LAG_SECONDS", 5) * 1_000_000_000
+	return time.time_ns() - max(int(token, 16) for token in tokens) >= lag
+
+
+def conditional_on_versions(version_keys, etag_extra=None):
+	"""
+	Answer ``If-None-Match`` / ``If-Modified-Since`` with a 304 before the
+	view runs. ``version_keys(*args, **kwargs)`` names the versions the page
+	is built from (``[INVENTORY_KEY]`` or an ``OBJECT_KEY``); the ETag also
+	covers the user, whose permissions change the page. Requests carrying
+	flash messages always get the full page so the messages are shown.
+
+	``etag_extra()`` returns anything else the page embeds that changes
+	without a write (it survives restarts the cached versions don't); such
+	pages only get an ETag, as no modification time covers it.
+	"""
+	def decorator(view):
+		@wraps(view)
+		def wrapper(request, *args, **kwargs):
+			if request.method not in ("GET", "HEAD") or len(messages.get_messages(request)):
+				return view(request, *args, **kwargs)
+			tokens = _versions(version_keys(*args, **kwargs))
+			if not settled(tokens):
+				response = view(request, *args, **kwargs)
+				patch_cache_control(response, private=True, no_cache=True)
+				return response
+			extra = etag_extra() if etag_extra else ""
+			digest = hashlib.blake2b(f"{request.user.pk}:{':'.join(tokens)}:{extra}".encode(), digest_size=12).hexdigest()
+			etag = quote_etag(digest)
+			last_modified = None if etag_extra else int(max(version_time(token) for token in tokens).timestamp())
+			response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+			if response is None:
+				response = view(request, *args, **kwargs)
+				if response.status_code == 200:
+					response.headers.setdefault("ETag", etag)
+					if last_modified is not None:
+						response.headers.setdefault("Last-Modified", http_date(last_modified))
+			# Let browsers keep the page but revalidate it on every use.
+			patch_cache_control(response, private=True, no_cache=True)
+			return response
+		return wrapper
+	return decorator
+
+
+def inventory_keys(*args, **kwargs):
+	return [INVENTORY_KEY]
+
+
+def product_keys(product_id, **kwargs):
+	return [OBJECT_KEY.format("product", product_id)]
+
+
+def supplier_keys(supplier_id, **kwargs):
+	return [OBJECT_KEY.format("supplier", supplier_id)]
+
+
+def _bump(keys):
+	cache.set(INVENTORY_KEY, _new_token(), None)
+	if keys:
+		cache.delete_many(keys)
+
+
+def _versions(keys):
+	found = cache.get_many(keys)
+	missing = {key: _new_token() for key in keys if key not in found}
+	if missing:
+		# add() keeps a token another process set in the meantime.
+		for key, token in missing.items():
+			cache.add(key, token, None)
+		found.update(cache.get_many(list(missing)))
+	# Without a working cache every read is a new version: never a 304.
+	return [found.get(key) or missing[key] for key in keys]
+
+
+def _new_token():
+	return f"{time.time_ns():x}"
@@ -1,46 +1,74 @@
 from django.shortcuts import render, redirect
-from django.http import HttpRequest, HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.contrib import messages
-from django.contrib.auth.decorators import login_required, permission_required
-from .models import Category, Supplier, Product, StockEntry, StockWithdrawal
-from .forms import CategoryForm, SupplierForm, ProductForm, StockEntryForm, StockWithdrawalForm
+from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
+from .models import Category, Supplier, Product, ProductForecast, StockEntry, StockWithdrawal, StockLevel, StockMovementDaily, StockSnapshot
+from .forms import CategoryForm, SupplierForm, ProductForm, StockEntryForm, StockWithdrawalForm, ProductWithdrawalForm
+from .dashboard import get_dashboard_snapshot
+from .metrics import request_metrics, reset_request_metrics
+from .notifications import check_low_stock, check_expiry
+from .services import withdraw_from_entry, withdraw_from_product, InsufficientStock, ALLOCATION_STRATEGIES
 from django.core.paginator import Paginator
-from django.db.models import Sum, Q, F
-
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from .pagination import paginate
+from .search import search_products, search_suppliers, search_ranked
+from .exports import stream_csv, EXPORT_CHUNK_SIZE
+from .fragments import TableFragments
+from .importers import IMPORTERS, import_csv, text_stream
+from .live import hub
+from .renditions import RENDITIONS_DIR
+from .routers import read_from_replica
+from .valuation import COLUMNS, GROUPS, METHODS, cached_valuation
+from .versioning import conditional_on_versions, inventory_keys, product_keys, supplier_keys
+from django.core.exceptions import PermissionDenied
 from django.conf import settings
-from datetime import date, timedelta
+from django.db import router
+from django.db.models import Sum, Q, F, OuterRef, Subquery, Value, ExpressionWrapper, FloatField
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_date
+from django.views.static import serve
+from datetime import datetime, time, timedelta
+from pathlib import Path
 
 def home_view(request: HttpRequest):
 	return render(request, "main/index.html")
 
 @login_required
+# The page embeds the live stream's last event id: a page from before a
+# restart must not be revalidated, or the stream keeps asking it to reload.
+@conditional_on_versions(inventory_keys, etag_extra=lambda: hub.last_event_id)
+@read_from_replica
 def dashboard_view(request: HttpRequest):
-	total_products = Product.objects.count()
-	total_categories = Category.objects.count()
-	total_suppliers = Supplier.objects.count()
-	total_stock_qty = StockEntry.objects.aggregate(total=Sum('quantity'))['total'] or 0
-	low_stock_count = Product.objects.annotate(qty=Sum('stockentry__quantity', default=0)).filter(qty__lt=F('reorder_level')).count() if hasattr(Product, 'reorder_level') else 0
-	recent_entries = StockEntry.objects.select_related('product','supplier').order_by('-created_at')[:5]
-	recent_withdrawals = StockWithdrawal.objects.select_related('product','stock_entry__supplier').order_by('-created_at')[:5]
-	top_categories = Category.objects.annotate(qty=Sum('product__stockentry__quantity', default=0)).order_by('-qty')[:5]
-	top_suppliers = Supplier.objects.annotate(qty=Sum('stockentry__quantity', default=0)).order_by('-qty')[:5]
-	return render(request, "main/dashboard.html", {
-		'total_products': total_products,
-		'total_categories': total_categories,
-		'total_suppliers': total_suppliers,
-		'total_stock_qty': total_stock_qty,
-		'low_stock_count': low_stock_count,
-		'recent_entries': recent_entries,
-		'recent_withdrawals': recent_withdrawals,
-		'top_categories': top_categories,
-		'top_suppliers': top_suppliers,
-	})
+	# Taken first: the live stream replays anything published while the snapshot is read.
+	last_event_id = hub.last_event_id
+	snapshot, hit = get_dashboard_snapshot()
+	response = render(request, "main/dashboard.html", {**snapshot, 'live_last_event_id': last_event_id})
+	response['X-Dashboard-Cache'] = "hit" if hit else "miss"
+	return response
+
+@login_required
+async def dashboard_events(request: HttpRequest):
+	"""Server-Sent Events stream of the dashboard's changes (see main.live); needs ASGI."""
+	if not isinstance(request, ASGIRequest):
+		# A WSGI worker would be held for the whole stream. 204 stops EventSource from reconnecting.
+		return HttpResponse(status=204)
+	last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+	response = StreamingHttpResponse(hub.stream(last_event_id), content_type="text/event-stream")
+	response['Cache-Control'] = "no-cache"
+	# Keep proxies (nginx) from buffering the stream.
+	response['X-Accel-Buffering'] = "no"
+	return response
 
 #===========[Category]===========
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def categories_view(request: HttpRequest):
+	fragments = TableFragments(request, "categories", perms=['main.change_category', 'main.delete_category'])
+	if fragments.complete:
+		return render(request, "main/category/all.html", {'fragments': fragments})
 	categories = Category.objects.all()
 	if 'search' in request.GET:
 		categories = categories.filter(Q(name__icontains=request.GET['search']))
@@ -48,7 +76,7 @@ def categories_view(request: HttpRequest):
 	page_number = request.GET.get("page",1)
 	paginator = Paginator(categories,7)
 	categories_page = paginator.get_page(page_number)
-	return render(request, "main/category/all.html", {'categories':categories_page, 'total_categories':total_categories})
+	return render(request, "main/category/all.html", {'categories':categories_page, 'total_categories':total_categories, 'fragments': fragments})
 
 @login_required
 @permission_required('main.add_category', raise_exception=True)
@@ -89,15 +117,20 @@ def delete_category(request: HttpRequest, category_id):
 
 #===========[Supplier]===========
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def suppliers_view(request: HttpRequest):
+	fragments = TableFragments(request, "suppliers", perms=['main.change_supplier', 'main.delete_supplier'])
+	if fragments.complete:
+		return render(request, "main/supplier/all.html", {'fragments': fragments})
 	suppliers = Supplier.objects.all()
 	if 'search' in request.GET:
-		suppliers = suppliers.filter(Q(name__icontains=request.GET['search']))
+		suppliers = search_suppliers(suppliers, request.GET['search'])
 	total_suppliers = suppliers.count()
 	page_number = request.GET.get("page",1)
 	paginator = Paginator(suppliers,7)
 	suppliers_page = paginator.get_page(page_number)
-	return render(request, "main/supplier/all.html", {'suppliers':suppliers_page, 'total_suppliers':total_suppliers})
+	return render(request, "main/supplier/all.html", {'suppliers':suppliers_page, 'total_suppliers':total_suppliers, 'fragments': fragments})
 
 @login_required
 @permission_required('main.add_supplier', raise_exception=True)
@@ -137,9 +170,11 @@ def delete_supplier(request: HttpRequest, supplier_id):
 	return render(request, "main/supplier/delete.html",{"supplier":supplier})
 
 @login_required
+@conditional_on_versions(supplier_keys)
+@read_from_replica
 def supplier_detail(request: HttpRequest, supplier_id: int):
 	supplier = Supplier.objects.get(pk=supplier_id)
-	products = Product.objects.filter(stockentry__supplier=supplier).annotate(supplier_qty=Sum('stockentry__quantity', filter=Q(stockentry__supplier=supplier), default=0)).order_by('name')
+	products = Product.objects.filter(stockentry__supplier=supplier).select_related('category').annotate(supplier_qty=Sum('stockentry__quantity', filter=Q(stockentry__supplier=supplier), default=0)).order_by('name')
 	total_products = products.count()
 	stock_entries = StockEntry.objects.filter(supplier=supplier).select_related('product').order_by('-created_at')
 	total_entries = stock_entries.count()
@@ -151,26 +186,35 @@ def supplier_detail(request: HttpRequest, supplier_id: int):
 
 #===========[Product]===========
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def products_view(request: HttpRequest):
-	products = Product.objects.annotate(total_qty=Sum('stockentry__quantity', default=0))
+	fragments = TableFragments(request, "products", perms=['main.change_product', 'main.delete_product'])
+	if fragments.complete:
+		return render(request, "main/product/all.html", {'fragments': fragments})
+	products = Product.objects.select_related('category').annotate(total_qty=Coalesce('stock_level__on_hand', 0))
+	# Current stock over the demand of the last forecast (manage.py forecast_demand).
+	products = products.annotate(days_of_cover=ExpressionWrapper(Cast('total_qty', FloatField()) / F('forecast__daily_demand'), output_field=FloatField()))
 	if 'search' in request.GET:
 		search = request.GET['search']
-		products = products.filter(Q(name__icontains=search) | Q(sku__icontains=search))
-		if "order_by" in request.GET and request.GET["order_by"] == "category":
-			products = products.order_by("-category__name")
-		elif "order_by" in request.GET and request.GET["order_by"] == "created_at":
-			products = products.order_by("-created_at")
-	total_products = products.count()
-	page_number = request.GET.get("page",1)
-	paginator = Paginator(products,7)
-	products_page = paginator.get_page(page_number)
-	return render(request, "main/product/all.html", {'products':products_page, 'total_products':total_products})
+		products = search_products(products, search, rank=True)
+	ordering = ["created_at"]
+	if search_ranked(products) and "order_by" not in request.GET:
+		ordering = ["search_rank"]
+	elif "order_by" in request.GET and request.GET["order_by"] == "category":
+		ordering = ["-category__name"]
+	elif "order_by" in request.GET and request.GET["order_by"] == "created_at":
+		ordering = ["-created_at"]
+	products_page, total_products, total_is_estimate = paginate(request, products, 7, ordering)
+	return render(request, "main/product/all.html", {'products':products_page, 'total_products':total_products, 'total_is_estimate': total_is_estimate, 'fragments': fragments})
 
 @login_required
+@conditional_on_versions(product_keys)
+@read_from_replica
 def product_detail(request: HttpRequest, product_id):
-	product = Product.objects.get(pk=product_id)
+	product = Product.objects.select_related('category').get(pk=product_id)
 	stock_entries = StockEntry.objects.filter(product=product).select_related('supplier').order_by('-created_at')
-	total_qty = stock_entries.aggregate(total_qty=Sum('quantity'))['total_qty'] or 0
+	total_qty = _product_total_qty(product.id)
 	stock_status = "LOW" if hasattr(product, 'reorder_level') and total_qty < (product.reorder_level or 0) else "OK"
 	return render(request, "main/product/details.html", {'product': product,'stock_entries': stock_entries,'total_qty': total_qty,'stock_status': stock_status,})
 
@@ -217,20 +261,23 @@ def delete_product(request: HttpRequest, product_id):
 
 #===========[Stock Entry]===========
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def stock_entries_view(request: HttpRequest):
-	stock_entries = StockEntry.objects.all()
+	fragments = TableFragments(request, "stock_entries", perms=['main.change_stockentry', 'main.delete_stockentry'])
+	if fragments.complete:
+		return render(request, "main/stock_entry/all.html", {'fragments': fragments})
+	stock_entries = StockEntry.objects.select_related('product__category', 'supplier')
 	if 'search' in request.GET:
 		search = request.GET['search']
-		stock_entries = stock_entries.filter(product__name__icontains=search)
-		if "order_by" in request.GET and request.GET["order_by"] == "category":
-			stock_entries = stock_entries.order_by("-product__category__name")
-		elif "order_by" in request.GET and request.GET["order_by"] == "supplier":
-			stock_entries = stock_entries.order_by("-supplier__name")
-	total_stock_entries = stock_entries.count()
-	page_number = request.GET.get("page",1)
-	paginator = Paginator(stock_entries,7)
-	products_page = paginator.get_page(page_number)
-	return render(request, "main/stock_entry/all.html", {'stock_entries':products_page, 'total_stock_entries':total_stock_entries})
+		stock_entries = stock_entries.filter(product__in=search_products(Product.objects.all(), search))
+	ordering = ["-created_at"]
+	if "order_by" in request.GET and request.GET["order_by"] == "category":
+		ordering = ["-product__category__name"]
+	elif "order_by" in request.GET and request.GET["order_by"] == "supplier":
+		ordering = ["-supplier__name"]
+	entries_page, total_stock_entries, total_is_estimate = paginate(request, stock_entries, 7, ordering)
+	return render(request, "main/stock_entry/all.html", {'stock_entries':entries_page, 'total_stock_entries':total_stock_entries, 'total_is_estimate': total_is_estimate, 'fragments': fragments})
 
 @login_required
 @permission_required('main.add_stockentry', raise_exception=True)
@@ -241,14 +288,8 @@ def add_stock_entry(request: HttpRequest):
         stock_entry_form = StockEntryForm(request.POST)
         if stock_entry_form.is_valid():
             entry = stock_entry_form.save()
-            _maybe_low_stock(entry.product)
-            days = int(getattr(settings, "EXPIRY_ALERT_DAYS", 7))
-            if entry.quantity and entry.expiry_date:
-                if entry.expiry_date <= date.today() + timedelta(days=days) and not getattr(entry, "expiry_notified", False):
-                    _send_expiry_email(entry)
-                    if hasattr(entry, "expiry_notified"):
-                        entry.expiry_notified = True
-                        entry.save(update_fields=["expiry_notified"])
+            check_low_stock(entry.product)
+            check_expiry(entry)
             messages.success(request, "Created Stock Entry Successfully!")
             return redirect('main:stock_entries_view')
         else:
@@ -266,14 +307,8 @@ def edit_stock_entry(request: HttpRequest, stock_entry_id):
         stock_entry_form = StockEntryForm(request.POST, instance=stock_entry)
         if stock_entry_form.is_valid():
             entry = stock_entry_form.save()
-            _maybe_low_stock(entry.product)
-            days = int(getattr(settings, "EXPIRY_ALERT_DAYS", 7))
-            if entry.quantity and entry.expiry_date:
-                if entry.expiry_date <= date.today() + timedelta(days=days) and not getattr(entry, "expiry_notified", False):
-                    _send_expiry_email(entry)
-                    if hasattr(entry, "expiry_notified"):
-                        entry.expiry_notified = True
-                        entry.save(update_fields=["expiry_notified"])
+            check_low_stock(entry.product)
+            check_expiry(entry)
             messages.success(request, "Edit Stock Entry Successfully!")
             return redirect("main:stock_entries_view")
         else:
@@ -284,31 +319,56 @@ def edit_stock_entry(request: HttpRequest, stock_entry_id):
 @permission_required('main.add_stockwithdrawal', raise_exception=True)
 @permission_required('main.change_stockentry', raise_exception=True)
 def withdraw_stock_entry(request: HttpRequest, stock_entry_id):
-	stock_entry = StockEntry.objects.get(pk=stock_entry_id)
+	stock_entry = StockEntry.objects.select_related('product', 'supplier').get(pk=stock_entry_id)
 	if request.method == "POST":
 		withdraw_stock_form = StockWithdrawalForm(request.POST)
 		if withdraw_stock_form.is_valid():
-			withdrawal = withdraw_stock_form.save(commit=False)
-			withdrawal.stock_entry = stock_entry
-			withdrawal.product = stock_entry.product
-			qty = withdrawal.quantity or 0
+			data = withdraw_stock_form.cleaned_data
+			qty = data['quantity'] or 0
 			if qty <= 0:
 				messages.error(request, "Quantity must be greater than 0.")
-			elif stock_entry.quantity < qty:
-				messages.error(request, "Not enough quantity in this entry.")
 			else:
-				stock_entry.quantity = stock_entry.quantity - qty
-				stock_entry.save()
-				withdrawal.save()
-				_maybe_low_stock(stock_entry.product)
-				messages.success(request, "Withdrawal recorded and stock updated!")
-				return redirect("main:stock_entries_view")
+				try:
+					withdraw_from_entry(stock_entry, qty, reason=data['reason'], note=data['note'])
+				except InsufficientStock as e:
+					messages.error(request, str(e))
+				else:
+					check_low_stock(stock_entry.product)
+					messages.success(request, "Withdrawal recorded and stock updated!")
+					return redirect("main:stock_entries_view")
 		else:
 			print(withdraw_stock_form.errors)
 	else:
 		withdraw_stock_form = StockWithdrawalForm()
 	return render(request, "main/stock_entry/withdraw.html", {'stock_entry': stock_entry})
 
+@login_required
+@permission_required('main.add_stockwithdrawal', raise_exception=True)
+@permission_required('main.change_stockentry', raise_exception=True)
+def withdraw_product(request: HttpRequest, product_id):
+	product = Product.objects.get(pk=product_id)
+	total_qty = _product_total_qty(product.id)
+	if request.method == "POST":
+		withdraw_form = ProductWithdrawalForm(request.POST)
+		if withdraw_form.is_valid():
+			data = withdraw_form.cleaned_data
+			qty = data['quantity'] or 0
+			if qty <= 0:
+				messages.error(request, "Quantity must be greater than 0.")
+			else:
+				try:
+					withdrawals = withdraw_from_product(product, qty, reason=data['reason'], note=data['note'], strategy=data['strategy'])
+				except InsufficientStock as e:
+					messages.error(request, str(e))
+				else:
+					check_low_stock(product)
+					messages.success(request, f"Withdrew {qty} unit(s) across {len(withdrawals)} stock entries!")
+					return redirect("main:product_detail", product_id=product.id)
+		else:
+			for field, errors in withdraw_form.errors.items():
+				messages.error(request, f"{field.capitalize()}: {' '.join(errors)}")
+	return render(request, "main/product/withdraw.html", {'product': product, 'total_qty': total_qty, 'strategies': ALLOCATION_STRATEGIES})
+
 @login_required
 @permission_required('main.delete_stockentry', raise_exception=True)
 def delete_stock_entry(request: HttpRequest, stock_entry_id):
@@ -322,118 +382,278 @@ def delete_stock_entry(request: HttpRequest, stock_entry_id):
 	return render(request, "main/stock_entry/delete.html",{"stock_entry":stock_entry, 'products':products, 'suppliers':suppliers})
 
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def withdrawals_view(request: HttpRequest):
+	fragments = TableFragments(request, "withdrawals")
+	if fragments.complete:
+		return render(request, "main/stock_withdraw/all.html", {'fragments': fragments})
+	withdrawals, ordering = _withdrawals_queryset(request)
+	withdrawals_page, total_withdrawals, total_is_estimate = paginate(request, withdrawals.select_related('product__category', 'stock_entry__supplier'), 7, ordering)
+	return render(request, "main/stock_withdraw/all.html", {'withdrawals': withdrawals_page,'total_withdrawals': total_withdrawals, 'total_is_estimate': total_is_estimate, 'fragments': fragments})
+
+@login_required
+@read_from_replica
+def withdrawals_export(request: HttpRequest):
+	withdrawals, ordering = _withdrawals_queryset(request)
+	# The rows are read while streaming, after the view returns: bind the alias now.
+	rows = withdrawals.using(router.db_for_read(withdrawals.model)).order_by(*ordering, 'pk').values_list(
+		'created_at', 'product__sku', 'product__name', 'product__category__name', 'stock_entry__supplier__name', 'quantity', 'reason', 'note',
+	).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+	rows = ((timezone.localtime(created_at).strftime("%Y-%m-%d %H:%M:%S"), *rest) for created_at, *rest in rows)
+	return stream_csv("withdrawals.csv", ["Date", "SKU", "Product", "Category", "Supplier", "Quantity", "Reason", "Note"], rows)
+
+def _withdrawals_queryset(request: HttpRequest):
 	withdrawals = StockWithdrawal.objects.all()
 	if 'search' in request.GET:
 		search = request.GET['search']
-		withdrawals = withdrawals.filter(Q(product__name__icontains=search) | Q(product__sku__icontains=search))
-		if "order_by" in request.GET and request.GET["order_by"] == "date":
-			withdrawals = withdrawals.order_by("-created_at")
-		elif "order_by" in request.GET and request.GET["order_by"] == "product":
-			withdrawals = withdrawals.order_by("product__name")
-		elif "order_by" in request.GET and request.GET["order_by"] == "supplier":
-			withdrawals = withdrawals.order_by("stock_entry__supplier__name")
-		elif "order_by" in request.GET and request.GET["order_by"] == "reason":
-			withdrawals = withdrawals.order_by("reason")
-	total_withdrawals = withdrawals.count()
-	page_number = request.GET.get("page",1)
-	paginator = Paginator(withdrawals,7)
-	withdrawals_page = paginator.get_page(page_number)
-	return render(request, "main/stock_withdraw/all.html", {'withdrawals': withdrawals_page,'total_withdrawals': total_withdrawals})
+		withdrawals = withdrawals.filter(product__in=search_products(Product.objects.all(), search))
+	bounds = _day_bounds(request.GET.get('start'), request.GET.get('end'))
+	if bounds:
+		withdrawals = withdrawals.filter(created_at__gte=bounds[0], created_at__lt=bounds[1])
+	ordering = ["-created_at"]
+	if "order_by" in request.GET and request.GET["order_by"] == "product":
+		ordering = ["product__name"]
+	elif "order_by" in request.GET and request.GET["order_by"] == "supplier":
+		ordering = ["stock_entry__supplier__name"]
+	elif "order_by" in request.GET and request.GET["order_by"] == "reason":
+		ordering = ["reason"]
+	return withdrawals, ordering
 
 #===========[Reports]===========
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def inventory_report_view(request: HttpRequest):
+	fragments = TableFragments(request, "inventory_report")
+	if fragments.complete:
+		return render(request, "main/reports/inventory.html", {'fragments': fragments})
+	products, ordering = _inventory_report_queryset(request)
+	products_page, total_products, total_is_estimate = paginate(request, products.select_related('category'), 10, ordering)
+	return render(request, "main/reports/inventory.html", {'products': products_page,'total_products': total_products, 'total_is_estimate': total_is_estimate, 'fragments': fragments})
+
+@login_required
+@read_from_replica
+def inventory_report_export(request: HttpRequest):
+	products, ordering = _inventory_report_queryset(request)
+	# The rows are read while streaming, after the view returns: bind the alias now.
+	rows = products.using(router.db_for_read(products.model)).order_by(*ordering, 'pk').values_list(
+		'sku', 'name', 'category__name', 'current_stock', 'in_qty', 'out_qty', 'net_movement',
+	).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+	return stream_csv("inventory_report.csv", ["SKU", "Product", "Category", "Current Stock", "In Qty", "Out Qty", "Net Movement"], rows)
+
+def _inventory_report_queryset(request: HttpRequest):
 	products = Product.objects.all()
 	if 'search' in request.GET:
 		search = request.GET['search']
-		products = products.filter(Q(name__icontains=search) | Q(sku__icontains=search))
-	start = request.GET.get('start')
-	end = request.GET.get('end')
-	products = products.annotate(current_stock=Sum('stockentry__quantity', default=0))
-	if start and end:
-		products = products.annotate(in_qty=Sum('stockentry__initial_quantity', filter=Q(stockentry__created_at__date__range=[start, end]), default=0),out_qty=Sum('stockwithdrawal__quantity', filter=Q(stockwithdrawal__created_at__date__range=[start, end]), default=0),)
-	else:
-		products = products.annotate(in_qty=Sum('stockentry__initial_quantity', default=0),out_qty=Sum('stockwithdrawal__quantity', default=0),)
+		products = search_products(products, search, rank=True)
+	start = _parse_day(request.GET.get('start'))
+	end = _parse_day(request.GET.get('end'))
+	as_of = _parse_day(request.GET.get('as_of'))
+	products = products.annotate(
+		current_stock=_stock_as_of('product', as_of) if as_of else Coalesce('stock_level__on_hand', 0),
+		in_qty=_movement_total('in_qty', 'product', start, end),
+		out_qty=_movement_total('out_qty', 'product', start, end),
+	)
 	products = products.annotate(net_movement=F('in_qty') - F('out_qty'))
+	ordering = ["search_rank"] if search_ranked(products) else ["name"]
 	if 'order_by' in request.GET:
 		ob = request.GET['order_by']
-		if ob == "current": products = products.order_by("-current_stock")
-		elif ob == "in": products = products.order_by("-in_qty")
-		elif ob == "out": products = products.order_by("-out_qty")
-		elif ob == "net": products = products.order_by("-net_movement")
-		else: products = products.order_by("name")
-	else:
-		products = products.order_by("name")
-	total_products = products.count()
-	page_number = request.GET.get("page",1)
-	paginator = Paginator(products, 10)
-	products_page = paginator.get_page(page_number)
-	return render(request, "main/reports/inventory.html", {'products': products_page,'total_products': total_products,})
+		if ob == "current": ordering = ["-current_stock"]
+		elif ob == "in": ordering = ["-in_qty"]
+		elif ob == "out": ordering = ["-out_qty"]
+		elif ob == "net": ordering = ["-net_movement"]
+	return products, ordering
 
 @login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
 def supplier_report_view(request: HttpRequest):
+	fragments = TableFragments(request, "supplier_report")
+	if fragments.complete:
+		return render(request, "main/reports/suppliers.html", {'fragments': fragments})
+	suppliers, ordering = _supplier_report_queryset(request)
+	suppliers_page, total_suppliers, total_is_estimate = paginate(request, suppliers, 10, ordering)
+	return render(request, "main/reports/suppliers.html", {'suppliers': suppliers_page,'total_suppliers': total_suppliers, 'total_is_estimate': total_is_estimate, 'fragments': fragments})
+
+@login_required
+@read_from_replica
+def supplier_report_export(request: HttpRequest):
+	suppliers, ordering = _supplier_report_queryset(request)
+	# The rows are read while streaming, after the view returns: bind the alias now.
+	rows = suppliers.using(router.db_for_read(suppliers.model)).order_by(*ordering, 'pk').values_list(
+		'name', 'email', 'mobile', 'current_stock', 'in_qty', 'out_qty',
+	).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+	return stream_csv("supplier_report.csv", ["Supplier", "Email", "Mobile", "Current Stock", "In Qty", "Out Qty"], rows)
+
+def _supplier_report_queryset(request: HttpRequest):
 	suppliers = Supplier.objects.all()
 	if 'search' in request.GET:
 		search = request.GET['search']
-		suppliers = suppliers.filter(Q(name__icontains=search))
-	start = request.GET.get('start')
-	end = request.GET.get('end')
-	if start and end:
-		suppliers = suppliers.annotate(in_qty=Sum('stockentry__initial_quantity', filter=Q(stockentry__created_at__date__range=[start, end]), default=0),out_qty=Sum('stockentry__stockwithdrawal__quantity', filter=Q(stockentry__stockwithdrawal__created_at__date__range=[start, end]), default=0),current_stock=Sum('stockentry__quantity', default=0),)
-	else:
-		suppliers = suppliers.annotate(in_qty=Sum('stockentry__initial_quantity', default=0),out_qty=Sum('stockentry__stockwithdrawal__quantity', default=0),current_stock=Sum('stockentry__quantity', default=0),)
+		suppliers = search_suppliers(suppliers, search, rank=True)
+	start = _parse_day(request.GET.get('start'))
+	end = _parse_day(request.GET.get('end'))
+	current_stock = StockEntry.objects.filter(supplier=OuterRef('pk')).order_by().values('supplier').annotate(total=Sum('quantity')).values('total')
+	suppliers = suppliers.annotate(
+		in_qty=_movement_total('in_qty', 'supplier', start, end),
+		out_qty=_movement_total('out_qty', 'supplier', start, end),
+		current_stock=Coalesce(Subquery(current_stock), 0),
+	)
+	ordering = ["search_rank"] if search_ranked(suppliers) else ["name"]
 	if 'order_by' in request.GET:
 		ob = request.GET['order_by']
-		if ob == "current": suppliers = suppliers.order_by("-current_stock")
-		else: suppliers = suppliers.order_by("name")
-	else:
-		suppliers = suppliers.order_by("name")
-	total_suppliers = suppliers.count()
-	page_number = request.GET.get("page",1)
-	paginator = Paginator(suppliers, 10)
-	suppliers_page = paginator.get_page(page_number)
-	return render(request, "main/reports/suppliers.html", {'suppliers': suppliers_page,'total_suppliers': total_suppliers,})
+		if ob == "current": ordering = ["-current_stock"]
+		elif ob == "in": ordering = ["-in_qty"]
+		elif ob == "out": ordering = ["-out_qty"]
+	return suppliers, ordering
 
+@login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
+def valuation_report_view(request: HttpRequest):
+	valuation = _valuation(request)
+	group = valuation.group
+	lines_page = Paginator(valuation.lines, 25).get_page(request.GET.get('page', 1))
+	params = request.GET.copy()
+	params.pop('page', None)
+	return render(request, "main/reports/valuation.html", {'valuation': valuation, 'lines': lines_page, 'group': group, 'group_label': GROUPS[group], 'groups': GROUPS, 'methods': METHODS, 'query': params.urlencode()})
 
-# mail 
+@login_required
+@read_from_replica
+def valuation_report_export(request: HttpRequest):
+	valuation = _valuation(request)
+	group = valuation.group
+	header = [GROUPS[group]] + [f"{column.title()} {kind}" for column in COLUMNS for kind in ("Qty", "Value")]
+	rows = ([line.label] + [figure for column in COLUMNS for figure in (line.units[column], line.values[column])] for line in valuation.lines)
+	return stream_csv(f"valuation_{group}.csv", header, rows)
+
+def _valuation(request: HttpRequest):
+	method = request.GET.get('method') if request.GET.get('method') in METHODS else "fifo"
+	group = request.GET.get('group') if request.GET.get('group') in GROUPS else "products"
+	return cached_valuation(_parse_day(request.GET.get('start')), _parse_day(request.GET.get('end')), method, group)
 
-def _manager_to_list():
-	to = []
-	if getattr(settings, "MANAGER_EMAIL", None):
-		to.append(settings.MANAGER_EMAIL)
-	return to
+@login_required
+@conditional_on_versions(inventory_keys)
+@read_from_replica
+def forecast_report_view(request: HttpRequest):
+	fragments = TableFragments(request, "forecast_report")
+	if fragments.complete:
+		return render(request, "main/reports/forecast.html", {'fragments': fragments})
+	forecasts, ordering = _forecast_report_queryset(request)
+	forecasts_page, total_forecasts, total_is_estimate = paginate(request, forecasts.select_related('product__category'), 10, ordering)
+	computed_at = ProductForecast.objects.order_by('-computed_at').values_list('computed_at', flat=True).first()
+	return render(request, "main/reports/forecast.html", {'forecasts': forecasts_page, 'total_forecasts': total_forecasts, 'total_is_estimate': total_is_estimate, 'computed_at': computed_at, 'fragments': fragments})
+
+@login_required
+@read_from_replica
+def forecast_report_export(request: HttpRequest):
+	forecasts, ordering = _forecast_report_queryset(request)
+	# The rows are read while streaming, after the view returns: bind the alias now.
+	rows = forecasts.using(router.db_for_read(forecasts.model)).order_by(*ordering, 'pk').values_list(
+		'product__sku', 'product__name', 'on_hand', 'daily_demand', 'demand_std', 'days_of_cover', 'product__reorder_level', 'reorder_level', 'order_quantity',
+	).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+	return stream_csv("forecast_report.csv", ["SKU", "Product", "On Hand", "Daily Demand", "Demand Std Dev", "Days of Cover", "Reorder Level", "Suggested Reorder Level", "Suggested Order Qty"], rows)
+
+def _forecast_report_queryset(request: HttpRequest):
+	forecasts = ProductForecast.objects.all()
+	if 'search' in request.GET:
+		forecasts = forecasts.filter(product__in=search_products(Product.objects.all(), request.GET['search']))
+	ordering = ["days_of_cover"]
+	if 'order_by' in request.GET:
+		ob = request.GET['order_by']
+		if ob == "demand": ordering = ["-daily_demand"]
+		elif ob == "order": ordering = ["-order_quantity"]
+	return forecasts, ordering
+
+#===========[Import]===========
+IMPORT_PERMISSIONS = {
+	"products": "main.add_product",
+	"suppliers": "main.add_supplier",
+	"stock_entries": "main.add_stockentry",
+}
+
+@login_required
+def import_view(request: HttpRequest):
+	kinds = [kind for kind in IMPORTERS if request.user.has_perm(IMPORT_PERMISSIONS[kind])]
+	if not kinds:
+		raise PermissionDenied
+	kind = request.POST.get('kind') or request.GET.get('kind')
+	kind = kind if kind in kinds else kinds[0]
+	result = None
+	if request.method == "POST":
+		upload = request.FILES.get('file')
+		if upload is None:
+			messages.error(request, "Please choose a CSV file.")
+		else:
+			result = import_csv(kind, text_stream(upload.open('rb')))
+			if result.stopped:
+				kept = f"The {result.created} row(s) imported before the error were kept." if result.created else "Nothing was imported."
+				messages.error(request, f"{result.stopped} {kept}")
+			elif result.errors:
+				messages.warning(request, f"Imported {result.created} row(s), {len(result.errors)} rejected.")
+			else:
+				messages.success(request, f"Imported {result.created} row(s) successfully!")
+	return render(request, "main/import.html", {'kinds': kinds, 'kind': kind, 'result': result})
+
+#===========[Renditions]===========
+@login_required
+def rendition_view(request: HttpRequest, path):
+	"""
+	Development only, like the MEDIA_URL route: ``serve`` is neither fast nor
+	hardened. In production the web server should answer /renditions/ from
+	MEDIA_ROOT/renditions itself, with the same cache headers.
+	"""
+	# Rendition names carry their content hash, so a URL never changes meaning.
+	# Private: a shared cache would hand the image to anonymous clients.
+	response = serve(request, path, document_root=Path(settings.MEDIA_ROOT) / RENDITIONS_DIR)
+	patch_cache_control(response, private=True, max_age=365 * 24 * 3600, immutable=True)
+	return response
+
+#===========[Metrics]===========
+@login_required
+@user_passes_test(lambda user: user.is_staff)
+def metrics_view(request: HttpRequest):
+	if request.method == "POST":
+		reset_request_metrics()
+		messages.success(request, "Request metrics reset.")
+		return redirect("main:metrics_view")
+	return render(request, "main/metrics.html", {'rows': request_metrics(), 'enabled': getattr(settings, "REQUEST_METRICS_ENABLED", False)})
+
+
+def _parse_day(value):
+	try:
+		return parse_date(value or "")
+	except ValueError:
+		return None
+
+def _day_bounds(start, end):
+	"""Aware datetimes spanning the local days [start, end], or None unless both parse as dates."""
+	start, end = _parse_day(start), _parse_day(end)
+	if not (start and end):
+		return None
+	return (
+		timezone.make_aware(datetime.combine(start, time.min)),
+		timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+	)
+
+def _movement_total(column, owner, start=None, end=None):
+	"""Sum of one daily rollup column for the outer product or supplier, optionally within [start, end]."""
+	rows = StockMovementDaily.objects.filter(**{owner: OuterRef('pk')})
+	if start and end:
+		rows = rows.filter(date__range=[start, end])
+	return Coalesce(Subquery(rows.order_by().values(owner).annotate(total=Sum(column)).values('total')), 0)
+
+def _stock_as_of(owner, day):
+	"""Units on hand at the end of ``day`` for the outer product or supplier: the nearest snapshot plus the rollups since."""
+	base = StockSnapshot.base_date(day)
+	moves = StockMovementDaily.objects.filter(**{owner: OuterRef('pk')}, date__lte=day)
+	stock = Value(0)
+	if base:
+		moves = moves.filter(date__gt=base)
+		snapshot = StockSnapshot.objects.filter(**{owner: OuterRef('pk')}, date=base)
+		stock = Coalesce(Subquery(snapshot.order_by().values(owner).annotate(total=Sum('on_hand')).values('total')), 0)
+	delta = Subquery(moves.order_by().values(owner).annotate(total=Sum(F('in_qty') - F('out_qty'))).values('total'))
+	return stock + Coalesce(delta, 0)
 
 def _product_total_qty(product_id: int):
-	return Product.objects.filter(pk=product_id).aggregate(total=Sum('stockentry__quantity'))['total'] or 0
-
-def _send_low_stock_email(product, total_qty):
-	to = _manager_to_list()
-	if not to:
-		return
-	subject = f"[Stocker] Low stock: {product.name} ({product.sku})"
-	html = render_to_string("emails/low_stock.html", {"product": product, "total_qty": total_qty})
-	EmailMessage(subject, html, settings.DEFAULT_FROM_EMAIL, to).send(fail_silently=True)
-
-def _send_expiry_email(entry):
-	to = _manager_to_list()
-	if not to:
-		return
-	subject = f"[Stocker] Expiry approaching: {entry.product.name}"
-	html = render_to_string("emails/expiry_alert.html", {"entry": entry})
-	EmailMessage(subject, html, settings.DEFAULT_FROM_EMAIL, to).send(fail_silently=True)
-
-def _maybe_low_stock(product):
-	total_qty = _product_total_qty(product.id)
-	reorder = getattr(product, "reorder_level", 0) or 0
-	low = total_qty < reorder
-	notified = getattr(product, "low_stock_notified", False)
-	if low and not notified:
-		_send_low_stock_email(product, total_qty)
-		if hasattr(product, "low_stock_notified"):
-			product.low_stock_notified = True
-			product.save(update_fields=["low_stock_notified"])
-	elif not low and notified:
-		if hasattr(product, "low_stock_notified"):
-			product.low_stock_notified = False
-			product.save(update_fields=["low_stock_notified"])
+	return StockLevel.objects.filter(product_id=product_id).values_list('on_hand', flat=True).first() or 0